@@ -1,10 +1,14 @@
+import gevent
+import gevent.os
+import gevent.socket as socket
 from gevent.pywsgi import WSGIServer
 from geventwebsocket.handler import WebSocketHandler
 
 import logging
+import os
 import time
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from flask_sockets import Sockets
 
 from werkzeug.exceptions import default_exceptions, HTTPException
@@ -12,9 +16,17 @@ from werkzeug.exceptions import default_exceptions, HTTPException
 import ConfigParser
 
 from hearts.services.player import PlayerService
-
-from hearts.queue_backend import GameQueueBackend
-from hearts.game_backend import GameBackend
+from hearts.services.sqlite_player import SqlitePlayerService
+
+from hearts.queue_backend import GameQueueBackend, RatedGameQueueBackend
+from hearts.game_backend import GameBackend, DEFAULT_JOIN_TIMEOUT, DEFAULT_IDLE_TIMEOUT
+from hearts.game_master import DEFAULT_MAX_BATCH_SIZE, DEFAULT_BATCH_LINGER, \
+    DEFAULT_MAX_QUEUE_SIZE, DEFAULT_SLOW_CONSUMER_POLICY
+from hearts.journal import GameJournal
+from hearts.checkpoint import GameCheckpointer, DEFAULT_CHECKPOINT_INTERVAL, get_checkpointed_players
+from hearts.greenlets import spawn
+from hearts.metrics import REGISTRY
+from hearts.shard import ShardCoordinator, ShardClient, bind_unix_listener, get_coordinator_path
 
 from hearts.game_sockets import GameWebsocketHandler
 
@@ -26,6 +38,56 @@ main_host = config.get("Main", "host")
 main_port = config.getint("Main", "port")
 logfile = config.get("Main", "logfile")
 
+if config.has_option("Main", "matchmaking"):
+    matchmaking = config.get("Main", "matchmaking")
+else:
+    matchmaking = "fifo"
+
+if config.has_option("Main", "event_batch_size"):
+    event_batch_size = config.getint("Main", "event_batch_size")
+    event_batch_linger = config.getfloat("Main", "event_batch_linger")
+else:
+    event_batch_size = DEFAULT_MAX_BATCH_SIZE
+    event_batch_linger = DEFAULT_BATCH_LINGER
+
+if config.has_option("Main", "outbound_queue_size"):
+    outbound_queue_size = config.getint("Main", "outbound_queue_size")
+    slow_consumer_policy = config.get("Main", "slow_consumer_policy")
+else:
+    outbound_queue_size = DEFAULT_MAX_QUEUE_SIZE
+    slow_consumer_policy = DEFAULT_SLOW_CONSUMER_POLICY
+
+if config.has_option("Main", "game_join_timeout"):
+    game_join_timeout = config.getfloat("Main", "game_join_timeout")
+    game_idle_timeout = config.getfloat("Main", "game_idle_timeout")
+else:
+    game_join_timeout = DEFAULT_JOIN_TIMEOUT
+    game_idle_timeout = DEFAULT_IDLE_TIMEOUT
+
+if config.has_option("Main", "player_db"):
+    player_db_path = config.get("Main", "player_db")
+else:
+    player_db_path = ""
+
+if config.has_option("Main", "journal"):
+    journal_path = config.get("Main", "journal")
+else:
+    journal_path = ""
+
+if config.has_option("Main", "checkpoint"):
+    checkpoint_path = config.get("Main", "checkpoint")
+    checkpoint_interval = config.getfloat("Main", "checkpoint_interval")
+else:
+    checkpoint_path = ""
+    checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
+
+if config.has_option("Main", "workers"):
+    workers = config.getint("Main", "workers")
+    socket_dir = config.get("Main", "socket_dir")
+else:
+    workers = 1
+    socket_dir = ""
+
 app = Flask(__name__)
 
 if use_cors:
@@ -34,12 +96,118 @@ if use_cors:
 
 sockets = Sockets(app)
 
-player_svc = PlayerService()
 
-game_backend = GameBackend(player_svc)
-queue_backend = GameQueueBackend(game_backend)
+def _shard_path(path, shard_index):
+    # each worker keeps its own journal and checkpoint
+    if not path or shard_index is None:
+        return path
+    return "%s.%d" % (path, shard_index)
+
+
+def create_queue_backend(game_creator):
+    if matchmaking == "rated":
+        backend = RatedGameQueueBackend(game_creator)
+        backend.start(config.getfloat("Main", "match_tick_interval"))
+        return backend
+
+    return GameQueueBackend(game_creator)
+
+
+def create_services(shard_index=None):
+    """
+    Builds the backends for one server process.
+    With several workers this runs in each of them after forking,
+    so that they share no threads or greenlets.
+    """
+    global player_svc, journal, game_backend, queue_backend, shard_client, checkpointer, ws_handler
+
+    if shard_index is None:
+        first_id, id_step = 1, 1
+    else:
+        # keeps player ids unique across workers
+        first_id, id_step = shard_index + 1, workers
+
+    if player_db_path:
+        # With several workers a name has to be written before it is given out,
+        # or two workers could both give it to someone.
+        player_svc = SqlitePlayerService(
+            player_db_path,
+            first_id=first_id,
+            id_step=id_step,
+            write_through=workers > 1)
+    else:
+        player_svc = PlayerService(first_id=first_id, id_step=id_step)
+
+    journal = GameJournal(_shard_path(journal_path, shard_index)) if journal_path else None
+
+    game_backend = GameBackend(
+        player_svc,
+        event_batch_size,
+        event_batch_linger,
+        journal,
+        outbound_queue_size,
+        slow_consumer_policy,
+        game_join_timeout,
+        game_idle_timeout)
+
+    if shard_index is None:
+        shard_client = None
+        queue_backend = create_queue_backend(game_backend)
+    else:
+        shard_client = ShardClient(socket_dir, shard_index, game_backend, player_svc)
+        queue_backend = shard_client
+
+    if checkpoint_path:
+        checkpointer = GameCheckpointer(
+            _shard_path(checkpoint_path, shard_index),
+            game_backend,
+            checkpoint_interval)
+    else:
+        checkpointer = None
+
+    ws_handler = GameWebsocketHandler(player_svc, queue_backend, game_backend, shard_client)
+
 
-ws_handler = GameWebsocketHandler(player_svc, queue_backend, game_backend)
+if workers == 1:
+    create_services()
+
+
+def purge_guests():
+    """
+    Deletes the guests left in the player_db by the last run,
+    apart from those seated in a checkpointed game,
+    who can sign back in to it with their session token.
+    Runs before any worker is forked.
+    """
+    keep = set()
+    if checkpoint_path:
+        shards = [None] if workers == 1 else range(workers)
+        keep = get_checkpointed_players([_shard_path(checkpoint_path, x) for x in shards])
+
+    svc = SqlitePlayerService(player_db_path)
+    try:
+        purged = svc.purge_guests(keep)
+    finally:
+        svc.close()
+    logging.info("Deleted %d guests from the last run.", purged)
+
+
+REGISTRY.gauge(
+    "hearts_active_games",
+    "Games in progress in this process.",
+    func=lambda: game_backend.get_game_count())
+REGISTRY.gauge(
+    "hearts_queued_players",
+    "Players waiting for a game in this process.",
+    func=lambda: queue_backend.get_queue_size())
+REGISTRY.gauge(
+    "hearts_outbound_queued_events",
+    "Events waiting to be sent, summed over all connected players.",
+    func=lambda: sum(game_backend.get_outbound_queue_lengths()))
+REGISTRY.gauge(
+    "hearts_outbound_queue_max_length",
+    "Events waiting to be sent to the most backed up player.",
+    func=lambda: max(game_backend.get_outbound_queue_lengths() or [0]))
 
 
 class APIError(Exception):
@@ -66,6 +234,11 @@ for code in default_exceptions.iterkeys():
     app.error_handler_spec[None][code] = create_json_error
 
 
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4")
+
+
 @sockets.route("/play")
 def connect_to_queue(ws):
     try:
@@ -91,7 +264,67 @@ if __name__ == "__main__":
 
     app.debug = True
 
-    server = WSGIServer((main_host, main_port), app, handler_class=WebSocketHandler)
+    # Players are only kept across restarts in a player_db,
+    # so without one the players of restored games would all be forgotten.
+    if checkpoint_path and not player_db_path:
+        raise SystemExit("Restoring games from a checkpoint needs a player_db.")
+
+    if player_db_path:
+        purge_guests()
+
+    if workers == 1:
+        listener = (main_host, main_port)
+    else:
+        # Players have to be able to sign in on any worker.
+        if not player_db_path:
+            raise SystemExit("Running more than one worker needs a player_db.")
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((main_host, main_port))
+        listener.listen(128)
+
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+
+        # bound before forking, so workers can connect straight away
+        coordinator_listener = bind_unix_listener(get_coordinator_path(socket_dir))
+
+        children = []
+        for shard_index in range(workers):
+            pid = gevent.fork()
+            if pid == 0:
+                coordinator_listener.close()
+                create_services(shard_index)
+                break
+            children.append(pid)
+        else:
+            listener.close()
+
+            coordinator = ShardCoordinator(coordinator_listener, workers, create_queue_backend)
+            coordinator.start()
+            logging.info("Started %d workers.", workers)
+
+            # Ctrl-C reaches the workers too,
+            # so they shut down on their own.
+            while children:
+                try:
+                    gevent.os.waitpid(children[0], 0)
+                    children.pop(0)
+                except KeyboardInterrupt:
+                    logging.info("Interrupt recieved, waiting for workers to shut down.")
+
+            coordinator.stop()
+            raise SystemExit(0)
+
+    server = WSGIServer(listener, app, handler_class=WebSocketHandler, spawn=spawn)
+
+    if checkpointer is not None:
+        logging.info("Restored %d games from checkpoint.", checkpointer.restore())
+        checkpointer.start()
+
+    if shard_client is not None:
+        shard_client.start(ws_handler)
 
     logging.info("Server started.")
 
@@ -99,3 +332,14 @@ if __name__ == "__main__":
         server.serve_forever()
     except KeyboardInterrupt:
         logging.info("Interrupt recieved, server shutting down.")
+
+    if shard_client is not None:
+        shard_client.stop()
+
+    if checkpointer is not None:
+        checkpointer.stop()
+
+    if journal is not None:
+        journal.close()
+
+    player_svc.close()
@@ -0,0 +1,76 @@
+"""
+Per-message encode and decode cost of each available JSON codec
+and of the binary protocol,
+using the shapes of the messages we actually send and receive.
+
+    python -m benchmarks.codecs
+"""
+import argparse
+import sys
+
+import hearts.binary_protocol as binary
+import hearts.websocket_util as wsutil
+
+from benchmarks.hot_paths import _best_rate, _fixed_hands, _seated_master
+
+
+def _messages():
+    """
+    Returns a list of (name, message) for representative messages.
+    """
+    state = _seated_master()._serialize_game_state(0)
+
+    return [
+        ("play_card", {"type": "play_card", "player": 2, "card": "h10"}),
+        ("command_success", {"type": "command_success", "command_id": 12}),
+        ("start_round", {"type": "start_round", "round_number": 1, "hand": _fixed_hands()[0]}),
+        ("query_success", {"type": "query_success", "command_id": 12, "data": state}),
+        ("recv play_card", {"type": "play_card", "command_id": 12, "card": "h10"}),
+    ]
+
+
+def measure(codec, message, min_time=0.05, repeat=10):
+    """
+    Returns (encode usec, decode usec, encoded size) for one message.
+    """
+    dumps = codec.dumps
+    loads = codec.loads
+    wire_str = dumps(message)
+
+    def encode():
+        dumps(message)
+        return 1
+
+    def decode():
+        loads(wire_str)
+        return 1
+
+    encode_rate = _best_rate(encode, min_time, repeat)
+    decode_rate = _best_rate(decode, min_time, repeat)
+
+    return 1e6 / encode_rate, 1e6 / decode_rate, len(wire_str)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the websocket JSON codecs.")
+    parser.parse_args(argv)
+
+    out = sys.stdout
+    out.write("selected codec: %s\n" % wsutil.select_codec().name)
+    out.write("%-8s %-16s %12s %12s %8s\n" % ("codec", "message", "encode us", "decode us", "bytes"))
+
+    messages = _messages()
+    codecs = wsutil.get_available_codecs()
+    codecs.append(wsutil.JsonCodec("binary", binary.encode_message, binary.decode_message))
+
+    for codec in codecs:
+        for name, message in messages:
+            encode_usec, decode_usec, size = measure(codec, message)
+            out.write("%-8s %-16s %12.3f %12.3f %8d\n" % (
+                codec.name, name, encode_usec, decode_usec, size))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
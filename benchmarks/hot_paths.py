@@ -0,0 +1,451 @@
+"""
+Benchmarks for the per-move hot paths of the model and protocol layers.
+
+    python -m benchmarks.hot_paths                   # run and compare against baseline.json
+    python -m benchmarks.hot_paths --save-baseline   # record a new baseline
+    python -m benchmarks.hot_paths --json out.json   # also write machine-readable results
+
+Timings are only comparable on the same machine and interpreter,
+so re-record the baseline when either changes,
+and whenever a benchmark is added.
+Each benchmark is sampled several times, interleaved with a fixed
+calibration workload, and compared on the median of its speed
+relative to that workload.
+Exits with status 1 if any benchmark is slower than the baseline
+by more than the tolerance, or by more than a few times
+the noise measured for it, whichever is larger.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import hearts.util as u
+import hearts.websocket_util as wsutil
+from hearts.model.game import HeartsGame
+from hearts.model.preround import HeartsPreRound
+from hearts.model.round import HeartsRound
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+BENCHMARKS = []
+
+# Process CPU time is much less sensitive to other load
+# on the machine than wall clock time.
+_timer = getattr(time, "process_time", None) or time.clock
+
+
+def benchmark(name):
+    """
+    Registers a benchmark.
+
+    The decorated function does any setup and returns a callable
+    that performs the operation under test.
+    The callable returns the number of operations it performed.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+class _NullWebsocket(object):
+    def send(self, message, binary=None):
+        pass
+
+
+class _NullQueue(object):
+    def put_nowait(self, item):
+        pass
+
+    def qsize(self):
+        return 0
+
+
+def _fixed_hands(seed=0):
+    return u.deal_hands(random.Random(seed))
+
+
+def _round_moves(hands):
+    """
+    Returns a full round of legal moves for the given hands.
+    """
+    round = HeartsRound(hands)
+    moves = []
+    while any(round.hands):
+        player = round.get_current_player()
+        card = round.get_legal_moves(player)[0]
+        moves.append(card)
+        round.play_card(card)
+    return moves
+
+
+def _playing_game():
+    hands = _fixed_hands()
+    game = HeartsGame(deal_func=lambda: [list(h) for h in hands])
+    game.start()
+    for i in range(4):
+        game.pass_cards(i, game.get_hand(i)[:3])
+
+    # get a few tricks in so the state is representative
+    for _ in range(10):
+        player = game.get_current_player()
+        game.play_card(game.get_legal_moves(player)[0])
+
+    return game
+
+
+def _seated_master(ws=None):
+    """
+    Returns a GameMaster for a game in progress with all four seats taken.
+    """
+    from hearts.game_master import GameMaster
+
+    master = GameMaster(_playing_game(), 1)
+    for i in range(4):
+        master.attach(ws, "player%d" % i, i, _NullQueue())
+    return master
+
+
+@benchmark("util.deal_hands")
+def bench_deal_hands():
+    rng = random.Random(0)
+
+    def op():
+        u.deal_hands(rng)
+        return 1
+    return op
+
+
+@benchmark("util.find_winning_index")
+def bench_find_winning_index():
+    tricks = [["c2", "c10", "c9", "c8"], ["h2", "c10", "h6", "h4"], ["s5", "sq", "d1", "sk"]]
+
+    def op():
+        for trick in tricks:
+            u.find_winning_index(trick)
+        return len(tricks)
+    return op
+
+
+@benchmark("round.play_card")
+def bench_play_card():
+    hands = _fixed_hands()
+    moves = _round_moves(hands)
+
+    def op():
+        round = HeartsRound(hands)
+        for card in moves:
+            round.play_card(card)
+        return len(moves)
+    return op
+
+
+@benchmark("round._finish_trick")
+def bench_finish_trick():
+    round = HeartsRound(_fixed_hands())
+    trick = [
+        {"player": 0, "card": "c5"},
+        {"player": 1, "card": "c10"},
+        {"player": 2, "card": "h3"},
+        {"player": 3, "card": "ck"},
+    ]
+
+    def op():
+        round.trick = list(trick)
+        round._finish_trick()
+        return 1
+    return op
+
+
+@benchmark("preround.finish_passing")
+def bench_finish_passing():
+    hands = _fixed_hands()
+    passes = [hand[:3] for hand in hands]
+
+    def op():
+        preround = HeartsPreRound(hands)
+        for i, cards in enumerate(passes):
+            preround.pass_cards(i, cards)
+        preround.finish_passing()
+        return 1
+    return op
+
+
+@benchmark("game_master._serialize_game_state")
+def bench_serialize_game_state():
+    master = _seated_master()
+
+    def op():
+        master._serialize_game_state(0)
+        return 1
+    return op
+
+
+@benchmark("game_master.on_play_card")
+def bench_broadcast_play_card():
+    master = _seated_master()
+
+    def op():
+        master.on_play_card(2, "h10")
+        return 1
+    return op
+
+
+@benchmark("game_master.get_state (cached)")
+def bench_get_state_cached():
+    master = _seated_master(_NullWebsocket())
+    msg = {"type": "get_state", "command_id": 12}
+
+    def op():
+        master._receive_message(0, msg)
+        return 1
+    return op
+
+
+@benchmark("websocket_util.send_ws_event")
+def bench_send_ws_event():
+    ws = _NullWebsocket()
+    play_card = {"player": 2, "card": "h10"}
+
+    def op():
+        wsutil.send_ws_event(ws, "play_card", play_card)
+        wsutil.send_command_success(ws, 12)
+        return 2
+    return op
+
+
+@benchmark("websocket_util.send_query_success")
+def bench_send_query_success():
+    ws = _NullWebsocket()
+    state = _seated_master()._serialize_game_state(0)
+
+    def op():
+        wsutil.send_query_success(ws, 12, state)
+        return 1
+    return op
+
+
+def _calibration():
+    """
+    A fixed pure-Python workload.
+    Every benchmark is also reported relative to this,
+    which cancels out most of the drift in machine speed
+    (frequency scaling, noisy neighbours) between runs.
+    """
+    data = [{"player": i % 4, "card": card} for i, card in enumerate(u.DECK)]
+
+    def op():
+        total = 0
+        for item in data:
+            if item["card"][0] == "h":
+                total += item["player"]
+        return 1
+    return op
+
+
+def _calls_for(op, min_time):
+    """
+    Returns the number of calls to op that take at least min_time.
+    """
+    calls = 1
+    while True:
+        start = _timer()
+        for _ in range(calls):
+            op()
+        if _timer() - start >= min_time:
+            return calls
+        calls *= 2
+
+
+def _timed_rate(op, calls):
+    gc.collect()
+    start = _timer()
+    ops = 0
+    for _ in range(calls):
+        ops += op()
+    elapsed = _timer() - start
+    return ops / elapsed if elapsed else float("inf")
+
+
+def _best_rate(op, min_time, repeat):
+    calls = _calls_for(op, min_time)
+    return max(_timed_rate(op, calls) for _ in range(repeat))
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def run_benchmark(func, min_time=0.02, samples=11, repeat=3):
+    """
+    Takes samples pairs of timings, each of the calibration workload
+    immediately followed by the benchmark,
+    so that both see the same machine conditions.
+    The reported speeds are the medians over the samples,
+    and relative_spread is the median absolute deviation of
+    the relative speed as a fraction of it, which compare uses
+    as a measure of how noisy the benchmark is.
+    """
+    op = func()
+    calibration = _calibration()
+
+    op_calls = _calls_for(op, min_time)
+    calibration_calls = _calls_for(calibration, min_time)
+
+    rates = []
+    relatives = []
+    for _ in range(samples):
+        calibration_rate = max(_timed_rate(calibration, calibration_calls) for _ in range(repeat))
+        rate = max(_timed_rate(op, op_calls) for _ in range(repeat))
+        rates.append(rate)
+        relatives.append(rate / calibration_rate)
+
+    ops_per_sec = _median(rates)
+    relative_speed = _median(relatives)
+    spread = _median([abs(x - relative_speed) for x in relatives]) / relative_speed
+
+    # Count GC-tracked objects left behind per operation,
+    # which catches anything that retains state per move.
+    # Python 2 has no way to trace allocations that are freed again,
+    # so this is the only per-op memory figure we report.
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        retained_ops = 0
+        for _ in range(100):
+            retained_ops += op()
+        retained = len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+
+    return {
+        "ops_per_sec": ops_per_sec,
+        "usec_per_op": 1e6 / ops_per_sec,
+        "relative_speed": relative_speed,
+        "relative_spread": spread,
+        "retained_objects_per_op": float(max(retained, 0)) / retained_ops,
+    }
+
+
+def run_all(selected=None):
+    results = {}
+    for name, func in BENCHMARKS:
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = run_benchmark(func)
+    return results
+
+
+def allowed_slowdown(result, base, tolerance, noise_factor):
+    """
+    The slowdown, as a fraction, that is not counted as a regression:
+    the tolerance, or more for benchmarks whose
+    timings are noisier than that on this machine.
+    """
+    noise = result.get("relative_spread", 0) + base.get("relative_spread", 0)
+    return max(tolerance, noise_factor * noise)
+
+
+def compare(results, baseline, tolerance, noise_factor=3.0):
+    """
+    Returns a list of (name, current, baseline, ratio) for every
+    benchmark that is slower than the baseline by more than
+    allowed_slowdown, after correcting for the speed of the machine.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result["relative_speed"] / base["relative_speed"]
+        if ratio < 1.0 - allowed_slowdown(result, base, tolerance, noise_factor):
+            regressions.append((name, result["ops_per_sec"], base["ops_per_sec"], ratio))
+    return regressions
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+    }
+
+
+def _print_results(results, baseline, out):
+    out.write("%-38s %14s %10s %8s %10s %9s\n" % (
+        "benchmark", "ops/sec", "usec/op", "noise", "objs/op", "vs base"))
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        change = ""
+        if base is not None:
+            change = "%+.1f%%" % ((result["relative_speed"] / base["relative_speed"] - 1) * 100)
+
+        out.write("%-38s %14.1f %10.3f %7.1f%% %10.2f %9s\n" % (
+            name, result["ops_per_sec"], result["usec_per_op"], result["relative_spread"] * 100,
+            result["retained_objects_per_op"], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model and protocol hot paths.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="only run benchmarks whose name contains one of these")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to the baseline file instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline, as a fraction")
+    parser.add_argument("--noise-factor", type=float, default=3.0,
+                        help="allow slowdowns of up to this many times the measured noise")
+    parser.add_argument("--json", default=None,
+                        help="write results to this file as JSON")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.benchmarks)
+    report = {"environment": _environment(), "results": results}
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        _print_results(results, {}, sys.stdout)
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored.get("environment") != report["environment"]:
+            sys.stdout.write("warning: baseline was recorded on %s\n" % stored.get("environment"))
+
+    _print_results(results, baseline, sys.stdout)
+
+    missing = sorted(name for name in results if name not in baseline)
+    if missing:
+        sys.stdout.write("warning: not in the baseline, re-record it: %s\n" % ", ".join(missing))
+
+    regressions = compare(results, baseline, args.tolerance, args.noise_factor)
+    for name, current, base, ratio in regressions:
+        sys.stdout.write("REGRESSION %s: %.1f ops/sec vs baseline %.1f (%.0f%% of baseline speed)\n"
+                         % (name, current, base, ratio * 100))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
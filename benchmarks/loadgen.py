@@ -0,0 +1,333 @@
+"""
+Websocket load generator for the /play endpoint.
+
+Starts the server from app.py inside this process on localhost,
+then drives synthetic clients through auth, matchmaking and games.
+
+    python -m benchmarks.loadgen --clients 2000 --rate 200 --rounds 2
+
+Like app.py, this reads config.ini from the working directory.
+Requires the websocket-client package.
+
+The clients run in the same process as the server,
+so peak RSS and greenlet counts include the clients' share;
+the client greenlet count is reported separately so it can be subtracted.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import gc
+import json
+import logging
+import resource
+import sys
+import time
+
+import gevent
+import greenlet
+from gevent.pywsgi import WSGIServer
+from geventwebsocket.handler import WebSocketHandler
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = {
+            "auth": [],
+            "queue_to_game": [],
+            "play_card": [],
+            "get_state": [],
+        }
+        self.errors = {}
+        self.games_completed = 0
+        self.clients_finished = 0
+        self.peak_greenlets = 0
+
+    def record(self, kind, seconds):
+        self.latencies[kind].append(seconds)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class LoadClient(object):
+    def __init__(self, url, name, stats, rounds, idle_timeout):
+        self.url = url
+        self.name = name
+        self.stats = stats
+        self.rounds = rounds
+        self.idle_timeout = idle_timeout
+        self.ws = None
+        self._next_command_id = 1
+        self._pending = {}
+        self._index = None
+        self._state_requested = False
+        self._state_stale = False
+        self._making_move = False
+
+    def run(self):
+        try:
+            self.ws = websocket.create_connection(self.url)
+            self._authenticate()
+            self._wait_for_game()
+            self._play()
+        except websocket.WebSocketException:
+            self.stats.error("socket")
+        except Exception:
+            logging.exception("Client %s failed.", self.name)
+            self.stats.error("client")
+        finally:
+            if self.ws is not None:
+                self.ws.close()
+            self.stats.clients_finished += 1
+
+    def _send(self, kind, msg):
+        command_id = self._next_command_id
+        self._next_command_id += 1
+
+        msg["command_id"] = command_id
+        self._pending[command_id] = (kind, time.time())
+        self.ws.send(json.dumps(msg))
+        return command_id
+
+    def _receive(self, timeout=None):
+        self.ws.settimeout(timeout)
+        try:
+            data = self.ws.recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+
+        if not data:
+            raise websocket.WebSocketConnectionClosedException()
+
+        return [json.loads(data)]
+
+    def _complete(self, msg):
+        """
+        Matches a response to its command,
+        returning the kind of command it completed.
+        """
+        pending = self._pending.pop(msg.get("command_id"), None)
+        if pending is None:
+            return None
+
+        kind, sent_at = pending
+        if kind in self.stats.latencies:
+            self.stats.record(kind, time.time() - sent_at)
+
+        if msg["type"] == "command_fail":
+            self.stats.error(kind)
+
+        return kind
+
+    def _authenticate(self):
+        command_id = self._send("auth", {"type": "auth", "name": self.name})
+        while command_id in self._pending:
+            for msg in self._receive():
+                self._complete(msg)
+
+    def _wait_for_game(self):
+        start = time.time()
+        while True:
+            for msg in self._receive():
+                if msg["type"] == "connected_to_game":
+                    self.stats.record("queue_to_game", time.time() - start)
+                    return
+
+    def _request_state(self):
+        if self._state_requested:
+            # the response may predate whatever prompted this,
+            # so ask again once it arrives.
+            self._state_stale = True
+            return
+
+        self._state_requested = True
+        self._send("get_state", {"type": "get_state"})
+
+    def _play(self):
+        self._request_state()
+
+        while True:
+            messages = self._receive(self.idle_timeout)
+            if messages is None:
+                # Nothing has happened for a while.
+                # The game may have ended quietly.
+                self._request_state()
+                continue
+
+            for msg in messages:
+                msg_type = msg["type"]
+                if msg_type in ("command_success", "command_fail", "query_success"):
+                    kind = self._complete(msg)
+                    if kind == "get_state":
+                        self._state_requested = False
+                        if not self._on_state(msg["data"]):
+                            return
+                        if self._state_stale:
+                            self._state_stale = False
+                            self._request_state()
+                    elif kind == "get_legal_moves":
+                        if msg_type == "query_success" and msg["data"]:
+                            self._send("play_card", {"type": "play_card", "card": msg["data"][0]})
+                        else:
+                            self._making_move = False
+                    elif kind == "play_card":
+                        self._making_move = False
+                else:
+                    self._request_state()
+
+    def _on_state(self, state):
+        """
+        Acts on a game state.
+        Returns False once the client is done with the game.
+        """
+        if self._index is None:
+            self._index = state["players"].index(self.name)
+
+        if state["state"] == "game_over":
+            self.stats.games_completed += 1
+            return False
+
+        data = state["state_data"]
+        if self.rounds and data.get("round_number", 0) >= self.rounds:
+            return False
+
+        if state["state"] == "passing" and not data["have_passed"]:
+            self._send("pass_card", {"type": "pass_card", "cards": data["hand"][:3]})
+        elif (state["state"] == "playing" and data["current_player"] == self._index
+                and data["hand"] and not self._making_move):
+            self._making_move = True
+            self._send("get_legal_moves", {"type": "get_legal_moves"})
+
+        return True
+
+
+def _count_greenlets():
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet))
+
+
+def _monitor(stats, interval):
+    while True:
+        stats.peak_greenlets = max(stats.peak_greenlets, _count_greenlets())
+        gevent.sleep(interval)
+
+
+def _percentiles(values):
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))] * 1000
+
+    return {
+        "count": len(values),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def _raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run(clients, rate, rounds, idle_timeout, monitor_interval):
+    import app as server_app
+
+    server = WSGIServer(("127.0.0.1", 0), server_app.app, handler_class=WebSocketHandler, log=None)
+    server.start()
+    url = "ws://127.0.0.1:%d/play" % server.server_port
+
+    stats = Stats()
+    monitor = gevent.spawn(_monitor, stats, monitor_interval)
+
+    start = time.time()
+    greenlets = []
+    for i in range(clients):
+        client = LoadClient(url, "load%d" % i, stats, rounds, idle_timeout)
+        greenlets.append(gevent.spawn(client.run))
+        if rate:
+            gevent.sleep(1.0 / rate)
+
+    gevent.joinall(greenlets)
+    elapsed = time.time() - start
+
+    monitor.kill()
+    server.stop()
+
+    return {
+        "clients": clients,
+        "elapsed": elapsed,
+        "games_completed": stats.games_completed,
+        "errors": stats.errors,
+        "latency": dict((kind, _percentiles(values))
+                        for kind, values in stats.latencies.items()),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_greenlets": stats.peak_greenlets,
+        "client_greenlets": clients,
+    }
+
+
+def _print_report(report, out):
+    out.write("clients:          %d (%d tables)\n" % (report["clients"], report["clients"] // 4))
+    out.write("elapsed:          %.1fs\n" % report["elapsed"])
+    out.write("games completed:  %d\n" % report["games_completed"])
+    out.write("errors:           %s\n" % (report["errors"] or "none"))
+    out.write("peak RSS:         %.1f MB\n" % (report["peak_rss_kb"] / 1024.0))
+    out.write("peak greenlets:   %d (%d of them clients)\n"
+              % (report["peak_greenlets"], report["client_greenlets"]))
+    out.write("\n")
+    out.write("%-15s %8s %9s %9s %9s %9s\n" % ("latency", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for kind in ["auth", "queue_to_game", "play_card", "get_state"]:
+        p = report["latency"][kind]
+        if p is None:
+            out.write("%-15s %8d\n" % (kind, 0))
+            continue
+        out.write("%-15s %8d %9.2f %9.2f %9.2f %9.2f\n" % (
+            kind, p["count"], p["p50_ms"], p["p95_ms"], p["p99_ms"], p["max_ms"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive synthetic clients against the /play endpoint.")
+    parser.add_argument("-c", "--clients", type=int, default=400,
+                        help="number of clients, rounded down to whole tables")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="clients started per second, 0 to start them all at once")
+    parser.add_argument("--rounds", type=int, default=1,
+                        help="leave after this many rounds, 0 to play whole games")
+    parser.add_argument("--idle-timeout", type=float, default=3.0,
+                        help="seconds without events before a client re-polls the state")
+    parser.add_argument("--monitor-interval", type=float, default=1.0,
+                        help="seconds between greenlet counts")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if websocket is None:
+        parser.error("the websocket-client package is required")
+
+    _raise_fd_limit()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = run(args.clients - args.clients % 4, args.rate, args.rounds,
+                 args.idle_timeout, args.monitor_interval)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        _print_report(report, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Archive of finished games, built from game journals.
+
+Games are stored whole, one after another, in segment files,
+using the same record format as the journal.
+A separate index holds one fixed-size entry per game,
+sorted by game_id and then by the id of the server run
+the game was started in (see hearts.journal),
+since game ids are reused from one run to the next:
+
+    index   = "HRTSIDX2", u32 entry count, entry * count
+    entry   = u32 game_id, u64 run id, u16 segment number, u64 offset, u32 length
+
+Journals, segments and the index are all read through mmap,
+so looking up a game is a binary search over the index
+and reading it never copies the segment.
+
+    python -m hearts.archive build games.journal archive/
+    python -m hearts.archive show archive/ 1234
+    python -m hearts.archive show archive/ 1234 --run 1476712345000000
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+
+import hearts.journal as j
+import hearts.model.game as m
+import hearts.util as u
+
+
+INDEX_MAGIC = "HRTSIDX2"
+
+INDEX_NAME = "index.dat"
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+_index_header = struct.Struct(">8sI")
+_index_entry = struct.Struct(">IQHQI")
+
+_index_key = struct.Struct(">IQ")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _segment_name(number):
+    return "segment-%05d.dat" % number
+
+
+def iter_finished_games(journal_paths):
+    """
+    Yields (game_id, run_id, records) for every game in the journals
+    that finished or was abandoned,
+    where records is the game's encoded journal records.
+
+    Games that never finished, for example
+    because the server stopped, are skipped.
+    """
+    for path in journal_paths:
+        data = j.map_journal(path)
+        try:
+            for game in _iter_finished_games(data):
+                yield game
+        finally:
+            data.close()
+
+
+def _iter_finished_games(data):
+    # journals written before runs were recorded
+    run_id = 0
+
+    # game_id -> (run_id, list of encoded records)
+    in_progress = {}
+    for record_type, game_id, fields in j.decode_records(data):
+        if record_type == j.RUN_START:
+            # Games restored from a checkpoint carry on in the new run,
+            # so this does not end the ones in progress.
+            run_id = fields[0]
+            continue
+
+        encoded = j.encode_record(record_type, game_id, *fields)
+
+        if record_type == j.GAME_START:
+            # Game ids start again from 1 when the server restarts,
+            # so this replaces any game that never finished.
+            in_progress[game_id] = (run_id, [encoded])
+            continue
+
+        game = in_progress.get(game_id)
+        if game is None:
+            continue
+        game[1].append(encoded)
+
+        if record_type == j.GAME_OVER or record_type == j.ABANDONED:
+            del in_progress[game_id]
+            yield game_id, game[0], "".join(game[1])
+
+
+def build_archive(journal_paths, archive_dir, segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Writes every finished game in the journals to a new archive.
+    Returns the number of games archived.
+    """
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+
+    entries = []
+    segment_number = 0
+    segment = open(os.path.join(archive_dir, _segment_name(segment_number)), "wb")
+    offset = 0
+
+    try:
+        for game_id, run_id, data in iter_finished_games(journal_paths):
+            if offset > 0 and offset + len(data) > segment_size:
+                segment.close()
+                segment_number += 1
+                segment = open(os.path.join(archive_dir, _segment_name(segment_number)), "wb")
+                offset = 0
+
+            segment.write(data)
+            entries.append((game_id, run_id, segment_number, offset, len(data)))
+            offset += len(data)
+    finally:
+        segment.close()
+
+    # stable, so a game that somehow appears twice stays in journal order
+    entries.sort(key=lambda x: (x[0], x[1]))
+
+    with open(os.path.join(archive_dir, INDEX_NAME), "wb") as f:
+        f.write(_index_header.pack(INDEX_MAGIC, len(entries)))
+        for entry in entries:
+            f.write(_index_entry.pack(*entry))
+
+    return len(entries)
+
+
+class _IndexKeys(object):
+    """
+    Presents the (game_id, run_id) keys in the index as a sequence,
+    so that bisect can search the mmap directly.
+    """
+
+    def __init__(self, index, count):
+        self._index = index
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return _index_key.unpack_from(self._index, _index_header.size + (i * _index_entry.size))
+
+
+class ArchiveReader(object):
+    def __init__(self, archive_dir):
+        self._dir = archive_dir
+        self._segments = {}
+
+        f = open(os.path.join(archive_dir, INDEX_NAME), "rb")
+        try:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        magic, self._count = _index_header.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ArchiveError("Not an archive index: " + archive_dir)
+
+        self._keys = _IndexKeys(self._index, self._count)
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        for segment in self._segments.itervalues():
+            segment.close()
+        self._segments = {}
+        self._index.close()
+
+    def get_runs(self, game_id):
+        """
+        Returns the ids of the runs that had a game with this id,
+        oldest first.
+        """
+        pos = bisect.bisect_left(self._keys, (game_id,))
+        runs = []
+        while pos < self._count:
+            key = self._keys[pos]
+            if key[0] != game_id:
+                break
+            runs.append(key[1])
+            pos += 1
+        return runs
+
+    def get_game_data(self, game_id, run_id=None):
+        """
+        Returns a zero-copy buffer over the game's journal records,
+        or None if the game is not in the archive.
+        Without a run_id, the game from the latest run with that id is returned.
+        """
+        if run_id is None:
+            runs = self.get_runs(game_id)
+            if not runs:
+                return None
+            run_id = runs[-1]
+
+        # the last entry, should the same game somehow appear twice
+        pos = bisect.bisect_right(self._keys, (game_id, run_id)) - 1
+        if pos < 0 or self._keys[pos] != (game_id, run_id):
+            return None
+
+        return self._read_entry(pos)[2]
+
+    def get_game(self, game_id, run_id=None):
+        """
+        Returns the game's journal records as dicts,
+        or None if the game is not in the archive.
+        """
+        data = self.get_game_data(game_id, run_id)
+        if data is None:
+            return None
+
+        return _decode_game(data)
+
+    def iter_range(self, first_id=0, last_id=None):
+        """
+        Yields (game_id, run_id, buffer) for every game
+        with first_id <= game_id <= last_id, in game_id order.
+        The buffers point straight into the segment files.
+        """
+        pos = bisect.bisect_left(self._keys, (first_id,))
+        while pos < self._count:
+            game_id, run_id, data = self._read_entry(pos)
+            if last_id is not None and game_id > last_id:
+                return
+            yield game_id, run_id, data
+            pos += 1
+
+    def _read_entry(self, pos):
+        game_id, run_id, segment_number, offset, length = _index_entry.unpack_from(
+            self._index, _index_header.size + (pos * _index_entry.size))
+        segment = self._get_segment(segment_number)
+        return game_id, run_id, buffer(segment, offset, length)
+
+    def _get_segment(self, number):
+        segment = self._segments.get(number)
+        if segment is None:
+            f = open(os.path.join(self._dir, _segment_name(number)), "rb")
+            try:
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+            self._segments[number] = segment
+        return segment
+
+
+def _decode_game(data):
+    return [j.record_to_dict(record_type, game_id, fields)
+            for record_type, game_id, fields in j.decode_records(data)]
+
+
+def replay_game(records):
+    """
+    Rebuilds a HeartsGame from a game's journal records
+    by dealing from the recorded seed
+    and feeding the passes and plays back through the model.
+    """
+    if not records or records[0]["type"] != "game_start":
+        raise ArchiveError("Game history does not start with game_start")
+
+    rng = random.Random(records[0]["seed"])
+    game = m.HeartsGame(deal_func=lambda: u.deal_hands(rng))
+
+    for record in records[1:]:
+        record_type = record["type"]
+        if record_type == "start_round":
+            if game.get_state() == "init":
+                game.start()
+            else:
+                game.start_next_round()
+        elif record_type == "pass":
+            game.pass_cards(record["player"], record["cards"])
+        elif record_type == "play":
+            if game.get_current_player() != record["player"]:
+                raise ArchiveError("Play out of turn in game history")
+            game.play_card(record["card"])
+        elif record_type == "game_over":
+            game.end_game()
+
+    return game
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and read archives of finished games.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    build_parser = subparsers.add_parser("build", help="archive finished games from journals")
+    build_parser.add_argument("journals", nargs="+")
+    build_parser.add_argument("archive_dir")
+    build_parser.add_argument("--segment-size", type=int, default=DEFAULT_SEGMENT_SIZE,
+                              help="approximate maximum size of each segment file in bytes")
+
+    show_parser = subparsers.add_parser("show", help="print a game's history and replayed scores")
+    show_parser.add_argument("archive_dir")
+    show_parser.add_argument("game_id", type=int)
+    show_parser.add_argument("--run", type=int, default=None,
+                             help="the run the game was played in, if the id was used in several")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build_archive(args.journals, args.archive_dir, args.segment_size)
+        sys.stderr.write("archived %d games\n" % count)
+        return 0
+
+    reader = ArchiveReader(args.archive_dir)
+    try:
+        runs = reader.get_runs(args.game_id)
+        records = reader.get_game(args.game_id, args.run)
+    finally:
+        reader.close()
+
+    if args.run is None and len(runs) > 1:
+        sys.stderr.write("game %d was played in runs %s, showing the last; pick one with --run\n"
+                         % (args.game_id, ", ".join(str(x) for x in runs)))
+
+    if records is None:
+        sys.stderr.write("game %d is not in the archive\n" % args.game_id)
+        return 1
+
+    for record in records:
+        sys.stdout.write(json.dumps(record) + "\n")
+
+    game = replay_game(records)
+    sys.stdout.write(json.dumps({"replayed_scores": game.get_scores()}) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
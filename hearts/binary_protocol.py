@@ -0,0 +1,480 @@
+"""
+Compact binary wire protocol.
+
+An alternative to JSON for high-volume clients,
+selected by sending "protocol": "binary" in the auth message.
+Everything after the auth reply is then sent as binary websocket frames
+in both directions.
+
+A frame holds one or more messages, each prefixed by its length:
+
+    message = u16 length, u8 type code, body
+    body    = u8 field count, then (key, value) for each field
+
+Message types and common keys are sent as one-byte codes
+from MESSAGE_TYPES and FIELDS.
+A code of 0 means the name follows as a u8-length-prefixed string.
+Values are tagged with one byte, and cards are sent as their
+index in util.DECK.
+All integers are big-endian.
+
+This saves bandwidth, not CPU.
+The codec is pure Python, so even with its lookup tables
+a message costs several times as much to encode or decode
+as it does with ujson (see benchmarks.codecs).
+"""
+import struct
+
+import hearts.util as u
+
+
+# Codes are the index in these lists, starting from 1.
+# Only ever append to them, or existing clients will break.
+MESSAGE_TYPES = [
+    "auth",
+    "command_success",
+    "command_fail",
+    "query_success",
+    "play_card",
+    "pass_card",
+    "get_state",
+    "get_legal_moves",
+    "connected_to_game",
+    "player_connected",
+    "player_disconnected",
+    "start_round",
+    "finish_passing",
+    "get_state_changes",
+    "resync",
+    "game_state",
+]
+
+FIELDS = [
+    "command_id",
+    "card",
+    "cards",
+    "player",
+    "index",
+    "hand",
+    "data",
+    "round_number",
+    "received_cards",
+    "name",
+    "password",
+    "token",
+    "protocol",
+    "game_id",
+    "players",
+    "scores",
+    "state",
+    "state_data",
+    "trick",
+    "current_player",
+    "round_scores",
+    "is_hearts_broken",
+    "is_first_trick",
+    "pass_direction",
+    "have_passed",
+    "passed_cards",
+    "version",
+    "since_version",
+    "full",
+    "changes",
+    "removed",
+]
+
+MESSAGE_TYPE_CODES = dict((name, idx + 1) for idx, name in enumerate(MESSAGE_TYPES))
+
+FIELD_CODES = dict((name, idx + 1) for idx, name in enumerate(FIELDS))
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT8 = 3
+TAG_INT32 = 4
+TAG_INT64 = 5
+TAG_FLOAT = 6
+TAG_CARD = 7
+TAG_CARD_LIST = 8
+TAG_STRING = 9
+TAG_LIST = 10
+TAG_DICT = 11
+
+_u16 = struct.Struct(">H")
+_i8 = struct.Struct(">b")
+_i32 = struct.Struct(">i")
+_i64 = struct.Struct(">q")
+_f64 = struct.Struct(">d")
+
+_CARD_TAGS = dict((card, chr(TAG_CARD) + chr(idx)) for card, idx in u.CARD_INDICES.iteritems())
+
+# Lookup tables, so that encoding and decoding
+# mostly avoid building bytes or branching on tags one by one.
+_CHR = [chr(i) for i in range(256)]
+
+_TYPE_BYTES = dict((name, chr(code)) for name, code in MESSAGE_TYPE_CODES.iteritems())
+
+_FIELD_BYTES = dict((name, chr(code)) for name, code in FIELD_CODES.iteritems())
+
+_CARD_BYTES = dict((card, chr(idx)) for card, idx in u.CARD_INDICES.iteritems())
+
+_CARDS_BY_BYTE = dict((chr(idx), card) for card, idx in u.CARD_INDICES.iteritems())
+
+_SMALL_INTS = dict((i, chr(TAG_INT8) + _i8.pack(i)) for i in range(-0x80, 0x80))
+
+_INT8_BY_BYTE = dict((_i8.pack(i), i) for i in range(-0x80, 0x80))
+
+_NO_FIELDS = chr(0)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_message(message):
+    """
+    Encodes a message dict, which must have a "type",
+    into a length-prefixed message.
+    """
+    data = dict(message)
+    return encode_event(data.pop("type"), data)
+
+
+def encode_event(event_type, data=None):
+    """
+    Like websocket_util.encode_event,
+    but produces a binary message.
+    """
+    out = []
+
+    code = _TYPE_BYTES.get(event_type)
+    if code is None:
+        out.append(_NO_FIELDS)
+        _encode_name(out, event_type)
+    else:
+        out.append(code)
+
+    if data is None:
+        out.append(_NO_FIELDS)
+    else:
+        _encode_fields(out, data)
+
+    body = "".join(out)
+    if len(body) > 0xffff:
+        raise ProtocolError("Message too long")
+
+    return _u16.pack(len(body)) + body
+
+
+def encode_value(value):
+    """
+    Encodes a single tagged value,
+    for use with encode_query_success.
+    """
+    out = []
+    _encode_value(out, value)
+    return "".join(out)
+
+
+def encode_query_success(command_id, encoded_data):
+    """
+    Builds a query_success message around data
+    that has already been encoded with encode_value.
+    """
+    out = [_TYPE_BYTES["query_success"], _CHR[2], _FIELD_BYTES["command_id"]]
+    _encode_value(out, command_id)
+    out.append(_FIELD_BYTES["data"])
+    out.append(encoded_data)
+
+    body = "".join(out)
+    if len(body) > 0xffff:
+        raise ProtocolError("Message too long")
+
+    return _u16.pack(len(body)) + body
+
+
+def decode_frame(frame):
+    """
+    Decodes a frame into the list of messages it contains.
+    """
+    if isinstance(frame, bytearray):
+        frame = str(frame)
+
+    messages = []
+    pos = 0
+    try:
+        while pos < len(frame):
+            length, = _u16.unpack_from(frame, pos)
+            pos += 2
+            end = pos + length
+            if end > len(frame):
+                raise ProtocolError("Truncated message")
+
+            message, pos = _decode_message(frame, pos)
+            if pos != end:
+                raise ProtocolError("Message length mismatch")
+            messages.append(message)
+    except (struct.error, IndexError, KeyError, TypeError, UnicodeDecodeError):
+        raise ProtocolError("Malformed frame")
+
+    return messages
+
+
+def decode_message(frame):
+    """
+    Decodes a frame that must hold exactly one message.
+    """
+    messages = decode_frame(frame)
+    if len(messages) != 1:
+        raise ProtocolError("Expected one message, got %d" % len(messages))
+    return messages[0]
+
+
+def _encode_name(out, name):
+    data = name.encode("utf-8")
+    if len(data) > 0xff:
+        raise ProtocolError("Name too long")
+    out.append(_CHR[len(data)])
+    out.append(data)
+
+
+def _encode_fields(out, fields):
+    if len(fields) > 0xff:
+        raise ProtocolError("Too many fields")
+
+    append = out.append
+    append(_CHR[len(fields)])
+    for key, value in fields.iteritems():
+        code = _FIELD_BYTES.get(key)
+        if code is None:
+            append(_NO_FIELDS)
+            _encode_name(out, key)
+        else:
+            append(code)
+
+        # the commonest values are encoded inline
+        value_type = type(value)
+        if value_type is int:
+            encoded = _SMALL_INTS.get(value)
+            if encoded is not None:
+                append(encoded)
+                continue
+        elif value_type is str or value_type is unicode:
+            encoded = _CARD_TAGS.get(value)
+            if encoded is not None:
+                append(encoded)
+                continue
+        _encode_value(out, value)
+
+
+def _encode_value(out, value):
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        encoder = _find_encoder(value)
+    encoder(out, value)
+
+
+def _find_encoder(value):
+    # subclasses of the types in _ENCODERS
+    for value_type, encoder in _ENCODERS.iteritems():
+        if value_type is not bool and isinstance(value, value_type):
+            return encoder
+    raise ProtocolError("Cannot encode value of type " + type(value).__name__)
+
+
+def _encode_none(out, value):
+    out.append(_CHR[TAG_NONE])
+
+
+def _encode_bool(out, value):
+    out.append(_CHR[TAG_TRUE] if value else _CHR[TAG_FALSE])
+
+
+def _encode_int(out, value):
+    encoded = _SMALL_INTS.get(value)
+    if encoded is not None:
+        out.append(encoded)
+    elif -0x80000000 <= value < 0x80000000:
+        out.append(_CHR[TAG_INT32] + _i32.pack(value))
+    else:
+        out.append(_CHR[TAG_INT64] + _i64.pack(value))
+
+
+def _encode_float(out, value):
+    out.append(_CHR[TAG_FLOAT] + _f64.pack(value))
+
+
+def _encode_string(out, value):
+    card_tag = _CARD_TAGS.get(value)
+    if card_tag is not None:
+        out.append(card_tag)
+        return
+
+    data = value.encode("utf-8")
+    if len(data) > 0xffff:
+        raise ProtocolError("String too long")
+    out.append(_CHR[TAG_STRING] + _u16.pack(len(data)))
+    out.append(data)
+
+
+def _encode_list(out, value):
+    count = len(value)
+    if 0 < count <= 0xff and isinstance(value[0], basestring):
+        try:
+            card_bytes = "".join([_CARD_BYTES[x] for x in value])
+        except (KeyError, TypeError):
+            pass
+        else:
+            out.append(_CHR[TAG_CARD_LIST] + _CHR[count])
+            out.append(card_bytes)
+            return
+
+    if count > 0xffff:
+        raise ProtocolError("List too long")
+    out.append(_CHR[TAG_LIST] + _u16.pack(count))
+    for item in value:
+        _encode_value(out, item)
+
+
+def _encode_dict(out, value):
+    out.append(_CHR[TAG_DICT])
+    _encode_fields(out, value)
+
+
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    long: _encode_int,
+    float: _encode_float,
+    str: _encode_string,
+    unicode: _encode_string,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+}
+
+
+def _decode_message(frame, pos):
+    code = ord(frame[pos])
+    pos += 1
+    if code == 0:
+        message_type, pos = _decode_name(frame, pos)
+    else:
+        message_type = MESSAGE_TYPES[code - 1]
+
+    message, pos = _decode_fields(frame, pos)
+    message["type"] = message_type
+    return message, pos
+
+
+def _decode_name(frame, pos):
+    length = ord(frame[pos])
+    pos += 1
+    end = pos + length
+    if end > len(frame):
+        raise ProtocolError("Truncated name")
+    return frame[pos:end].decode("utf-8"), end
+
+
+def _decode_fields(frame, pos):
+    count = ord(frame[pos])
+    pos += 1
+
+    fields = {}
+    for _ in xrange(count):
+        code = ord(frame[pos])
+        pos += 1
+        if code == 0:
+            key, pos = _decode_name(frame, pos)
+        else:
+            key = FIELDS[code - 1]
+
+        # the commonest values are decoded inline
+        tag = ord(frame[pos])
+        if tag == TAG_CARD:
+            fields[key] = _CARDS_BY_BYTE[frame[pos + 1]]
+            pos += 2
+        elif tag == TAG_INT8:
+            fields[key] = _INT8_BY_BYTE[frame[pos + 1]]
+            pos += 2
+        else:
+            decoder = _DECODERS[tag]
+            if decoder is None:
+                raise ProtocolError("Unknown value tag: %d" % tag)
+            fields[key], pos = decoder(frame, pos + 1)
+
+    return fields, pos
+
+
+def _decode_value(frame, pos):
+    tag = ord(frame[pos])
+    decoder = _DECODERS[tag]
+    if decoder is None:
+        raise ProtocolError("Unknown value tag: %d" % tag)
+    return decoder(frame, pos + 1)
+
+
+def _decode_card(frame, pos):
+    return _CARDS_BY_BYTE[frame[pos]], pos + 1
+
+
+def _decode_int8(frame, pos):
+    return _INT8_BY_BYTE[frame[pos]], pos + 1
+
+
+def _decode_card_list(frame, pos):
+    end = pos + 1 + ord(frame[pos])
+    if end > len(frame):
+        raise ProtocolError("Truncated card list")
+    return [_CARDS_BY_BYTE[x] for x in frame[pos + 1:end]], end
+
+
+def _decode_string(frame, pos):
+    length, = _u16.unpack_from(frame, pos)
+    pos += 2
+    end = pos + length
+    if end > len(frame):
+        raise ProtocolError("Truncated string")
+    return frame[pos:end].decode("utf-8"), end
+
+
+def _decode_list(frame, pos):
+    count, = _u16.unpack_from(frame, pos)
+    pos += 2
+    items = []
+    for _ in xrange(count):
+        item, pos = _decode_value(frame, pos)
+        items.append(item)
+    return items, pos
+
+
+def _struct_decoder(packer):
+    unpack_from = packer.unpack_from
+    size = packer.size
+
+    def decode(frame, pos):
+        return unpack_from(frame, pos)[0], pos + size
+    return decode
+
+
+def _constant_decoder(value):
+    def decode(frame, pos):
+        return value, pos
+    return decode
+
+
+# tag -> function(frame, pos after the tag) returning (value, new pos)
+_DECODERS = [None] * 256
+_DECODERS[TAG_NONE] = _constant_decoder(None)
+_DECODERS[TAG_FALSE] = _constant_decoder(False)
+_DECODERS[TAG_TRUE] = _constant_decoder(True)
+_DECODERS[TAG_INT8] = _decode_int8
+_DECODERS[TAG_INT32] = _struct_decoder(_i32)
+_DECODERS[TAG_INT64] = _struct_decoder(_i64)
+_DECODERS[TAG_FLOAT] = _struct_decoder(_f64)
+_DECODERS[TAG_CARD] = _decode_card
+_DECODERS[TAG_CARD_LIST] = _decode_card_list
+_DECODERS[TAG_STRING] = _decode_string
+_DECODERS[TAG_LIST] = _decode_list
+_DECODERS[TAG_DICT] = _decode_fields
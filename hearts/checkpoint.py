@@ -0,0 +1,190 @@
+"""
+Periodic checkpoints of live games, so that they survive a restart.
+
+The checkpoint file is a log of JSON lines.
+Each line either holds a game's latest snapshot
+or records that a game has gone away:
+
+    {"game_id": 12, "players": [...], "seed": ..., "game": {...}}
+    {"game_id": 12, "removed": true}
+
+Each checkpoint only appends lines for the games
+that have changed since the previous one.
+When loading, the last line for each game wins.
+Once the log holds several times more lines than there are live games,
+it is compacted by writing out the live games to a new file
+and renaming it over the old one.
+"""
+import json
+import logging
+import os
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+from hearts.greenlets import spawn
+
+
+DEFAULT_CHECKPOINT_INTERVAL = 5
+
+# compact once the log is this many times the size it needs to be
+DEFAULT_COMPACT_RATIO = 4
+
+
+def load_checkpoint(path):
+    """
+    Returns a dict of game_id -> latest checkpoint record
+    for every game that was live when the checkpoint was written.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # torn write at the end of the log
+                break
+
+            if record.get("removed"):
+                records.pop(record["game_id"], None)
+            else:
+                records[record["game_id"]] = record
+
+    return records
+
+
+def get_checkpointed_players(paths):
+    """
+    Returns the set of ids of the players seated
+    in any game in the given checkpoint files.
+    """
+    players = set()
+    for path in paths:
+        for record in load_checkpoint(path).itervalues():
+            players.update(record["players"])
+    return players
+
+
+class GameCheckpointer(object):
+    """
+    Writes checkpoints of the games in a GameBackend
+    every interval seconds.
+    Files are written on a native thread,
+    so the gevent loop never waits for the disk.
+    """
+
+    def __init__(
+            self,
+            path,
+            game_backend,
+            interval=DEFAULT_CHECKPOINT_INTERVAL,
+            compact_ratio=DEFAULT_COMPACT_RATIO):
+        self.path = path
+        self._backend = game_backend
+        self._interval = interval
+        self._compact_ratio = compact_ratio
+        self._pool = ThreadPool(1)
+        self._greenlet = None
+        self._line_count = 0
+        self._live_games = set()
+        self._needs_compact = False
+        self.logger = logging.getLogger(__name__)
+
+    def restore(self):
+        """
+        Loads the checkpoint file into the backend.
+        Returns the number of games restored.
+        """
+        records = load_checkpoint(self.path)
+        self._backend.restore_games(records.values())
+
+        # start from a compact log of what we just restored
+        self._live_games = set(records.iterkeys())
+        lines = [json.dumps(x, separators=(",", ":")) + "\n" for x in records.itervalues()]
+        self._pool.apply(self._rewrite, ("".join(lines),))
+        self._line_count = len(lines)
+
+        return len(records)
+
+    def checkpoint(self):
+        """
+        Appends the games that have changed since the last checkpoint.
+        Blocks the calling greenlet until the write is done.
+        """
+        changed, removed = self._backend.collect_checkpoint()
+
+        # only updated once the write has succeeded
+        live_games = set(self._live_games)
+
+        lines = []
+        for game_id in removed:
+            if game_id in live_games:
+                live_games.remove(game_id)
+                lines.append(json.dumps({"game_id": game_id, "removed": True}) + "\n")
+
+        for record in changed:
+            live_games.add(record["game_id"])
+            lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+
+        # A failed append may have left a torn line,
+        # which would hide every line after it, so start afresh.
+        if self._needs_compact or \
+                self._line_count + len(lines) > self._compact_ratio * max(len(live_games), 1):
+            self._compact()
+            return
+
+        if lines:
+            self._needs_compact = True
+            self._pool.apply(self._append, ("".join(lines),))
+            self._needs_compact = False
+            self._line_count += len(lines)
+
+        self._live_games = live_games
+        self._backend.commit_checkpoint(changed, removed)
+
+    def start(self):
+        if self._greenlet is None:
+            self._greenlet = spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+        self.checkpoint()
+
+    def _compact(self):
+        records, removed = self._backend.collect_checkpoint(full=True)
+        lines = [json.dumps(x, separators=(",", ":")) + "\n" for x in records]
+        self._pool.apply(self._rewrite, ("".join(lines),))
+
+        self._needs_compact = False
+        self._live_games = set(x["game_id"] for x in records)
+        self._line_count = len(lines)
+        self._backend.commit_checkpoint(records, removed)
+
+    def _run(self):
+        while True:
+            gevent.sleep(self._interval)
+            try:
+                self.checkpoint()
+            except (IOError, OSError):
+                self.logger.error("Failed to write checkpoint.", exc_info=True)
+
+    # The methods below run on the writer thread.
+
+    def _append(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, data):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
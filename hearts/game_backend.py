@@ -1,38 +1,206 @@
 import hearts.model.game as m
-from hearts.game_master import GameMaster
+import hearts.util as u
+from hearts.game_master import GameMaster, DEFAULT_MAX_BATCH_SIZE, DEFAULT_BATCH_LINGER, \
+    DEFAULT_MAX_QUEUE_SIZE, DEFAULT_SLOW_CONSUMER_POLICY
+from hearts.journal import JournalRecorder
+from hearts.timer_wheel import TimerWheel
+from hearts.metrics import REGISTRY
 import logging
+import random
+import time
+
+
+# Seconds a new game waits for anyone to connect before it is reaped.
+DEFAULT_JOIN_TIMEOUT = 60
+
+# Seconds a game may go without any player activity before it is reaped.
+DEFAULT_IDLE_TIMEOUT = 600
+
+REAPED_GAMES = REGISTRY.counter(
+    "hearts_reaped_games_total",
+    "Games destroyed by the reaper, by reason.",
+    labels=("reason",))
+
+REAPED_PLAYERS = REGISTRY.counter(
+    "hearts_reaped_players_total",
+    "Player records and seat mappings freed by reaping games.")
 
 
 class GameBackend(object):
-    def __init__(self, player_svc):
+    def __init__(
+            self,
+            player_svc,
+            max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+            batch_linger=DEFAULT_BATCH_LINGER,
+            journal=None,
+            max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+            slow_consumer_policy=DEFAULT_SLOW_CONSUMER_POLICY,
+            join_timeout=DEFAULT_JOIN_TIMEOUT,
+            idle_timeout=DEFAULT_IDLE_TIMEOUT,
+            clock=time.time):
+        self._max_batch_size = max_batch_size
+        self._batch_linger = batch_linger
+        self._max_queue_size = max_queue_size
+        self._slow_consumer_policy = slow_consumer_policy
+        self._join_timeout = join_timeout
+        self._idle_timeout = idle_timeout
+
+        # One wheel holds the deadlines of every game,
+        # rather than each game having its own timers.
+        self._timers = TimerWheel(clock=clock)
+
+        # game_id -> Timer for the game's next reap check
+        self._reap_timers = {}
+
         self._next_game_id = 1
         self._game_masters = {}
         self._players = {}
         self._player_mapping = {}
         self._player_svc = player_svc
+        self._journal = journal
+        self._seed_rng = random.SystemRandom()
+        self._seeds = {}
+
+        # game_id -> state version at the last checkpoint
+        self._checkpoint_versions = {}
+        self._removed_since_checkpoint = []
+
+        self._observers = []
+
         self.logger = logging.getLogger(__name__)
 
-    def create_game(self, players):
-        game_id = self._next_game_id
-        self._next_game_id += 1
+    def add_observer(self, observer):
+        self._observers.append(observer)
 
-        model = m.HeartsGame()
-        model.start()
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
 
-        master = GameMaster(model, game_id)
-        self._game_masters[game_id] = master
-        master.add_observer(self)
+    def create_game(self, players, game_id=None):
+        """
+        Creates and starts a game for the given players.
+        The game_id is chosen by the backend unless one is given.
+        """
+        if game_id is None:
+            game_id = self._next_game_id
+        self._next_game_id = max(self._next_game_id, game_id + 1)
 
-        self._players[game_id] = list(players)
+        # Each game deals from its own seeded generator,
+        # so that the journal can record the seed instead of every hand.
+        seed = self._seed_rng.getrandbits(64)
+        rng = random.Random(seed)
+        model = m.HeartsGame(deal_func=lambda: u.deal_hands(rng))
 
-        for idx, player_id in enumerate(players):
-            self._player_mapping[player_id] = (game_id, idx)
+        if self._journal is not None:
+            self._journal.record_game_start(game_id, seed, players)
+            model.add_observer(JournalRecorder(self._journal, game_id, model))
+
+        model.start()
+
+        self._add_game(game_id, model, players, seed)
 
         return game_id
 
+    def collect_checkpoint(self, full=False):
+        """
+        Returns a list of checkpoint records for the games
+        that have changed since the last committed checkpoint,
+        or for every game if full is set,
+        and a list of the ids of games that have ended since.
+        Nothing is marked as written until commit_checkpoint,
+        so a checkpoint that fails to write is collected again next time.
+        """
+        records = []
+        for game_id, master in self._game_masters.iteritems():
+            version = master.get_state_version()
+            if not full and self._checkpoint_versions.get(game_id) == version:
+                continue
+
+            records.append({
+                "game_id": game_id,
+                "version": version,
+                "players": self._players[game_id],
+                "seed": self._seeds[game_id],
+                "game": master.get_game_snapshot(),
+            })
+
+        return records, list(self._removed_since_checkpoint)
+
+    def commit_checkpoint(self, records, removed):
+        """
+        Marks the records and removals from collect_checkpoint as written.
+        """
+        for record in records:
+            game_id = record["game_id"]
+            # the game may have ended while the checkpoint was written
+            if game_id in self._game_masters:
+                self._checkpoint_versions[game_id] = record["version"]
+
+        removed = set(removed)
+        self._removed_since_checkpoint = [x for x in self._removed_since_checkpoint if x not in removed]
+
+    def restore_games(self, records):
+        """
+        Recreates games from checkpoint records,
+        so that their players can reconnect to the same game and seat.
+
+        Only players that still exist get their seat back,
+        which guests do if they were kept in the player_db.
+        The seats of any others stay empty,
+        and their ids are never handed out again.
+        """
+        records = list(records)
+        player_ids = [p for record in records for p in record["players"]]
+        if player_ids:
+            self._player_svc.reserve_ids(max(player_ids))
+
+        for record in records:
+            game_id = record["game_id"]
+            seed = record["seed"]
+            snapshot = record["game"]
+
+            # Deal the rounds already played again,
+            # so that later rounds get the same hands they would have.
+            rng = random.Random(seed)
+            for _ in range(snapshot["current_round"] + 1):
+                u.deal_hands(rng)
+
+            model = m.HeartsGame.from_snapshot(snapshot, deal_func=lambda rng=rng: u.deal_hands(rng))
+
+            if self._journal is not None:
+                model.add_observer(JournalRecorder(self._journal, game_id, model))
+
+            master = self._add_game(game_id, model, record["players"], seed)
+            for player_id in record["players"]:
+                if self._player_svc.get_player(player_id) is None:
+                    del self._player_mapping[player_id]
+            master.resume()
+
+            self._next_game_id = max(self._next_game_id, game_id + 1)
+            self.logger.info("Restored game %d.", game_id)
+
     def get_game_master(self, game_id):
         return self._game_masters[game_id]
 
+    def get_game_count(self):
+        return len(self._game_masters)
+
+    def get_outbound_queue_lengths(self):
+        """
+        Returns the number of events waiting to be sent
+        to each connected player, across all games.
+        """
+        lengths = []
+        for master in self._game_masters.itervalues():
+            lengths.extend(master.get_outbound_queue_lengths())
+        return lengths
+
+    def get_games(self):
+        """
+        Returns a dict of game_id -> list of player ids
+        for every live game.
+        """
+        return dict((game_id, list(players)) for game_id, players in self._players.iteritems())
+
     def try_get_player_game(self, player_id):
         data = self._player_mapping.get(player_id)
         if data is None:
@@ -56,12 +224,79 @@ class GameBackend(object):
 
     def on_game_abandoned(self, game_id):
         self.logger.info("Game %d has been abandoned.", game_id)
+        if self._journal is not None:
+            self._journal.record_abandoned(game_id)
         self._destruct_game(game_id)
 
+    def _check_reap(self, game_id):
+        """
+        Destroys the game if it has been idle for too long,
+        or checks again when it next could be.
+        Activity doesn't touch the timer,
+        so busy games cost one check per timeout.
+        """
+        master = self._game_masters[game_id]
+        if master.has_had_players():
+            reason, timeout = "idle", self._idle_timeout
+        else:
+            reason, timeout = "never_joined", self._join_timeout
+
+        idle_for = self._timers.now() - master.get_last_activity()
+        if idle_for < timeout:
+            self._reap_timers[game_id] = self._timers.schedule(timeout - idle_for, self._check_reap, game_id)
+            return
+
+        del self._reap_timers[game_id]
+        players = len(self._players[game_id])
+        self.logger.info(
+            "Reaping game %d (%s for %d seconds), freeing %d players.",
+            game_id, reason, idle_for, players)
+        REAPED_GAMES.labels(reason).inc()
+        REAPED_PLAYERS.inc(players)
+
+        master.disconnect_all()
+        self.on_game_abandoned(game_id)
+
+    def _add_game(self, game_id, model, players, seed):
+        master = GameMaster(
+            model,
+            game_id,
+            self._max_batch_size,
+            self._batch_linger,
+            self._max_queue_size,
+            self._slow_consumer_policy,
+            self._timers)
+        self._game_masters[game_id] = master
+        master.add_observer(self)
+
+        self._players[game_id] = list(players)
+        self._seeds[game_id] = seed
+
+        for idx, player_id in enumerate(players):
+            self._player_mapping[player_id] = (game_id, idx)
+
+        self._reap_timers[game_id] = self._timers.schedule(self._join_timeout, self._check_reap, game_id)
+
+        return master
+
     def _destruct_game(self, game_id):
         for player in self._players[game_id]:
-            del self._player_mapping[player]
-            self._player_svc.remove_player(player)
+            # Players of a restored game may not exist any more,
+            # for example guests from before a restart,
+            # and then their seat was never mapped.
+            self._player_mapping.pop(player, None)
+            if self._player_svc.get_player(player) is not None:
+                self._player_svc.remove_player(player)
 
         del self._players[game_id]
-        del self._game_masters[game_id]
\ No newline at end of file
+        self._game_masters.pop(game_id).close()
+
+        reap_timer = self._reap_timers.pop(game_id, None)
+        if reap_timer is not None:
+            reap_timer.cancel()
+        del self._seeds[game_id]
+        self._checkpoint_versions.pop(game_id, None)
+        self._removed_since_checkpoint.append(game_id)
+
+        for observer in self._observers:
+            observer.on_game_removed(game_id)
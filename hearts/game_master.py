@@ -1,25 +1,160 @@
+from collections import OrderedDict
 from hearts.model.exceptions import GameStateError
+from hearts.greenlets import spawn
+from hearts.metrics import REGISTRY
+from hearts.timer_wheel import TimerWheel
 import gevent
 import gevent.queue as gq
 import hearts.websocket_util as wsutil
 import logging
+import time
 
 
 class PlayerAlreadyConnectedError(Exception):
     pass
 
 
-def _consume_events(ws, queue):
-        for item in queue:
-            wsutil.send_ws_event(ws, item[0], item[1])
+DEFAULT_MAX_BATCH_SIZE = 16
+
+DEFAULT_BATCH_LINGER = 0
+
+# Seconds between the last card of a round and the next round starting.
+ROUND_END_DELAY = 2
+
+# How many past state snapshots to keep per player
+# for answering get_state_changes.
+MAX_STATE_HISTORY = 16
+
+RECEIVE_MESSAGE_SECONDS = REGISTRY.histogram(
+    "hearts_receive_message_seconds",
+    "Time taken to handle a message from a player, by message type.",
+    labels=("type",))
+
+# How many events may wait to be sent to a player
+# before the slow consumer policy kicks in.
+DEFAULT_MAX_QUEUE_SIZE = 256
+
+# What to do when a player's outbound queue is full:
+#   resync     - drop the backlog, send a "resync" event
+#                and send nothing more until the client asks for its state
+#   coalesce   - replace the backlog with one "game_state" event
+#                holding the player's current state
+#   disconnect - close the player's connection
+SLOW_CONSUMER_POLICIES = ("resync", "coalesce", "disconnect")
+
+DEFAULT_SLOW_CONSUMER_POLICY = "resync"
+
+OUTBOUND_QUEUE_HIGH_WATER = REGISTRY.gauge(
+    "hearts_outbound_queue_high_water",
+    "Longest any player's outbound event queue has been.")
+
+OUTBOUND_QUEUE_OVERFLOWS = REGISTRY.counter(
+    "hearts_outbound_queue_overflows_total",
+    "Times a player's outbound event queue filled up, by the policy applied.",
+    labels=("policy",))
+
+_MESSAGE_TYPES = frozenset(["play_card", "pass_card", "get_state", "get_state_changes", "get_legal_moves"])
+
+
+def _drain(queue, frames, max_batch_size):
+    while len(frames) < max_batch_size:
+        try:
+            frames.append(queue.get_nowait())
+        except gq.Empty:
+            return
+
+
+def _consume_events(ws, queue, protocol, max_batch_size=1, linger=0):
+        if protocol.join_frames is None:
+            max_batch_size = 1
+
+        for frame in queue:
+            if max_batch_size <= 1:
+                wsutil.send_ws_frame(ws, frame, protocol)
+                continue
+
+            # Send whatever else is already waiting in the same frame,
+            # optionally waiting a little for more to arrive.
+            frames = [frame]
+            _drain(queue, frames, max_batch_size)
+            if linger > 0 and len(frames) < max_batch_size:
+                gevent.sleep(linger)
+                _drain(queue, frames, max_batch_size)
+
+            if len(frames) == 1:
+                wsutil.send_ws_frame(ws, frame, protocol)
+            else:
+                wsutil.send_ws_frame(ws, protocol.join_frames(frames), protocol)
+
+
+def _diff_state(old, new):
+    """
+    Returns the top-level fields and state_data entries
+    that differ between two serialized states,
+    plus the state_data entries that have gone away.
+    """
+    changes = {}
+    for key, value in new.iteritems():
+        if key != "state_data" and key != "version" and old.get(key) != value:
+            changes[key] = value
+
+    old_data = old["state_data"]
+    new_data = new["state_data"]
+
+    data_changes = {}
+    for key, value in new_data.iteritems():
+        if key not in old_data or old_data[key] != value:
+            data_changes[key] = value
+
+    removed = [key for key in old_data if key not in new_data]
+
+    return {
+        "version": new["version"],
+        "changes": changes,
+        "state_data": data_changes,
+        "removed": removed,
+    }
 
 
 class GameMaster(object):
-    def __init__(self, game, game_id):
+    def __init__(
+            self,
+            game,
+            game_id,
+            max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+            batch_linger=DEFAULT_BATCH_LINGER,
+            max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+            slow_consumer_policy=DEFAULT_SLOW_CONSUMER_POLICY,
+            timers=None):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError("Unknown slow consumer policy: " + slow_consumer_policy)
+
         self._game_id = game_id
         self._game = game
+        self._max_batch_size = max_batch_size
+        self._batch_linger = batch_linger
+        self._max_queue_size = max_queue_size
+        self._slow_consumer_policy = slow_consumer_policy
+
+        # Normally shared by every game in the backend.
+        self._timers = TimerWheel() if timers is None else timers
+        self._round_timer = None
+
+        # for reaping games nobody joins or that go quiet
+        self._last_activity = self._timers.now()
+        self._has_had_players = False
         self._players = [None, None, None, None]
         self._observers = []
+
+        # Bumped whenever anything visible through get_state changes.
+        self._state_version = 0
+
+        # player index -> OrderedDict of version -> state sent at that version
+        self._state_history = [OrderedDict() for _ in range(4)]
+
+        # player index -> (version, {protocol name -> encoded state})
+        self._encoded_states = [(None, {}) for _ in range(4)]
+
         self.logger = logging.getLogger(__name__)
 
         game.add_observer(self)
@@ -30,38 +165,132 @@ class GameMaster(object):
     def remove_observer(self, observer):
         self._observers.remove(observer)
 
-    def connect(self, ws, player_name, player_index):
-        if self._players[player_index] is not None:
-            raise PlayerAlreadyConnectedError()
+    def connect(self, ws, player_name, player_index, protocol=wsutil.JSON_PROTOCOL):
+        queue = gq.Queue(self._max_queue_size)
+        player = self.attach(ws, player_name, player_index, queue, protocol)
+        queue_greenlet = spawn(
+            _consume_events,
+            ws,
+            queue,
+            protocol,
+            self._max_batch_size,
+            self._batch_linger)
 
-        queue = gq.Queue()
-        queue_greenlet = gevent.spawn(_consume_events, ws, queue)
-        self._players[player_index] = {
-            "ws": ws,
-            "name": player_name,
-            "queue": queue,
-        }
-
-        wsutil.send_ws_event(ws, "connected_to_game")
+        wsutil.send_ws_event(ws, "connected_to_game", protocol=protocol)
 
         self._on_connect(player_index, player_name)
 
         try:
             while True:
-                msg = wsutil.receive_ws_event(ws)
+                try:
+                    msg = wsutil.receive_ws_event(ws, protocol)
+                except Exception:
+                    # A frame we cannot decode, or a broken connection.
+                    # Either way we cannot carry on with this client,
+                    # so free up their seat rather than leave it taken.
+                    if self._players[player_index] is player:
+                        self.logger.warning(
+                            "Disconnecting player %d: failed to receive a message.",
+                            player_index,
+                            exc_info=True)
+                    msg = None
+
+                if self._players[player_index] is not player:
+                    # dropped as a slow consumer, see _on_queue_full
+                    return
+
                 if msg is None:
                     self._players[player_index] = None
                     self._on_disconnect(player_index)
                     return
-                else:
+
+                try:
                     self._receive_message(player_index, msg)
+                except Exception:
+                    # A message we failed to handle.
+                    # Free up the seat, as for one we failed to receive,
+                    # so that the player can connect again.
+                    self.logger.error(
+                        "Disconnecting player %d: failed to handle a message.",
+                        player_index,
+                        exc_info=True)
+                    if self._players[player_index] is player:
+                        self._players[player_index] = None
+                        self._on_disconnect(player_index)
+                    return
         finally:
             queue_greenlet.kill()
 
+    def attach(self, ws, player_name, player_index, queue, protocol=wsutil.JSON_PROTOCOL):
+        """
+        Seats a player without telling anyone or reading from ws.
+        Events for the player are put on queue, for the caller to send.
+        connect does this and then serves the player until they leave.
+        """
+        if self._players[player_index] is not None:
+            raise PlayerAlreadyConnectedError()
+
+        player = {
+            "ws": ws,
+            "name": player_name,
+            "queue": queue,
+            "protocol": protocol,
+            "awaiting_resync": False,
+        }
+        self._players[player_index] = player
+        return player
+
     def is_connected(self, player_index):
         return self._players[player_index] is not None
 
+    def get_state_version(self):
+        return self._state_version
+
+    def get_game_snapshot(self):
+        return self._game.get_snapshot()
+
+    def resume(self):
+        """
+        Picks a restored game back up where it was left.
+        """
+        if self._game.is_round_finished():
+            # we were waiting to start the next round
+            self._round_timer = self._timers.schedule(ROUND_END_DELAY, self._continue_post_round)
+
+    def get_last_activity(self):
+        """
+        Returns when a player last connected, disconnected or sent a message.
+        """
+        return self._last_activity
+
+    def has_had_players(self):
+        """
+        Returns true once any player has connected.
+        """
+        return self._has_had_players
+
+    def disconnect_all(self):
+        """
+        Closes every player's connection without telling the others,
+        for when the game itself is going away.
+        """
+        for idx, player in enumerate(self._players):
+            if player is not None:
+                self._players[idx] = None
+                player["ws"].close()
+
+    def close(self):
+        """
+        Cancels anything the game was waiting to do,
+        once it has been removed from the backend.
+        """
+        if self._round_timer is not None:
+            self._round_timer.cancel()
+            self._round_timer = None
+
     def on_start_round(self, round_number):
+        self._bump_state_version()
+
         for idx, player in enumerate(self._players):
             if player is None:
                 continue
@@ -76,6 +305,8 @@ class GameMaster(object):
             self._queue_event(idx, "start_round", data)
 
     def on_finish_passing(self):
+        self._bump_state_version()
+
         for idx, player in enumerate(self._players):
             if player is None:
                 continue
@@ -89,6 +320,8 @@ class GameMaster(object):
             self._queue_event(idx, "finish_passing", data)
 
     def on_play_card(self, player_index, card):
+        self._bump_state_version()
+
         data = {
             "player": player_index,
             "card": card
@@ -97,31 +330,54 @@ class GameMaster(object):
         self._broadcast_event_from(player_index, "play_card", data)
 
     def on_finish_trick(self, winner, points):
-        pass
+        self._bump_state_version()
 
     def on_finish_round(self, scores):
+        self._bump_state_version()
+
         # The client doesn't yet cope
         # with starting the next round immediately,
         # since it wants to wait to display the trick winner.
         # So, we wait some time for the client to do that
         # before starting the next round.
-        gevent.spawn_later(2, self._continue_post_round)
+        self._round_timer = self._timers.schedule(ROUND_END_DELAY, self._continue_post_round)
 
     def on_finish_game(self):
+        self._bump_state_version()
+
         for obs in self._observers:
             obs.on_game_finished(self._game_id)
 
     def _continue_post_round(self):
+        self._round_timer = None
         if self._game.is_player_above_hundred():
             self._game.end_game()
         else:
             self._game.start_next_round()
 
+    def get_outbound_queue_lengths(self):
+        """
+        Returns how many events are waiting to be sent
+        to each connected player.
+        """
+        return [p["queue"].qsize() for p in self._players if p is not None]
+
     def _receive_message(self, player_index, msg):
+        self._last_activity = self._timers.now()
+
+        start = time.time()
+        self._handle_message(player_index, msg)
+
+        # clients choose the type, so keep the set of labels bounded
+        action = msg["type"] if msg.get("type") in _MESSAGE_TYPES else "invalid"
+        RECEIVE_MESSAGE_SECONDS.labels(action).observe(time.time() - start)
+
+    def _handle_message(self, player_index, msg):
         data = msg
         game = self._game
         player_idx = player_index
         ws = self._players[player_index]["ws"]
+        protocol = self._players[player_index]["protocol"]
 
         action = data["type"]
         command_id = data["command_id"]
@@ -134,34 +390,65 @@ class GameMaster(object):
 
                 game.play_card(card)
             except GameStateError:
-                wsutil.send_command_fail(ws, command_id)
+                wsutil.send_command_fail(ws, command_id, protocol)
                 return
 
-            wsutil.send_command_success(ws, command_id)
+            wsutil.send_command_success(ws, command_id, protocol=protocol)
 
         elif action == "pass_card":
             cards = data["cards"]
             try:
                 game.pass_cards(player_idx, cards)
             except GameStateError:
-                wsutil.send_command_fail(ws, command_id)
+                wsutil.send_command_fail(ws, command_id, protocol)
                 return
 
-            wsutil.send_command_success(ws, command_id)
+            # The model only tells observers once everyone has passed,
+            # but this player's state has changed already.
+            self._bump_state_version()
+
+            wsutil.send_command_success(ws, command_id, protocol=protocol)
 
         elif action == "get_state":
-            state = self._serialize_game_state(player_index)
-            wsutil.send_query_success(ws, command_id, state)
+            self._players[player_index]["awaiting_resync"] = False
+            encoded_state = self._get_encoded_state(player_index, protocol)
+            wsutil.send_encoded_query_success(ws, command_id, encoded_state, protocol)
+
+        elif action == "get_state_changes":
+            since_version = data.get("since_version")
+            if not isinstance(since_version, (int, long)) or isinstance(since_version, bool):
+                wsutil.send_command_fail(ws, command_id, protocol)
+                return
+
+            self._players[player_index]["awaiting_resync"] = False
+            changes = self._get_state_changes(player_index, since_version)
+            wsutil.send_query_success(ws, command_id, changes, protocol)
+
+        elif action == "get_legal_moves":
+            try:
+                moves = game.get_legal_moves(player_idx)
+            except GameStateError:
+                wsutil.send_command_fail(ws, command_id, protocol)
+                return
+
+            wsutil.send_query_success(ws, command_id, moves, protocol)
 
         else:
             self.logger.warning("Received invalid message type: %s", action)
-            wsutil.send_command_fail(ws, command_id)
+            wsutil.send_command_fail(ws, command_id, protocol)
 
     def _on_connect(self, player_index, player_name):
+        self._last_activity = self._timers.now()
+        self._has_had_players = True
+        self._bump_state_version()
+
         data = {"index": player_index, "player": player_name}
         self._broadcast_event_from(player_index, "player_connected", data)
 
     def _on_disconnect(self, player_index):
+        self._last_activity = self._timers.now()
+        self._bump_state_version()
+
         data = {"index": player_index}
         self._broadcast_event_from(player_index, "player_disconnected", data)
 
@@ -173,24 +460,125 @@ class GameMaster(object):
             for obs in self._observers:
                 obs.on_game_abandoned(self._game_id)
 
+    def _bump_state_version(self):
+        self._state_version += 1
+
+    def _get_state_snapshot(self, player_index):
+        """
+        Serializes the game state for the player
+        and remembers it, so that later changes
+        can be sent relative to it.
+        """
+        version = self._state_version
+        history = self._state_history[player_index]
+
+        state = history.get(version)
+        if state is None:
+            state = self._serialize_game_state(player_index)
+            state["version"] = version
+            history[version] = state
+            if len(history) > MAX_STATE_HISTORY:
+                history.popitem(last=False)
+
+        return state
+
+    def _get_encoded_state(self, player_index, protocol):
+        """
+        Returns the player's state encoded for the protocol.
+        Repeated queries reuse the same encoding
+        until the state version changes.
+        """
+        version, encoded_states = self._encoded_states[player_index]
+        if version != self._state_version:
+            encoded_states = {}
+            self._encoded_states[player_index] = (self._state_version, encoded_states)
+
+        encoded = encoded_states.get(protocol.name)
+        if encoded is None:
+            encoded = protocol.encode_value(self._get_state_snapshot(player_index))
+            encoded_states[protocol.name] = encoded
+
+        return encoded
+
+    def _get_state_changes(self, player_index, since_version):
+        """
+        Returns what has changed in the player's state
+        since the given version.
+
+        If the state at that version is no longer known,
+        the full state is returned instead under "full".
+        """
+        old = self._state_history[player_index].get(since_version)
+        new = self._get_state_snapshot(player_index)
+
+        if old is None:
+            return {"version": new["version"], "full": new}
+
+        return _diff_state(old, new)
+
     def _queue_event(self, player_index, event_type, data):
-        self._players[player_index]["queue"].put((event_type, data))
+        player = self._players[player_index]
+        frame = player["protocol"].encode_event(event_type, data)
+        self._put_frame(player_index, player, frame)
 
     def _broadcast_event(self, event_type, data):
-        for player in self._players:
-            if player is None:
-                continue
-
-            player["queue"].put((event_type, data))
+        self._broadcast_event_from(None, event_type, data)
 
     def _broadcast_event_from(self, origin_player_index, event_type, data):
+        # Every recipient using the same protocol
+        # shares the same encoded frame.
+        frames = {}
         for idx, player in enumerate(self._players):
             if player is None:
                 continue
             if idx == origin_player_index:
                 continue
 
-            player["queue"].put((event_type, data))
+            protocol = player["protocol"]
+            frame = frames.get(protocol.name)
+            if frame is None:
+                frame = protocol.encode_event(event_type, data)
+                frames[protocol.name] = frame
+            self._put_frame(idx, player, frame)
+
+    def _put_frame(self, player_index, player, frame):
+        if player["awaiting_resync"]:
+            # the client is about to fetch the whole state anyway
+            return
+
+        queue = player["queue"]
+        try:
+            queue.put_nowait(frame)
+        except gq.Full:
+            self._on_queue_full(player_index, player)
+            return
+
+        length = queue.qsize()
+        if length > OUTBOUND_QUEUE_HIGH_WATER.value:
+            OUTBOUND_QUEUE_HIGH_WATER.set(length)
+
+    def _on_queue_full(self, player_index, player):
+        policy = self._slow_consumer_policy
+        OUTBOUND_QUEUE_OVERFLOWS.labels(policy).inc()
+        self.logger.warning(
+            "Outbound queue full for player %d in game %d, applying policy '%s'.",
+            player_index, self._game_id, policy)
+
+        queue = player["queue"]
+        while not queue.empty():
+            queue.get_nowait()
+
+        if policy == "resync":
+            player["awaiting_resync"] = True
+            queue.put_nowait(player["protocol"].encode_event("resync"))
+        elif policy == "coalesce":
+            # the state already includes the event that didn't fit
+            state = self._get_state_snapshot(player_index)
+            queue.put_nowait(player["protocol"].encode_event("game_state", {"data": state}))
+        else:
+            self._players[player_index] = None
+            self._on_disconnect(player_index)
+            player["ws"].close()
 
     def _serialize_player(self, player):
         if player is None:
@@ -1,35 +1,77 @@
-import gevent
-
+from hearts.greenlets import spawn
+from hearts.metrics import REGISTRY
 from hearts.queue_backend import PlayerUnregisteredError
+from hearts.services.player import PlayerExistsError
 
 import hearts.websocket_util as wsutil
 
-import hearts.util as u
-
 import logging
+import time
+
+
+CONNECTED_SOCKETS = REGISTRY.gauge(
+    "hearts_connected_sockets",
+    "Client websockets currently open.")
+
+AUTH_SECONDS = REGISTRY.histogram(
+    "hearts_auth_seconds",
+    "Time taken to handle an auth message, including password hashing.",
+    labels=("result",))
 
 
 class GameWebsocketHandler(object):
 
-    def __init__(self, player_svc, queue_backend, game_backend):
+    def __init__(self, player_svc, queue_backend, game_backend, router=None):
         self.player_svc = player_svc
         self.queue_backend = queue_backend
         self.game_backend = game_backend
+
+        # When running as one of several worker processes,
+        # finds and forwards to the worker that owns a player's game.
+        self.router = router
+
         self.logger = logging.getLogger(__name__)
 
     def handle_ws(self, ws):
+        CONNECTED_SOCKETS.inc()
+        try:
+            self._handle_ws(ws)
+        finally:
+            CONNECTED_SOCKETS.dec()
+
+    def _handle_ws(self, ws):
         self.logger.info("Got connection.")
-        player_id = self._receive_auth(ws)
-        if player_id is None:
+        auth = self._receive_auth(ws)
+        if auth is None:
             self.logger.info("Client disconnected during auth.")
             return
 
+        player_id, protocol = auth
+
         self.logger.info("Authenticated as user %d.", player_id)
 
-        if self.game_backend.is_in_game(player_id):
-            self._handle_game_connection(ws, player_id)
+        if self._is_in_game(player_id):
+            self._handle_game_connection(ws, player_id, protocol)
         else:
-            self._handle_queue_connection(ws, player_id)
+            self._handle_queue_connection(ws, player_id, protocol)
+
+    def handle_forwarded(self, ws, player_id, player_name, protocol):
+        """
+        Serves a player whose connection was accepted and authenticated
+        by another worker and forwarded to this one.
+        """
+        self.logger.info("Got forwarded connection for user %d.", player_id)
+        if not self.game_backend.is_in_game(player_id):
+            self.logger.info("Player %d is not in a game here, disconnecting.", player_id)
+            return
+
+        self._connect_to_game(ws, player_id, player_name, protocol)
+
+    def _is_in_game(self, player_id):
+        if self.game_backend.is_in_game(player_id):
+            return True
+
+        return self.router is not None and self.router.get_player_shard(player_id) is not None
 
     def _receive_auth(self, ws):
         while True:
@@ -37,46 +79,80 @@ class GameWebsocketHandler(object):
             if msg is None:
                 return None
 
-            command_id = msg["command_id"]
-
-            if msg.get("type") != "auth":
-                self.logger.info("Got non-auth message, ignoring.")
+            start = time.time()
+            auth = self._try_auth(ws, msg)
+            result = "fail" if auth is None else "success"
+            AUTH_SECONDS.labels(result).observe(time.time() - start)
+
+            if auth is not None:
+                return auth
+
+    def _try_auth(self, ws, msg):
+        """
+        Handles one auth message.
+        Returns (player_id, protocol) if it succeeded, otherwise None.
+        """
+        command_id = msg["command_id"]
+
+        if msg.get("type") != "auth":
+            self.logger.info("Got non-auth message, ignoring.")
+            wsutil.send_command_fail(ws, command_id)
+            return None
+
+        self.logger.info("Got auth message.")
+        username = msg.get("name")
+        passwd = msg.get("password")
+
+        if not username:
+            self.logger.info("Auth message has incomplete credentials, failing.")
+            wsutil.send_command_fail(ws, command_id)
+            return None
+
+        if len(username) > 20 or (passwd and len(passwd) > 50):
+            self.logger.info("Credentials too long, rejecting.")
+            wsutil.send_command_fail(ws, command_id)
+            return None
+
+        # The auth reply is always JSON.
+        # The chosen protocol is used from then on.
+        protocol = wsutil.PROTOCOLS.get(msg.get("protocol", "json"))
+        if protocol is None:
+            self.logger.info("Unknown protocol requested, failing.")
+            wsutil.send_command_fail(ws, command_id)
+            return None
+
+        player_id = self.player_svc.get_player_id(username)
+        if player_id is None:
+            try:
+                if passwd:
+                    self.logger.info("Player with name '%s' does not exist, creating.", username)
+                    player_id = self.player_svc.create_player(username, passwd)
+                    wsutil.send_command_success(ws, command_id)
+                else:
+                    self.logger.info("Player with name '%s' does not exist, creating guest.", username)
+                    player_id, token = self.player_svc.create_guest_player(username)
+                    wsutil.send_command_success(ws, command_id, {"token": token})
+            except PlayerExistsError:
+                self.logger.info("Player with name '%s' was created by someone else, failing.", username)
                 wsutil.send_command_fail(ws, command_id)
-                continue
-
-            self.logger.info("Got auth message.")
-            username = msg.get("name")
-            passwd = msg.get("password")
+                return None
 
-            if not username:
-                self.logger.info("Auth message has incomplete credentials, failing.")
-                wsutil.send_command_fail(ws, command_id)
-                continue
+            self.logger.info("%s created as user %d.", username, player_id)
+            return player_id, protocol
 
-            if not passwd:
-                passwd = u.gen_temp_password()
+        if not passwd:
+            self.logger.info("Name '%s' is taken and no password was given, failing.", username)
+            wsutil.send_command_fail(ws, command_id)
+            return None
 
-            if len(username) > 20 or len(passwd) > 50:
-                self.logger.info("Credentials too long, rejecting.")
-                wsutil.send_command_fail(ws, command_id)
-                continue
-
-            player_id = self.player_svc.get_player_id(username)
-            if player_id is None:
-                self.logger.info("Player with name '%s' does not exist, creating.", username)
-                player_id = self.player_svc.create_player(username, passwd)
-                self.logger.info("%s created as user %d.", username, player_id)
-                wsutil.send_command_success(ws, command_id)
-                return player_id
-
-            if self.player_svc.auth_player(player_id, passwd):
-                wsutil.send_command_success(ws, command_id)
-                return player_id
-            else:
-                wsutil.send_command_fail(ws, command_id)
-                continue
+        if self.player_svc.auth_player(player_id, passwd):
+            wsutil.send_command_success(ws, command_id)
+            return player_id, protocol
+        else:
+            wsutil.send_command_fail(ws, command_id)
+            return None
 
-    def _handle_queue_connection(self, ws, player_id):
+    def _handle_queue_connection(self, ws, player_id, protocol):
         # add to queue
         self.logger.info("Checking if player %d is already on the queue.", player_id)
         if self.queue_backend.is_registered(player_id):
@@ -95,7 +171,7 @@ class GameWebsocketHandler(object):
                     self.queue_backend.unregister(player_id)
                     return
 
-        listen_greenlet = gevent.spawn(check_cancel)
+        listen_greenlet = spawn(check_cancel)
 
         try:
             result.get()
@@ -108,10 +184,19 @@ class GameWebsocketHandler(object):
 
         self.logger.info("Game found for player %d, handing over to game handler.", player_id)
 
-        self._handle_game_connection(ws, player_id)
+        self._handle_game_connection(ws, player_id, protocol)
 
-    def _handle_game_connection(self, ws, player_id):
+    def _handle_game_connection(self, ws, player_id, protocol):
         player = self.player_svc.get_player(player_id)
+
+        if not self.game_backend.is_in_game(player_id):
+            self.logger.info("Forwarding player %d to the worker running their game.", player_id)
+            self.router.forward(ws, player_id, player["name"], protocol)
+            return
+
+        self._connect_to_game(ws, player_id, player["name"], protocol)
+
+    def _connect_to_game(self, ws, player_id, player_name, protocol):
         result = self.game_backend.try_get_game_info(player_id)
 
         # We know we have a game,
@@ -126,4 +211,4 @@ class GameWebsocketHandler(object):
             return
 
         # this will block until connection close
-        game_master.connect(ws, player["name"], player_index)
+        game_master.connect(ws, player_name, player_index, protocol)
@@ -0,0 +1,26 @@
+"""
+Spawns greenlets while keeping a running count of those still alive,
+so that /metrics can report it without walking the heap.
+
+Everything in the server that starts a greenlet goes through spawn,
+including the servers accepting connections.
+"""
+import gevent
+
+from hearts.metrics import REGISTRY
+
+
+GREENLETS = REGISTRY.gauge(
+    "hearts_greenlets",
+    "Greenlets spawned by this process that are still alive.")
+
+
+def _on_exit(greenlet):
+    GREENLETS.dec()
+
+
+def spawn(func, *args, **kwargs):
+    greenlet = gevent.spawn(func, *args, **kwargs)
+    GREENLETS.inc()
+    greenlet.rawlink(_on_exit)
+    return greenlet
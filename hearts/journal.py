@@ -0,0 +1,289 @@
+"""
+Append-only journal of game events.
+
+Every game writes its deal seed, passes and plays here,
+so that it can be replayed or analysed after it has finished.
+
+Each record is a fixed-size header followed by a payload
+whose size depends only on the record type:
+
+    header = u8 record type, u32 game_id
+
+    RUN_START   u64 run id (game_id is 0)
+    GAME_START  u64 deal seed, u32 player id * 4
+    START_ROUND u8 round number
+    PASS        u8 player index, u8 card * 3
+    PLAY        u8 player index, u8 card
+    GAME_OVER   i16 score * 4
+    ABANDONED   (nothing)
+
+Cards are their index in util.DECK.
+All integers are big-endian.
+A torn record at the end of the file is ignored by the reader.
+
+Game ids start again from 1 each time the server starts,
+so every time a journal is opened it first records a RUN_START
+with an id for that run of the server.
+A game is identified by the run it started in and its game_id.
+"""
+import logging
+import mmap
+import os
+import struct
+import time
+
+from gevent.event import Event
+from gevent.threadpool import ThreadPool
+
+from hearts.greenlets import spawn
+import hearts.util as u
+
+
+GAME_START = 1
+START_ROUND = 2
+PASS = 3
+PLAY = 4
+GAME_OVER = 5
+ABANDONED = 6
+RUN_START = 7
+
+RECORD_NAMES = {
+    GAME_START: "game_start",
+    START_ROUND: "start_round",
+    PASS: "pass",
+    PLAY: "play",
+    GAME_OVER: "game_over",
+    ABANDONED: "abandoned",
+    RUN_START: "run_start",
+}
+
+_header = struct.Struct(">BI")
+
+_payloads = {
+    GAME_START: struct.Struct(">QIIII"),
+    START_ROUND: struct.Struct(">B"),
+    PASS: struct.Struct(">BBBB"),
+    PLAY: struct.Struct(">BB"),
+    GAME_OVER: struct.Struct(">hhhh"),
+    ABANDONED: struct.Struct(""),
+    RUN_START: struct.Struct(">Q"),
+}
+
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+# longest to wait between attempts while writes are failing
+MAX_RETRY_INTERVAL = 5.0
+
+
+class JournalError(Exception):
+    pass
+
+
+def encode_record(record_type, game_id, *fields):
+    return _header.pack(record_type, game_id) + _payloads[record_type].pack(*fields)
+
+
+def decode_records(data, offset=0, end=None):
+    """
+    Yields (record type, game_id, fields) for each
+    complete record in data, starting at offset.
+    """
+    if end is None:
+        end = len(data)
+
+    header_size = _header.size
+    while offset + header_size <= end:
+        record_type, game_id = _header.unpack_from(data, offset)
+        payload = _payloads.get(record_type)
+        if payload is None:
+            raise JournalError("Unknown record type %d at offset %d" % (record_type, offset))
+
+        offset += header_size
+        if offset + payload.size > end:
+            # torn write at the end of the journal
+            return
+
+        fields = payload.unpack_from(data, offset)
+        offset += payload.size
+        yield record_type, game_id, fields
+
+
+def map_journal(path):
+    """
+    Returns the contents of the journal at path through a read-only mmap,
+    so that large journals are never read into memory whole.
+    Close the result when done with it.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses empty files
+            return _EmptyJournal()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _EmptyJournal(str):
+    def close(self):
+        pass
+
+
+def read_journal(path):
+    """
+    Yields every event in the journal at path as a dict.
+    """
+    data = map_journal(path)
+    try:
+        for record_type, game_id, fields in decode_records(data):
+            yield record_to_dict(record_type, game_id, fields)
+    finally:
+        data.close()
+
+
+def record_to_dict(record_type, game_id, fields):
+    record = {"type": RECORD_NAMES[record_type], "game_id": game_id}
+
+    if record_type == RUN_START:
+        record["run_id"] = fields[0]
+    elif record_type == GAME_START:
+        record["seed"] = fields[0]
+        record["players"] = list(fields[1:])
+    elif record_type == START_ROUND:
+        record["round_number"] = fields[0]
+    elif record_type == PASS:
+        record["player"] = fields[0]
+        record["cards"] = [u.DECK[x] for x in fields[1:]]
+    elif record_type == PLAY:
+        record["player"] = fields[0]
+        record["card"] = u.DECK[fields[1]]
+    elif record_type == GAME_OVER:
+        record["scores"] = list(fields)
+
+    return record
+
+
+class GameJournal(object):
+    """
+    Buffers records in memory and appends them to the journal file
+    in batches every flush_interval seconds.
+
+    Each batch is written and fsynced on a native thread,
+    so the gevent loop never waits for the disk.
+    Records that arrive during a write go into the next batch.
+    If a write fails, the batch is kept and tried again,
+    backing off up to MAX_RETRY_INTERVAL.
+
+    The run id defaults to the time the journal was opened, in microseconds.
+    """
+
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL, run_id=None):
+        self.path = path
+        if run_id is None:
+            run_id = int(time.time() * 1000000)
+        self.run_id = run_id
+
+        # unbuffered, so a failed write leaves nothing behind to go out later
+        self._file = open(path, "ab", 0)
+        self._size = os.fstat(self._file.fileno()).st_size
+
+        self._flush_interval = flush_interval
+        self._buffer = [encode_record(RUN_START, 0, run_id)]
+        self._pool = ThreadPool(1)
+        self._closing = Event()
+        self._flush_greenlet = spawn(self._run_flushes)
+        self.logger = logging.getLogger(__name__)
+
+    def record_game_start(self, game_id, seed, players):
+        self._buffer.append(encode_record(GAME_START, game_id, seed, *players))
+
+    def record_start_round(self, game_id, round_number):
+        self._buffer.append(encode_record(START_ROUND, game_id, round_number))
+
+    def record_pass(self, game_id, player_index, cards):
+        indices = [u.CARD_INDICES[card] for card in cards]
+        self._buffer.append(encode_record(PASS, game_id, player_index, *indices))
+
+    def record_play(self, game_id, player_index, card):
+        self._buffer.append(encode_record(PLAY, game_id, player_index, u.CARD_INDICES[card]))
+
+    def record_game_over(self, game_id, scores):
+        self._buffer.append(encode_record(GAME_OVER, game_id, *scores))
+
+    def record_abandoned(self, game_id):
+        self._buffer.append(encode_record(ABANDONED, game_id))
+
+    def flush(self):
+        """
+        Writes out everything recorded so far,
+        blocking the calling greenlet until it is on disk.
+        """
+        if not self._buffer:
+            return
+
+        batch = self._buffer
+        self._buffer = []
+        try:
+            self._pool.apply(self._write, ("".join(batch),))
+        except (IOError, OSError):
+            # keep the records, ahead of any that arrived during the write
+            self._buffer[:0] = batch
+            raise
+
+    def close(self):
+        # let a flush that is already running finish,
+        # or its batch would be written twice
+        self._closing.set()
+        self._flush_greenlet.join()
+        self.flush()
+        self._file.close()
+        self._pool.kill()
+
+    def _run_flushes(self):
+        interval = self._flush_interval
+        while not self._closing.wait(interval):
+            try:
+                self.flush()
+                interval = self._flush_interval
+            except (IOError, OSError):
+                self.logger.error("Failed to write journal.", exc_info=True)
+                interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+    def _write(self, data):
+        try:
+            self._file.write(data)
+            os.fsync(self._file.fileno())
+        except (IOError, OSError):
+            # Cut off any part of the batch that did get written,
+            # so that retrying it does not leave a torn record mid-file.
+            os.ftruncate(self._file.fileno(), self._size)
+            raise
+        self._size += len(data)
+
+
+class JournalRecorder(object):
+    """
+    Observes a HeartsGame and writes its events to a journal.
+    """
+
+    def __init__(self, journal, game_id, game):
+        self._journal = journal
+        self._game_id = game_id
+        self._game = game
+
+    def on_start_round(self, round_number):
+        self._journal.record_start_round(self._game_id, round_number)
+
+    def on_finish_passing(self):
+        for i in range(4):
+            cards = self._game.get_passed_cards(i)
+            self._journal.record_pass(self._game_id, i, cards)
+
+    def on_play_card(self, player_index, card):
+        self._journal.record_play(self._game_id, player_index, card)
+
+    def on_finish_trick(self, winner, points):
+        pass
+
+    def on_finish_round(self, scores):
+        pass
+
+    def on_finish_game(self):
+        self._journal.record_game_over(self._game_id, self._game.get_scores())
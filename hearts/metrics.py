@@ -0,0 +1,163 @@
+"""
+Counters, gauges and histograms, rendered in the Prometheus text format.
+
+Everything runs on the gevent loop,
+so updating a metric is a plain attribute update with no locking.
+Histograms keep a count per bucket, so observing a value
+costs one binary search over the bucket bounds.
+
+Metrics are created once, at import time, from REGISTRY:
+
+    PLAYS = REGISTRY.counter("hearts_plays_total", "Cards played.")
+    PLAYS.inc()
+
+Gauges can instead be given a function,
+which is only called when the metrics are rendered.
+"""
+import bisect
+
+
+# seconds, from 100us up to 2.5s
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter(object):
+    __slots__ = ["value"]
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, label_names, label_values):
+        yield name, label_names, label_values, self.value
+
+
+class Gauge(object):
+    __slots__ = ["value", "_func"]
+
+    def __init__(self, func=None):
+        self.value = 0
+        self._func = func
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, name, label_names, label_values):
+        value = self.value if self._func is None else self._func()
+        yield name, label_names, label_values, value
+
+
+class Histogram(object):
+    __slots__ = ["_bounds", "_counts", "sum", "count"]
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        # the last count is for values above every bound
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, label_names, label_values):
+        bucket_labels = label_names + ("le",)
+        total = 0
+        for bound, count in zip(self._bounds + (float("inf"),), self._counts):
+            total += count
+            yield name + "_bucket", bucket_labels, label_values + (_format_value(bound),), total
+        yield name + "_sum", label_names, label_values, self.sum
+        yield name + "_count", label_names, label_values, self.count
+
+
+class Metric(object):
+    """
+    A named metric, optionally split by labels.
+    Without labels it can be used directly like its children,
+    otherwise labels(...) returns the child for those label values.
+    """
+
+    def __init__(self, name, doc, metric_type, label_names, factory):
+        self.name = name
+        self.doc = doc
+        self.type = metric_type
+        self.label_names = tuple(label_names)
+        self._factory = factory
+
+        # label values -> child
+        self._children = {}
+        if not self.label_names:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._factory()
+            self._children[values] = child
+        return child
+
+    def __getattr__(self, name):
+        # only reached for attributes Metric does not have itself
+        if name.startswith("_") or self.label_names:
+            raise AttributeError(name)
+        return getattr(self._default, name)
+
+    def render(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.doc))
+        lines.append("# TYPE %s %s" % (self.name, self.type))
+        for values, child in sorted(self._children.iteritems()):
+            for name, label_names, label_values, value in child.samples(self.name, self.label_names, values):
+                lines.append("%s%s %s" % (name, _format_labels(label_names, label_values), _format_value(value)))
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, doc, labels=()):
+        return self._add(Metric(name, doc, "counter", labels, Counter))
+
+    def gauge(self, name, doc, func=None, labels=()):
+        return self._add(Metric(name, doc, "gauge", labels, lambda: Gauge(func)))
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        bounds = tuple(sorted(buckets))
+        return self._add(Metric(name, doc, "histogram", labels, lambda: Histogram(bounds)))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = Registry()
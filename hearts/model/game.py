@@ -15,6 +15,50 @@ class HeartsGame(object):
         self._current_round = None
         self._scores = [0, 0, 0, 0]
 
+    @classmethod
+    def from_snapshot(cls, snapshot, deal_func=u.deal_hands):
+        """
+        Rebuilds a game from the output of get_snapshot.
+        deal_func will be used to deal the rounds that follow.
+        """
+        game = cls(deal_func)
+        game._state = snapshot["state"]
+        game._current_round = snapshot["current_round"]
+        game._scores = list(snapshot["scores"])
+
+        if game._state == "passing":
+            game._preround = HeartsPreRound.from_snapshot(snapshot["preround"])
+        elif game._state == "playing":
+            game._round = HeartsRound.from_snapshot(snapshot["round"])
+            game._round.add_observer(RoundObserver(game))
+
+        return game
+
+    def get_snapshot(self):
+        """
+        Returns everything needed to rebuild the game
+        as plain data, ready to be serialized.
+        """
+        snapshot = {
+            "state": self._state,
+            "current_round": self._current_round,
+            "scores": list(self._scores),
+        }
+
+        if self._state == "passing":
+            snapshot["preround"] = self._preround.get_snapshot()
+        elif self._state == "playing":
+            snapshot["round"] = self._round.get_snapshot()
+
+        return snapshot
+
+    def is_round_finished(self):
+        """
+        Returns true between the last card of a round being played
+        and the next round being started.
+        """
+        return self._state == "playing" and self._round.is_finished()
+
     def get_score(self, player_index):
         return self._scores[player_index]
 
@@ -57,6 +101,12 @@ class HeartsGame(object):
 
         raise e.RoundNotInProgressError()
 
+    def get_legal_moves(self, player_index):
+        if self._state == "playing":
+            return self._round.get_legal_moves(player_index)
+
+        raise e.RoundNotInProgressError()
+
     def get_trick(self):
         if self._state == "playing":
             return self._round.get_trick()
@@ -10,10 +10,32 @@ class HeartsPreRound(object):
     def __init__(self, hands, pass_direction="left"):
         self.pass_direction = pass_direction
         self.hands = [None, None, None, None]
+        self._hand_masks = [0, 0, 0, 0]
         self.passed_cards = [None, None, None, None]
+        self._pass_masks = [0, 0, 0, 0]
 
         for i, hand in enumerate(hands):
             self.hands[i] = list(hand)
+            self._hand_masks[i] = u.cards_to_mask(hand)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Rebuilds a preround part way through passing
+        from the output of get_snapshot.
+        """
+        preround = cls(snapshot["hands"], snapshot["pass_direction"])
+        for i, cards in enumerate(snapshot["passed_cards"]):
+            if cards is not None:
+                preround.pass_cards(i, cards)
+        return preround
+
+    def get_snapshot(self):
+        return {
+            "pass_direction": self.pass_direction,
+            "hands": self.get_all_hands(),
+            "passed_cards": [None if x is None else list(x) for x in self.passed_cards],
+        }
 
     def get_hand(self, player_index):
         return self.hands[player_index][:]
@@ -40,11 +62,20 @@ class HeartsPreRound(object):
         # copy cards to prevent shenanigans
         cards_to_pass = list(cards)
 
+        hand_mask = self._hand_masks[player_index]
+        pass_mask = 0
         for card in cards_to_pass:
-            if card not in self.hands[player_index]:
+            card_bit = u.card_to_bit(card)
+            if not hand_mask & card_bit:
                 raise CardsNotInHandError()
+            pass_mask |= card_bit
+
+        # the same card cannot be passed twice
+        if u.popcount(pass_mask) != 3:
+            raise e.InvalidMoveError()
 
         self.passed_cards[player_index] = cards_to_pass
+        self._pass_masks[player_index] = pass_mask
 
     def get_received_cards(self, player_index):
         from_idx = self._get_from_player_index(player_index)
@@ -58,11 +89,14 @@ class HeartsPreRound(object):
             if cards is None:
                 raise PlayersYetToPassError()
 
+        for i, mask in enumerate(self._pass_masks):
+            self.hands[i] = [c for c in self.hands[i] if not u.CARD_BITS[c] & mask]
+            self._hand_masks[i] &= ~mask
+
         for i, cards in enumerate(self.passed_cards):
-            for card in cards:
-                target_index = self._get_target_player_index(i)
-                self.hands[i].remove(card)
-                self.hands[target_index].append(card)
+            target_index = self._get_target_player_index(i)
+            self.hands[target_index].extend(cards)
+            self._hand_masks[target_index] |= self._pass_masks[i]
 
     def _get_from_player_index(self, player_index):
         return (player_index - u.get_pass_offset(self.pass_direction)) % 4
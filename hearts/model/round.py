@@ -4,10 +4,14 @@ import exceptions as e
 import hearts.util as u
 
 
+_POINT_CARDS_MASK = u.SUIT_MASKS["h"] | u.CARD_BITS["sq"]
+
+
 class HeartsRound(object):
 
     def __init__(self, hands):
         self.hands = [None, None, None, None]
+        self._hand_masks = [0, 0, 0, 0]
         self.scores = [0, 0, 0, 0]
         self.current_player = None
         self.trick = []
@@ -15,13 +19,17 @@ class HeartsRound(object):
         self._is_hearts_broken = False
         self._is_first_trick = True
         self._observers = []
+        self._legal_mask = None
+        self._legal_moves = None
 
         for i, hand in enumerate(hands):
             self.hands[i] = list(hand)
+            self._hand_masks[i] = u.cards_to_mask(hand)
 
         # find the starting player
-        for i, hand in enumerate(self.hands):
-            if "c2" in hand:
+        c2_bit = u.CARD_BITS["c2"]
+        for i, mask in enumerate(self._hand_masks):
+            if mask & c2_bit:
                 self.current_player = i
                 break
 
@@ -33,6 +41,40 @@ class HeartsRound(object):
         # move to playing state
         self.is_first_move = True
 
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Rebuilds a round part way through
+        from the output of get_snapshot.
+        """
+        round = cls.__new__(cls)
+        round.hands = [list(hand) for hand in snapshot["hands"]]
+        round._hand_masks = map(u.cards_to_mask, round.hands)
+        round.scores = list(snapshot["scores"])
+        round.current_player = snapshot["current_player"]
+        round.trick = [dict(x) for x in snapshot["trick"]]
+        round.is_first_move = snapshot["is_first_move"]
+        round._is_hearts_broken = snapshot["is_hearts_broken"]
+        round._is_first_trick = snapshot["is_first_trick"]
+        round._observers = []
+        round._legal_mask = None
+        round._legal_moves = None
+        return round
+
+    def get_snapshot(self):
+        return {
+            "hands": [list(hand) for hand in self.hands],
+            "scores": list(self.scores),
+            "current_player": self.current_player,
+            "trick": [dict(x) for x in self.trick],
+            "is_first_move": self.is_first_move,
+            "is_hearts_broken": self._is_hearts_broken,
+            "is_first_trick": self._is_first_trick,
+        }
+
+    def is_finished(self):
+        return not any(self._hand_masks)
+
     def add_observer(self, observer):
         self._observers.append(observer)
 
@@ -48,37 +90,35 @@ class HeartsRound(object):
     def get_scores(self):
         return list(self.scores)
 
-    def play_card(self, card):
-        hand = self.hands[self.current_player]
+    def get_legal_moves(self, player_index):
+        if player_index != self.current_player:
+            return []
 
-        if card not in hand:
-            raise InvalidMoveError()
+        if self._legal_moves is None:
+            legal_mask = self._get_legal_mask()
+            hand = self.hands[self.current_player]
+            self._legal_moves = [c for c in hand if u.CARD_BITS[c] & legal_mask]
 
-        if self.is_first_move and card != "c2":
-            raise InvalidMoveError()
+        return self._legal_moves[:]
 
-        card_suit = u.get_suit(card)
-        if len(self.trick) > 0:
-            lead_suit = u.get_suit(self.trick[0]["card"])
-            hand_has_suit = any(map(lambda c: u.get_suit(c) == lead_suit, hand))
-            if hand_has_suit and lead_suit != card_suit:
-                raise InvalidMoveError()
+    def play_card(self, card):
+        card_bit = u.card_to_bit(card)
 
-        if len(self.trick) == 0 and card_suit == "h" and not self._is_hearts_broken:
+        if not self._get_legal_mask() & card_bit:
             raise InvalidMoveError()
 
-        if card_suit == "h":
+        if u.get_suit(card) == "h":
             self._is_hearts_broken = True
 
-        if self._is_first_trick and (card_suit == "h" or card == "sq"):
-            raise InvalidMoveError()
-
         player = self.current_player
 
         self.hands[player].remove(card)
+        self._hand_masks[player] &= ~card_bit
         self.trick.append({"player": player, "card": card})
         self.current_player = (player + 1) % 4
         self.is_first_move = False
+        self._legal_mask = None
+        self._legal_moves = None
 
         for obs in self._observers:
             obs.on_play_card(player, card)
@@ -95,6 +135,33 @@ class HeartsRound(object):
     def is_first_trick(self):
         return self._is_first_trick
 
+    def _get_legal_mask(self):
+        if self._legal_mask is not None:
+            return self._legal_mask
+
+        hand_mask = self._hand_masks[self.current_player]
+
+        if self.is_first_move:
+            legal_mask = hand_mask & u.CARD_BITS["c2"]
+        elif len(self.trick) > 0:
+            # must follow suit if possible
+            lead_suit = u.get_suit(self.trick[0]["card"])
+            legal_mask = (hand_mask & u.SUIT_MASKS[lead_suit]) or hand_mask
+        elif not self._is_hearts_broken:
+            # cannot lead hearts until broken,
+            # unless there is nothing else to lead.
+            legal_mask = (hand_mask & ~u.SUIT_MASKS["h"]) or hand_mask
+        else:
+            legal_mask = hand_mask
+
+        if self._is_first_trick:
+            # no points on the first trick,
+            # unless the hand holds nothing else.
+            legal_mask = (legal_mask & ~_POINT_CARDS_MASK) or legal_mask
+
+        self._legal_mask = legal_mask
+        return legal_mask
+
     def _finish_trick(self):
         # move onto the next trick
         cards = map(lambda x: x["card"], self.trick)
@@ -103,13 +170,15 @@ class HeartsRound(object):
         self.current_player = winner
         self.trick = []
         self._is_first_trick = False
+        self._legal_mask = None
+        self._legal_moves = None
         points = u.sum_points(cards)
         self.scores[winner] += points
 
         for obs in self._observers:
             obs.on_finish_trick(winner, points)
 
-        if all(map(lambda x: len(x) == 0, self.hands)):
+        if not any(self._hand_masks):
             self._finish_round()
 
     def _finish_round(self):
@@ -1,5 +1,30 @@
+from collections import OrderedDict
+import logging
+import time
+
+import gevent
 from gevent.event import AsyncResult
 
+from hearts.greenlets import spawn
+from hearts.metrics import REGISTRY
+
+
+DEFAULT_RATING = 1500
+
+MATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "hearts_match_wait_seconds",
+    "Time players waited in the rated queue before being seated.",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+
+MATCH_RATING_SPREAD = REGISTRY.histogram(
+    "hearts_match_rating_spread",
+    "Difference between the highest and lowest rating at each table the rated queue formed.",
+    buckets=(0, 25, 50, 100, 200, 300, 500, 750, 1000, 1500))
+
+FAILED_MATCH_TICKS = REGISTRY.counter(
+    "hearts_match_tick_failures_total",
+    "Rated queue ticks that failed to create a game.")
+
 
 class PlayerUnregisteredError(Exception):
     pass
@@ -7,12 +32,13 @@ class PlayerUnregisteredError(Exception):
 
 class GameQueueBackend(object):
     def __init__(self, game_creator):
-        self.clients = []
+        # player_id -> AsyncResult, in the order players registered
+        self.clients = OrderedDict()
         self.game_creator = game_creator
 
-    def register(self, player_id):
+    def register(self, player_id, rating=DEFAULT_RATING):
         result = AsyncResult()
-        self.clients.append((player_id, result))
+        self.clients[player_id] = result
 
         self.try_match()
 
@@ -22,8 +48,7 @@ class GameQueueBackend(object):
         if len(self.clients) < 4:
             return
 
-        players = self.clients[:4]
-        self.clients = self.clients[4:]
+        players = [self.clients.popitem(last=False) for _ in range(4)]
 
         player_ids = map(lambda x: x[0], players)
         game_id = self.game_creator.create_game(player_ids)
@@ -32,19 +57,256 @@ class GameQueueBackend(object):
             result.set(game_id)
 
     def is_registered(self, player_id):
-        for idx, (item_id, _) in enumerate(self.clients):
-            if item_id == player_id:
-                return True
+        return player_id in self.clients
 
-        return False
+    def get_queue_size(self):
+        return len(self.clients)
 
     def unregister(self, player_id):
-        found_idx = None
-        for idx, (item_id, _) in enumerate(self.clients):
-            if item_id == player_id:
-                found_idx = idx
-                break
-
-        if found_idx is not None:
-            _, result = self.clients.pop(found_idx)
+        result = self.clients.pop(player_id, None)
+        if result is not None:
             result.set_exception(PlayerUnregisteredError())
+
+
+class _QueueEntry(object):
+    __slots__ = ["player_id", "rating", "registered_at", "result"]
+
+    def __init__(self, player_id, rating, registered_at, result):
+        self.player_id = player_id
+        self.rating = rating
+        self.registered_at = registered_at
+        self.result = result
+
+
+class RatedGameQueueBackend(object):
+    """
+    Matches players of similar rating.
+
+    Tables are formed in a periodic batch tick rather than on register.
+    Each player will accept opponents within a rating window
+    that starts at base_window and widens by widen_rate
+    for every second they have waited, up to max_window.
+
+    The oldest players are seated first,
+    each with the three players nearest to them in rating.
+    The tick sorts the queue by rating once
+    and keeps the players not yet seated in a linked list in that order,
+    so the nearest players are always next to each other.
+    A tick is O(n log n) in the queue size,
+    rather than growing with the number of pairs of players.
+    """
+
+    def __init__(
+            self,
+            game_creator,
+            base_window=100,
+            widen_rate=10,
+            max_window=1000,
+            clock=time.time):
+        # player_id -> _QueueEntry, in the order players registered
+        self.clients = OrderedDict()
+
+        self.game_creator = game_creator
+        self.base_window = base_window
+        self.widen_rate = widen_rate
+        self.max_window = max_window
+        self._clock = clock
+        self._tick_greenlet = None
+
+        self.last_tick_stats = None
+
+        self.logger = logging.getLogger(__name__)
+
+    def register(self, player_id, rating=DEFAULT_RATING):
+        result = AsyncResult()
+        self.clients[player_id] = _QueueEntry(player_id, rating, self._clock(), result)
+        return result
+
+    def is_registered(self, player_id):
+        return player_id in self.clients
+
+    def get_queue_size(self):
+        return len(self.clients)
+
+    def unregister(self, player_id):
+        entry = self.clients.pop(player_id, None)
+        if entry is not None:
+            entry.result.set_exception(PlayerUnregisteredError())
+
+    def get_window(self, wait_time):
+        """
+        Returns how far from their own rating
+        a player who has waited wait_time seconds will look for opponents.
+        """
+        return min(self.base_window + (self.widen_rate * wait_time), self.max_window)
+
+    def tick(self):
+        """
+        Forms as many tables as the current queue allows.
+
+        Returns a dict of statistics about the tick,
+        which is also kept in last_tick_stats,
+        and records each wait and spread in the metrics.
+        Waits are in seconds, and the spread of a table
+        is the difference between its highest and lowest rating.
+
+        If a game cannot be created, its players go back in the queue
+        and the error is raised.
+        """
+        now = self._clock()
+        waits = []
+        spreads = []
+
+        # sorted is stable, so players of equal rating
+        # stay in the order they registered
+        by_rating = sorted(self.clients.itervalues(), key=lambda x: x.rating)
+        index = dict((entry.player_id, i) for i, entry in enumerate(by_rating))
+        ladder = _Ladder(len(by_rating))
+
+        for anchor in list(self.clients.itervalues()):
+            anchor_index = index[anchor.player_id]
+            if not ladder.contains(anchor_index):
+                # already seated earlier in this tick
+                continue
+
+            window = self.get_window(now - anchor.registered_at)
+            opponents = self._find_opponents(by_rating, ladder, anchor_index, window)
+            if opponents is None:
+                continue
+
+            table = [anchor] + [by_rating[i] for i in opponents]
+            for i in [anchor_index] + opponents:
+                ladder.remove(i)
+            for entry in table:
+                del self.clients[entry.player_id]
+
+            try:
+                game_id = self.game_creator.create_game([x.player_id for x in table])
+            except Exception:
+                self._requeue(table)
+                raise
+
+            for entry in table:
+                wait = now - entry.registered_at
+                waits.append(wait)
+                MATCH_WAIT_SECONDS.observe(wait)
+                entry.result.set(game_id)
+
+            ratings = [x.rating for x in table]
+            spread = max(ratings) - min(ratings)
+            spreads.append(spread)
+            MATCH_RATING_SPREAD.observe(spread)
+
+        stats = {
+            "tables": len(spreads),
+            "players_matched": len(waits),
+            "players_waiting": len(self.clients),
+            "mean_wait": _mean(waits),
+            "max_wait": max(waits) if waits else 0,
+            "mean_spread": _mean(spreads),
+            "max_spread": max(spreads) if spreads else 0,
+        }
+
+        self.last_tick_stats = stats
+        return stats
+
+    def start(self, interval=1.0):
+        """
+        Starts running tick every interval seconds in a greenlet.
+        """
+        if self._tick_greenlet is None:
+            self._tick_greenlet = spawn(self._run_ticks, interval)
+
+    def stop(self):
+        if self._tick_greenlet is not None:
+            self._tick_greenlet.kill()
+            self._tick_greenlet = None
+
+    def _run_ticks(self, interval):
+        while True:
+            gevent.sleep(interval)
+            try:
+                self.tick()
+            except Exception:
+                # the players are back in the queue for the next tick
+                self.logger.error("Failed to create a game from the rated queue.", exc_info=True)
+                FAILED_MATCH_TICKS.inc()
+
+    def _requeue(self, entries):
+        """
+        Puts players taken off the queue back on it,
+        in the order they registered.
+        """
+        entries = [x for x in entries if x.player_id not in self.clients]
+        entries.extend(self.clients.itervalues())
+        entries.sort(key=lambda x: x.registered_at)
+        self.clients = OrderedDict((x.player_id, x) for x in entries)
+
+    def _find_opponents(self, by_rating, ladder, anchor_index, window):
+        """
+        Returns the indexes of the three players nearest the anchor in rating,
+        or None if there are not three of them inside the anchor's window.
+        """
+        rating = by_rating[anchor_index].rating
+        below = ladder.previous(anchor_index)
+        above = ladder.next(anchor_index)
+
+        opponents = []
+        while len(opponents) < 3:
+            if below is None and above is None:
+                return None
+
+            if above is None or (below is not None and
+                                 rating - by_rating[below].rating <= by_rating[above].rating - rating):
+                nearest = below
+                below = ladder.previous(below)
+            else:
+                nearest = above
+                above = ladder.next(above)
+
+            # everyone further along is even further away
+            if abs(by_rating[nearest].rating - rating) > window:
+                return None
+            opponents.append(nearest)
+
+        return opponents
+
+
+class _Ladder(object):
+    """
+    The indexes 0 to size - 1 in order, as a doubly linked list,
+    so that each can be removed in O(1)
+    and its nearest remaining neighbours found in O(1).
+    """
+
+    def __init__(self, size):
+        self._previous = range(-1, size - 1)
+        self._next = range(1, size + 1)
+        self._removed = [False] * size
+        self._size = size
+
+    def contains(self, i):
+        return not self._removed[i]
+
+    def previous(self, i):
+        i = self._previous[i]
+        return i if i >= 0 else None
+
+    def next(self, i):
+        i = self._next[i]
+        return i if i < self._size else None
+
+    def remove(self, i):
+        previous = self._previous[i]
+        next = self._next[i]
+        if previous >= 0:
+            self._next[previous] = next
+        if next < self._size:
+            self._previous[next] = previous
+        self._removed[i] = True
+
+
+def _mean(values):
+    if not values:
+        return 0
+    return float(sum(values)) / len(values)
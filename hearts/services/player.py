@@ -1,5 +1,17 @@
+import hmac
+import multiprocessing
+
+from gevent.threadpool import ThreadPool
 from passlib.apps import custom_app_context as pwd_context
 
+import hearts.util as u
+
+
+# Hashing a password costs hundreds of milliseconds of CPU
+# and the crypt backend holds the GIL throughout,
+# so it is done in a pool of processes to keep the gevent loop responsive.
+DEFAULT_HASH_PROCESSES = 4
+
 
 class PlayerStateError(Exception):
     def __init__(self, msg=""):
@@ -11,14 +23,30 @@ class PlayerExistsError(PlayerStateError):
 
 
 class PlayerService(object):
+    """
+    Keeps players in memory.
+
+    Ids are handed out as first_id, first_id + id_step, ...
+    so that several services can share one id space.
+    """
 
-    def __init__(self):
+    def __init__(self, hash_processes=DEFAULT_HASH_PROCESSES, first_id=1, id_step=1):
         self._players = {}
         self._usernames = {}
-        self._next_id = 1
+        self._next_id = first_id
+        self._id_step = id_step
+
+        # Started on first use, so that with several workers
+        # each gets its own after forking.
+        self._hash_processes = hash_processes
+        self._hash_pool = None
+
+        # Native threads to wait for the processes on,
+        # since waiting on a multiprocessing result would block the loop.
+        self._hash_waiters = ThreadPool(hash_processes)
 
     def get_player(self, player_id):
-        data = self._players.get(player_id)
+        data = self._get_player_data(player_id)
         if data is None:
             return None
 
@@ -41,33 +69,118 @@ class PlayerService(object):
         return self.get_player(player_id)
 
     def create_player(self, name, password):
-        if name in self._usernames:
+        if self.get_player_id(name) is not None:
             raise PlayerExistsError()
 
-        password_hash = pwd_context.encrypt(password)
+        password_hash = self._hash(_encrypt, password)
 
-        player_id = self._next_id
-        self._next_id += 1
+        # Other greenlets ran while we were hashing,
+        # so the name may have been taken in the meantime.
+        if self.get_player_id(name) is not None:
+            raise PlayerExistsError()
 
-        self._players[player_id] = {
-            "id": player_id,
-            "name": name,
-            "password_hash": password_hash
-        }
+        return self._add_player(name, password_hash=password_hash)
 
-        self._usernames[name] = player_id
+    def create_guest_player(self, name):
+        """
+        Creates a player without a password.
 
-        return player_id
+        Returns the new player's ID and a random session token
+        that can be passed to auth_player in place of a password.
+        The token is stored as-is, since it is only good
+        for the lifetime of the player and not worth hashing.
+        """
+        if self.get_player_id(name) is not None:
+            raise PlayerExistsError()
+
+        token = u.gen_session_token()
+        player_id = self._add_player(name, session_token=token)
+
+        return player_id, token
 
     def auth_player(self, player_id, password):
-        player = self._players.get(player_id)
+        player = self._get_player_data(player_id)
         if player is None:
             return False
 
+        token = player.get("session_token")
+        if token is not None:
+            return hmac.compare_digest(_to_bytes(token), _to_bytes(password))
+
         pwd_hash = player["password_hash"]
-        return pwd_context.verify(password, pwd_hash)
+        return self._hash(_verify, password, pwd_hash)
+
+    def reserve_ids(self, max_id):
+        """
+        Makes sure that no player created from now on
+        is given an id up to max_id,
+        for example because it was handed out before a restart.
+        """
+        if max_id >= self._next_id:
+            # the first id after max_id that is still ours
+            steps = (max_id - self._next_id) // self._id_step + 1
+            self._next_id += steps * self._id_step
+
+    def forget_player(self, player_id):
+        """
+        Drops a player that another process has removed.
+        Players are only kept in memory here,
+        so this is the same as remove_player.
+        """
+        self.remove_player(player_id)
 
     def remove_player(self, player_id):
         name = self._players[player_id]["name"]
         del self._usernames[name]
         del self._players[player_id]
+
+    def close(self):
+        if self._hash_pool is not None:
+            self._hash_pool.terminate()
+            self._hash_pool.join()
+            self._hash_pool = None
+        self._hash_waiters.kill()
+
+    def _hash(self, func, *args):
+        if self._hash_pool is None:
+            self._hash_pool = multiprocessing.Pool(self._hash_processes)
+        return self._hash_waiters.apply(self._hash_pool.apply, (func, args))
+
+    def _get_player_data(self, player_id):
+        return self._players.get(player_id)
+
+    def _add_player(self, name, **credentials):
+        # Subclasses may yield while looking names up,
+        # so check again now that nothing else can run.
+        if name in self._usernames:
+            raise PlayerExistsError()
+
+        player_id = self._next_id
+        self._next_id += self._id_step
+
+        data = {
+            "id": player_id,
+            "name": name
+        }
+        data.update(credentials)
+        self._players[player_id] = data
+
+        self._usernames[name] = player_id
+
+        return player_id
+
+
+# module level, so that they can be sent to the hashing processes
+
+def _encrypt(password):
+    return pwd_context.encrypt(password)
+
+
+def _verify(password, password_hash):
+    return pwd_context.verify(password, password_hash)
+
+
+def _to_bytes(s):
+    if isinstance(s, unicode):
+        return s.encode("utf-8")
+    return s
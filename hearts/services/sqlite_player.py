@@ -0,0 +1,294 @@
+import logging
+import sqlite3
+import threading
+
+from gevent.event import Event
+from gevent.threadpool import ThreadPool
+
+from hearts.greenlets import spawn
+from hearts.services.player import PlayerService, PlayerExistsError, DEFAULT_HASH_PROCESSES
+
+
+DEFAULT_DB_THREADS = 2
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+
+# Guests have an empty password_hash and a session_token.
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    session_token TEXT
+)
+"""
+
+# databases from before guests were kept lack the column
+_ADD_SESSION_TOKEN = "ALTER TABLE players ADD COLUMN session_token TEXT"
+
+# These are kept constant so that sqlite3's statement cache
+# prepares each of them only once per connection.
+_SELECT_MAX_ID = "SELECT MAX(id) FROM players"
+_SELECT_BY_ID = "SELECT id, name, password_hash, session_token FROM players WHERE id = ?"
+_SELECT_BY_NAME = "SELECT id, name, password_hash, session_token FROM players WHERE name = ?"
+_SELECT_GUEST_IDS = "SELECT id FROM players WHERE session_token IS NOT NULL"
+_INSERT = "INSERT INTO players (id, name, password_hash, session_token) VALUES (?, ?, ?, ?)"
+_DELETE = "DELETE FROM players WHERE id = ?"
+
+
+class SqlitePlayerService(PlayerService):
+    """
+    A PlayerService that keeps players in a SQLite database,
+    so that accounts survive restarts
+    and every process sharing the database can find them.
+
+    Lookups go through the in-memory dicts of PlayerService first
+    and only fall back to the database on a miss.
+    New players are written in batches every flush_interval seconds.
+    All database work happens on a small pool of native threads,
+    each with its own connection.
+
+    Guests are written too, along with their session token,
+    so that they can sign back in to their game on any process
+    or after a restart.
+    remove_player deletes a guest from the database,
+    but only forgets registered players from the cache.
+    forget_player only ever forgets from the cache.
+
+    When several processes share the database,
+    two of them can hand out the same name before either has written it.
+    Whichever writes second has its player rejected by the database,
+    and that player is dropped.
+    With write_through set, new players are instead written
+    before create_player returns, and the loser of such a race
+    gets a PlayerExistsError like any other taken name.
+    """
+
+    def __init__(
+            self,
+            path,
+            db_threads=DEFAULT_DB_THREADS,
+            flush_interval=DEFAULT_FLUSH_INTERVAL,
+            hash_processes=DEFAULT_HASH_PROCESSES,
+            first_id=1,
+            id_step=1,
+            write_through=False):
+        super(SqlitePlayerService, self).__init__(hash_processes, first_id, id_step)
+        self._path = path
+        self._local = threading.local()
+        self._connections = []
+        self._closing = Event()
+        self._db_pool = ThreadPool(db_threads)
+        self._flush_interval = flush_interval
+        self._write_through = write_through
+        self.logger = logging.getLogger(__name__)
+
+        # player_id -> row waiting to be written
+        self._pending = {}
+
+        # ids of guests waiting to be deleted
+        self._deleted = set()
+
+        self._db_pool.apply(self._create_schema)
+        max_id = self._db_pool.apply(self._query_one, (_SELECT_MAX_ID, ()))[0]
+        if max_id is not None:
+            self.reserve_ids(max_id)
+
+        self._flush_greenlet = spawn(self._run_flushes)
+
+    def get_player_id(self, name):
+        player_id = self._usernames.get(name)
+        if player_id is None:
+            player_id = self._load(_SELECT_BY_NAME, name)
+        return player_id
+
+    def remove_player(self, player_id):
+        if "session_token" in self._players[player_id]:
+            super(SqlitePlayerService, self).remove_player(player_id)
+            self._deleted.add(player_id)
+        else:
+            self.forget_player(player_id)
+
+    def forget_player(self, player_id):
+        # Until they are written players have to stay in the cache,
+        # or their name would look free.
+        if player_id not in self._pending:
+            super(SqlitePlayerService, self).remove_player(player_id)
+
+    def flush(self):
+        """
+        Writes out every new player created so far
+        and deletes every guest removed so far,
+        blocking the calling greenlet until they are committed.
+        """
+        if not self._pending and not self._deleted:
+            return
+
+        deleted = set(self._deleted)
+        rows = self._pending.values()
+        rejected = self._db_pool.apply(
+            self._write_changes,
+            (deleted, [row for row in rows if row[0] not in deleted]))
+
+        self._deleted -= deleted
+        for row in rows:
+            if self._pending.get(row[0]) is row:
+                del self._pending[row[0]]
+
+        for row in rejected:
+            self._drop_rejected(row)
+
+    def purge_guests(self, keep=()):
+        """
+        Deletes every guest apart from those in keep,
+        for when the server starts and their sessions have ended.
+        Returns the number deleted.
+        """
+        keep = set(keep)
+        guest_ids = self._db_pool.apply(self._query_ids, (_SELECT_GUEST_IDS,))
+        purged = [x for x in guest_ids if x not in keep]
+        self._db_pool.apply(self._write_changes, (purged, []))
+        return len(purged)
+
+    def close(self):
+        # let a flush that is already running finish,
+        # or its rows would be written twice
+        self._closing.set()
+        self._flush_greenlet.join()
+        self.flush()
+
+        self._db_pool.join()
+        self._db_pool.kill()
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+        super(SqlitePlayerService, self).close()
+
+    def _get_player_data(self, player_id):
+        data = self._players.get(player_id)
+        if data is None and self._load(_SELECT_BY_ID, player_id) is not None:
+            data = self._players.get(player_id)
+        return data
+
+    def _add_player(self, name, **credentials):
+        player_id = super(SqlitePlayerService, self)._add_player(name, **credentials)
+
+        row = (player_id, name, credentials.get("password_hash", ""), credentials.get("session_token"))
+        if not self._write_through:
+            self._pending[player_id] = row
+            return player_id
+
+        # a guest removed earlier may still hold the name
+        deleted = set(self._deleted)
+        try:
+            rejected = self._db_pool.apply(self._write_changes, (deleted, [row]))
+        except Exception:
+            self._forget(player_id, name)
+            raise
+
+        self._deleted -= deleted
+        if rejected:
+            self._forget(player_id, name)
+            raise PlayerExistsError()
+
+        return player_id
+
+    def _drop_rejected(self, row):
+        player_id, name = row[:2]
+        self.logger.warning(
+            "Dropped new player %d (%s): another process has already registered the name or id.",
+            player_id,
+            name)
+        self._forget(player_id, name)
+
+    def _forget(self, player_id, name):
+        if player_id in self._players:
+            del self._players[player_id]
+        if self._usernames.get(name) == player_id:
+            del self._usernames[name]
+
+    def _load(self, query, key):
+        """
+        Looks a player up in the database and caches them.
+        Returns their id, or None if they do not exist.
+        """
+        row = self._db_pool.apply(self._query_one, (query, (key,)))
+        if row is None:
+            return None
+
+        player_id, name, password_hash, session_token = row
+
+        # a guest we have removed, but not yet deleted
+        if player_id in self._deleted:
+            return None
+
+        # Someone else may have cached them
+        # while we were waiting for the database.
+        if player_id not in self._players:
+            data = {
+                "id": player_id,
+                "name": name,
+            }
+            if session_token is not None:
+                data["session_token"] = session_token
+            else:
+                data["password_hash"] = str(password_hash)
+            self._players[player_id] = data
+            self._usernames[name] = player_id
+
+        return player_id
+
+    def _run_flushes(self):
+        while not self._closing.wait(self._flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # the changes stay pending and are retried next time
+                self.logger.error("Failed to write player changes.", exc_info=True)
+
+    # The methods below run on the database threads.
+
+    def _get_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # only ever used by this thread until close()
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def _create_schema(self):
+        conn = self._get_connection()
+        with conn:
+            conn.execute(_CREATE_TABLE)
+            columns = [x[1] for x in conn.execute("PRAGMA table_info(players)")]
+            if "session_token" not in columns:
+                conn.execute(_ADD_SESSION_TOKEN)
+
+    def _query_one(self, query, params):
+        return self._get_connection().execute(query, params).fetchone()
+
+    def _query_ids(self, query):
+        return [x[0] for x in self._get_connection().execute(query)]
+
+    def _write_changes(self, deleted, rows):
+        """
+        Deletes the players with the given ids,
+        then inserts the rows, in one transaction.
+        Returns the rows that were rejected because their
+        id or name is already taken, which can never succeed,
+        so that they do not hold up the others.
+        """
+        conn = self._get_connection()
+        rejected = []
+        with conn:
+            conn.executemany(_DELETE, [(x,) for x in deleted])
+            for row in rows:
+                try:
+                    conn.execute(_INSERT, row)
+                except sqlite3.IntegrityError:
+                    rejected.append(row)
+        return rejected
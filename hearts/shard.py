@@ -0,0 +1,504 @@
+"""
+Running the server as several worker processes on one machine.
+
+The parent process binds the listening socket, forks the workers
+and runs a ShardCoordinator.
+Every worker accepts connections on the shared socket
+and runs its own GameBackend, so games are spread across cores.
+
+Matchmaking happens in the coordinator,
+which the workers talk to over a Unix socket
+using newline-delimited JSON messages:
+
+    worker -> coordinator
+        {"type": "hello", "shard": 0, "games": [[12, [1, 2, 3, 4]]]}
+        {"type": "register", "player_id": 1, "rating": 1500}
+        {"type": "unregister", "player_id": 1}
+        {"type": "created", "game_id": 12}
+        {"type": "removed", "game_id": 12}
+
+    coordinator -> worker
+        {"type": "create_game", "game_id": 12, "players": [1, 2, 3, 4]}
+        {"type": "placed", "game_id": 12, "shard": 0, "players": [1, 2, 3, 4]}
+        {"type": "removed", "game_id": 12, "players": [1, 2, 3, 4]}
+
+Each worker keeps a copy of which worker runs every game.
+A player whose connection lands on a worker other than the one
+running their game is forwarded to it over that worker's own Unix socket:
+a JSON header line, then the websocket messages in each direction as
+
+    frame = u8 is_binary, u32 length, payload
+"""
+import json
+import logging
+import os
+import struct
+
+import gevent.queue as gq
+import gevent.socket as socket
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from gevent.server import StreamServer
+
+from hearts.greenlets import spawn
+from hearts.queue_backend import GameQueueBackend, PlayerUnregisteredError, DEFAULT_RATING
+import hearts.websocket_util as wsutil
+
+
+COORDINATOR_SOCKET_NAME = "coordinator.sock"
+
+_frame_header = struct.Struct(">BI")
+
+
+def get_coordinator_path(socket_dir):
+    return os.path.join(socket_dir, COORDINATOR_SOCKET_NAME)
+
+
+def get_shard_path(socket_dir, shard_index):
+    return os.path.join(socket_dir, "shard-%d.sock" % shard_index)
+
+
+def bind_unix_listener(path):
+    # a socket left over from a previous run would make bind fail
+    if os.path.exists(path):
+        os.unlink(path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    return listener
+
+
+def _encode_frame(data, binary):
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    return _frame_header.pack(1 if binary else 0, len(data)) + str(data)
+
+
+def _read_frame(f):
+    """
+    Returns (data, is_binary),
+    or None if the other end has gone away.
+    """
+    header = f.read(_frame_header.size)
+    if len(header) < _frame_header.size:
+        return None
+
+    binary, length = _frame_header.unpack(header)
+    data = f.read(length)
+    if len(data) < length:
+        return None
+
+    return data, bool(binary)
+
+
+class _Channel(object):
+    """
+    One end of a JSON lines connection.
+    Sends are queued and written by a single greenlet,
+    so messages from different greenlets never interleave.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        self._queue = gq.Queue()
+        self._writer = spawn(self._write_messages)
+
+    def send(self, msg):
+        self._queue.put(json.dumps(msg, separators=(",", ":")) + "\n")
+
+    def receive(self):
+        """
+        Returns the next message,
+        or None if the other end has gone away.
+        """
+        line = self._file.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        self._writer.kill()
+        self._sock.close()
+
+    def _write_messages(self):
+        for line in self._queue:
+            self._sock.sendall(line)
+
+
+class _ForwardedSocket(object):
+    """
+    Looks enough like a websocket for GameMaster
+    to serve a player forwarded from another worker.
+    """
+
+    def __init__(self, sock, f):
+        self._sock = sock
+        self._file = f
+        self._send_lock = Semaphore()
+
+    def receive(self):
+        frame = _read_frame(self._file)
+        if frame is None:
+            return None
+
+        data, binary = frame
+        if binary:
+            return data
+        return data.decode("utf-8")
+
+    def send(self, data, binary=False):
+        with self._send_lock:
+            self._sock.sendall(_encode_frame(data, binary))
+
+    def close(self):
+        # wakes up receive, and lets the other worker see it closed
+        self._sock.shutdown(socket.SHUT_RDWR)
+
+
+class ShardCoordinator(object):
+    """
+    Runs matchmaking for all the workers
+    and decides which worker each new game is created on.
+
+    The listener is bound by the caller,
+    so that it can be done before the workers are forked
+    and they can connect as soon as they are ready.
+
+    Game ids are unique across workers:
+    worker i gets ids i + 1, i + 1 + shard_count, ...
+    so the ids of games restored from a worker's checkpoint
+    can never clash with new ones.
+    """
+
+    def __init__(self, listener, shard_count, queue_factory=GameQueueBackend):
+        self._listener = listener
+        self._shard_count = shard_count
+        self.queue_backend = queue_factory(self)
+
+        # shard index -> _Channel
+        self._shards = {}
+
+        # player_id -> shard index the player is queued on
+        self._queued = {}
+
+        # game_id -> (shard index, players)
+        self._games = {}
+
+        self._next_game_ids = [i + 1 for i in range(shard_count)]
+
+        self._server = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self._server = StreamServer(self._listener, self._handle_connection, spawn=spawn)
+        self._server.start()
+
+    def stop(self):
+        self._server.stop()
+        for channel in self._shards.values():
+            channel.close()
+
+    def create_game(self, players):
+        shard = self._choose_shard(players)
+        game_id = self._next_game_ids[shard]
+        self._next_game_ids[shard] += self._shard_count
+
+        self._games[game_id] = (shard, list(players))
+        for player_id in players:
+            self._queued.pop(player_id, None)
+
+        # Players are only told where to go once the worker has the game,
+        # see the "created" message.
+        self._shards[shard].send({"type": "create_game", "game_id": game_id, "players": players})
+
+        return game_id
+
+    def _choose_shard(self, players):
+        """
+        Picks the worker most of the players are connected to,
+        so that as few of them as possible have to be forwarded.
+        Ties go to the worker with the fewest games.
+        """
+        games_per_shard = dict((shard, 0) for shard in self._shards)
+        for shard, _ in self._games.itervalues():
+            if shard in games_per_shard:
+                games_per_shard[shard] += 1
+
+        players_per_shard = dict((shard, 0) for shard in self._shards)
+        for player_id in players:
+            shard = self._queued.get(player_id)
+            if shard in players_per_shard:
+                players_per_shard[shard] += 1
+
+        return max(self._shards, key=lambda x: (players_per_shard[x], -games_per_shard[x]))
+
+    def _handle_connection(self, sock, address):
+        channel = _Channel(sock)
+        shard = None
+
+        try:
+            while True:
+                msg = channel.receive()
+                if msg is None:
+                    return
+
+                if msg["type"] == "hello":
+                    shard = msg["shard"]
+                    self._on_hello(shard, channel, msg["games"])
+                elif shard is None:
+                    self.logger.warning("Got message before hello, ignoring.")
+                else:
+                    self._receive_message(shard, msg)
+        finally:
+            if shard is not None and self._shards.get(shard) is channel:
+                self._on_shard_lost(shard)
+            channel.close()
+
+    def _on_hello(self, shard, channel, games):
+        self.logger.info("Worker %d connected with %d games.", shard, len(games))
+        self._shards[shard] = channel
+
+        # tell the new worker where every game is
+        for game_id, (game_shard, players) in self._games.iteritems():
+            channel.send({"type": "placed", "game_id": game_id, "shard": game_shard, "players": players})
+
+        for game_id, players in games:
+            self._games[game_id] = (shard, players)
+            self._next_game_ids[shard] = max(self._next_game_ids[shard], game_id + self._shard_count)
+            self._broadcast({"type": "placed", "game_id": game_id, "shard": shard, "players": players})
+
+    def _receive_message(self, shard, msg):
+        msg_type = msg["type"]
+        if msg_type == "register":
+            self._queued[msg["player_id"]] = shard
+            self.queue_backend.register(msg["player_id"], msg.get("rating", DEFAULT_RATING))
+        elif msg_type == "unregister":
+            if self._queued.get(msg["player_id"]) == shard:
+                del self._queued[msg["player_id"]]
+                self.queue_backend.unregister(msg["player_id"])
+        elif msg_type == "created":
+            game_shard, players = self._games[msg["game_id"]]
+            self._broadcast({"type": "placed", "game_id": msg["game_id"], "shard": game_shard, "players": players})
+        elif msg_type == "removed":
+            self._remove_game(msg["game_id"])
+        else:
+            self.logger.warning("Unknown message type '%s' from worker %d.", msg_type, shard)
+
+    def _on_shard_lost(self, shard):
+        self.logger.error("Lost connection to worker %d.", shard)
+        del self._shards[shard]
+
+        for player_id, queued_shard in self._queued.items():
+            if queued_shard == shard:
+                del self._queued[player_id]
+                self.queue_backend.unregister(player_id)
+
+        for game_id, (game_shard, _) in self._games.items():
+            if game_shard == shard:
+                self._remove_game(game_id)
+
+    def _remove_game(self, game_id):
+        game = self._games.pop(game_id, None)
+        if game is not None:
+            self._broadcast({"type": "removed", "game_id": game_id, "players": game[1]})
+
+    def _broadcast(self, msg):
+        for channel in self._shards.itervalues():
+            channel.send(msg)
+
+
+class ShardClient(object):
+    """
+    A worker's link to the coordinator and the other workers.
+
+    Stands in for the queue backend,
+    routes players to the worker running their game,
+    and serves players forwarded from other workers.
+    """
+
+    def __init__(self, socket_dir, shard_index, game_backend, player_svc):
+        self._socket_dir = socket_dir
+        self._shard_index = shard_index
+        self._game_backend = game_backend
+        self._player_svc = player_svc
+
+        # player_id -> AsyncResult, for players queued on this worker
+        self._clients = {}
+
+        # player_id -> shard index running their game
+        self._locations = {}
+
+        self._channel = None
+        self._reader = None
+        self._server = None
+        self.logger = logging.getLogger(__name__)
+
+        game_backend.add_observer(self)
+
+    def start(self, ws_handler):
+        """
+        Connects to the coordinator
+        and starts accepting players forwarded from other workers.
+        """
+        self._ws_handler = ws_handler
+
+        listener = bind_unix_listener(get_shard_path(self._socket_dir, self._shard_index))
+        self._server = StreamServer(listener, self._handle_forwarded, spawn=spawn)
+        self._server.start()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(get_coordinator_path(self._socket_dir))
+        self._channel = _Channel(sock)
+
+        games = self._game_backend.get_games()
+        for game_id, players in games.iteritems():
+            self._set_locations(players, self._shard_index)
+
+        self._channel.send({"type": "hello", "shard": self._shard_index, "games": games.items()})
+        self._reader = spawn(self._read_messages)
+
+    def stop(self):
+        self._server.stop()
+        self._reader.kill()
+        self._channel.close()
+
+    # queue backend interface
+
+    def register(self, player_id, rating=DEFAULT_RATING):
+        result = AsyncResult()
+        self._clients[player_id] = result
+        self._channel.send({"type": "register", "player_id": player_id, "rating": rating})
+        return result
+
+    def is_registered(self, player_id):
+        return player_id in self._clients
+
+    def get_queue_size(self):
+        """
+        Returns the number of players queued through this worker.
+        """
+        return len(self._clients)
+
+    def unregister(self, player_id):
+        result = self._clients.pop(player_id, None)
+        if result is not None:
+            self._channel.send({"type": "unregister", "player_id": player_id})
+            result.set_exception(PlayerUnregisteredError())
+
+    # routing
+
+    def get_player_shard(self, player_id):
+        return self._locations.get(player_id)
+
+    def forward(self, ws, player_id, player_name, protocol):
+        """
+        Relays messages between the player's websocket
+        and the worker running their game, until either end closes.
+        """
+        shard = self._locations.get(player_id)
+        if shard is None:
+            self.logger.info("Player %d's game has gone away, disconnecting.", player_id)
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(get_shard_path(self._socket_dir, shard))
+        except socket.error:
+            self.logger.error("Could not reach worker %d.", shard, exc_info=True)
+            sock.close()
+            return
+
+        header = {"player_id": player_id, "name": player_name, "protocol": protocol.name}
+        sock.sendall(json.dumps(header) + "\n")
+
+        def to_shard():
+            try:
+                while True:
+                    msg = ws.receive()
+                    if msg is None:
+                        break
+                    sock.sendall(_encode_frame(msg, not isinstance(msg, unicode)))
+
+                # lets the other worker see the player disconnect
+                sock.shutdown(socket.SHUT_WR)
+            except socket.error:
+                # the other worker has gone away,
+                # which the loop below will notice
+                pass
+
+        to_shard_greenlet = spawn(to_shard)
+
+        try:
+            f = sock.makefile("rb")
+            while True:
+                frame = _read_frame(f)
+                if frame is None:
+                    return
+                data, binary = frame
+                ws.send(data, binary=binary)
+        finally:
+            to_shard_greenlet.kill()
+            sock.close()
+
+    # game backend observer
+
+    def on_game_removed(self, game_id):
+        self._channel.send({"type": "removed", "game_id": game_id})
+
+    def _handle_forwarded(self, sock, address):
+        try:
+            # frames may already be buffered behind the header,
+            # so the same file has to be used to read them
+            f = sock.makefile("rb")
+            header = json.loads(f.readline())
+            protocol = wsutil.PROTOCOLS[header["protocol"]]
+            self._ws_handler.handle_forwarded(
+                _ForwardedSocket(sock, f),
+                header["player_id"],
+                header["name"],
+                protocol)
+        finally:
+            sock.close()
+
+    def _read_messages(self):
+        while True:
+            msg = self._channel.receive()
+            if msg is None:
+                self.logger.error("Lost connection to the coordinator.")
+                return
+
+            msg_type = msg["type"]
+            if msg_type == "create_game":
+                self._game_backend.create_game(msg["players"], msg["game_id"])
+                self._channel.send({"type": "created", "game_id": msg["game_id"]})
+            elif msg_type == "placed":
+                self._on_placed(msg["game_id"], msg["shard"], msg["players"])
+            elif msg_type == "removed":
+                self._on_removed(msg["players"])
+            else:
+                self.logger.warning("Unknown message type '%s' from coordinator.", msg_type)
+
+    def _on_placed(self, game_id, shard, players):
+        self._set_locations(players, shard)
+        for player_id in players:
+            result = self._clients.pop(player_id, None)
+            if result is not None:
+                result.set(game_id)
+
+    def _on_removed(self, players):
+        for player_id in players:
+            self._locations.pop(player_id, None)
+
+            # The worker that ran the game has removed its players.
+            # Those who signed in here have to be forgotten here too,
+            # unless they have already moved on.
+            if self._game_backend.is_in_game(player_id) or player_id in self._clients:
+                continue
+            if self._player_svc.get_player(player_id) is not None:
+                self._player_svc.forget_player(player_id)
+
+    def _set_locations(self, players, shard):
+        for player_id in players:
+            self._locations[player_id] = shard
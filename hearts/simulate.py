@@ -0,0 +1,293 @@
+"""
+Headless game simulator.
+
+Drives HeartsGame directly, without gevent or websockets,
+to measure model throughput and to generate game corpora.
+
+    python -m hearts.simulate -n 10000 -j 4 --players heuristic,random,random,random
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import hearts.model.game as m
+import hearts.util as u
+
+
+class RandomPlayer(object):
+    def __init__(self, rng):
+        self._rng = rng
+
+    def choose_pass(self, game, player_index):
+        return self._rng.sample(game.get_hand(player_index), 3)
+
+    def choose_card(self, game, player_index, legal_moves):
+        return self._rng.choice(legal_moves)
+
+
+class HeuristicPlayer(object):
+    """
+    Tries to avoid taking points:
+    passes its most dangerous cards,
+    ducks under the current winner when following suit
+    and dumps points when it cannot follow.
+    """
+
+    def __init__(self, rng):
+        self._rng = rng
+
+    def choose_pass(self, game, player_index):
+        hand = game.get_hand(player_index)
+        return sorted(hand, key=_danger, reverse=True)[:3]
+
+    def choose_card(self, game, player_index, legal_moves):
+        trick = game.get_trick()
+
+        if len(trick) == 0:
+            # lead low
+            return min(legal_moves, key=_rank)
+
+        lead_suit = u.CARD_SUITS[trick[0]["card"]]
+        if u.CARD_SUITS[legal_moves[0]] == lead_suit:
+            winning_card = trick[u.find_winning_index([x["card"] for x in trick])]["card"]
+            winning_rank = u.CARD_RANKS[winning_card]
+            ducks = [c for c in legal_moves if u.CARD_RANKS[c] < winning_rank]
+            if ducks:
+                return max(ducks, key=_rank)
+
+            if len(trick) == 3:
+                # we are taking this trick anyway,
+                # so take it with our biggest card.
+                return max(legal_moves, key=_rank)
+
+            return min(legal_moves, key=_rank)
+
+        # can't follow suit, get rid of something nasty
+        return max(legal_moves, key=_danger)
+
+
+PLAYER_TYPES = {
+    "random": RandomPlayer,
+    "heuristic": HeuristicPlayer,
+}
+
+
+def _rank(card):
+    return u.CARD_RANKS[card]
+
+
+def _danger(card):
+    return u.CARD_POINTS[card] * 100 + u.CARD_RANKS[card]
+
+
+class _GameRecorder(object):
+    def __init__(self, game, record_moves):
+        self.game = game
+        self.record_moves = record_moves
+        self.round_finished = False
+        self.rounds = []
+
+    def on_start_round(self, round_number):
+        self.round_finished = False
+        if self.record_moves:
+            self.rounds.append({"passes": None, "plays": []})
+
+    def on_finish_passing(self):
+        if self.record_moves:
+            passes = [self.game.get_passed_cards(i) for i in range(4)]
+            self.rounds[-1]["passes"] = passes
+
+    def on_play_card(self, player_index, card):
+        if self.record_moves:
+            self.rounds[-1]["plays"].append([player_index, card])
+
+    def on_finish_trick(self, winner, points):
+        pass
+
+    def on_finish_round(self, scores):
+        self.round_finished = True
+
+    def on_finish_game(self):
+        pass
+
+
+def play_game(player_types, seed, record_moves=False):
+    """
+    Plays a single game to completion.
+
+    Returns a dict describing the game,
+    including the final scores and the number of cards played.
+    """
+    rng = random.Random(seed)
+    players = [PLAYER_TYPES[name](rng) for name in player_types]
+
+    game = m.HeartsGame(deal_func=lambda: u.deal_hands(rng))
+    recorder = _GameRecorder(game, record_moves)
+    game.add_observer(recorder)
+
+    game.start()
+
+    moves = 0
+    round_count = 1
+
+    while game.get_state() != "game_over":
+        if game.get_state() == "passing":
+            for i, player in enumerate(players):
+                game.pass_cards(i, player.choose_pass(game, i))
+        elif recorder.round_finished:
+            if game.is_player_above_hundred():
+                game.end_game()
+            else:
+                game.start_next_round()
+                round_count += 1
+        else:
+            idx = game.get_current_player()
+            legal_moves = game.get_legal_moves(idx)
+            game.play_card(players[idx].choose_card(game, idx, legal_moves))
+            moves += 1
+
+    result = {
+        "seed": seed,
+        "players": list(player_types),
+        "scores": game.get_scores(),
+        "moves": moves,
+        "rounds": round_count,
+    }
+
+    if record_moves:
+        result["history"] = recorder.rounds
+
+    return result
+
+
+def _play_batch(args):
+    player_types, seeds, record_moves = args
+    return [play_game(player_types, seed, record_moves) for seed in seeds]
+
+
+def run_games(player_types, count, seed=None, processes=1, record_moves=False):
+    """
+    Plays count games, spread across a pool of processes.
+    Returns the list of game results, in seed order.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    seeds = [seed + i for i in range(count)]
+
+    if processes <= 1:
+        return _play_batch((player_types, seeds, record_moves))
+
+    # a few chunks per process keeps the pool busy
+    # without paying for a round trip per game.
+    chunk_count = processes * 4
+    chunks = [seeds[i::chunk_count] for i in range(chunk_count)]
+    jobs = [(player_types, chunk, record_moves) for chunk in chunks if chunk]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        batches = pool.map(_play_batch, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = [result for batch in batches for result in batch]
+    results.sort(key=lambda x: x["seed"])
+    return results
+
+
+def summarize(results, elapsed):
+    games = len(results)
+    moves = sum(r["moves"] for r in results)
+
+    seats = []
+    for i in range(4):
+        scores = sorted(r["scores"][i] for r in results)
+        wins = sum(1 for r in results if r["scores"][i] == min(r["scores"]))
+        seats.append({
+            "player": results[0]["players"][i] if results else None,
+            "mean": float(sum(scores)) / games if games else 0.0,
+            "min": scores[0] if scores else 0,
+            "p50": _percentile(scores, 50),
+            "p90": _percentile(scores, 90),
+            "max": scores[-1] if scores else 0,
+            "wins": wins,
+        })
+
+    return {
+        "games": games,
+        "moves": moves,
+        "rounds": sum(r["rounds"] for r in results),
+        "elapsed": elapsed,
+        "games_per_sec": games / elapsed if elapsed else 0.0,
+        "moves_per_sec": moves / elapsed if elapsed else 0.0,
+        "seats": seats,
+    }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    idx = int(round((len(sorted_values) - 1) * pct / 100.0))
+    return sorted_values[idx]
+
+
+def _print_summary(summary, out):
+    out.write("games:       %d (%d rounds, %d moves)\n"
+              % (summary["games"], summary["rounds"], summary["moves"]))
+    out.write("elapsed:     %.3fs\n" % summary["elapsed"])
+    out.write("games/sec:   %.1f\n" % summary["games_per_sec"])
+    out.write("moves/sec:   %.1f\n" % summary["moves_per_sec"])
+    out.write("\n")
+    out.write("seat  player      mean    min  p50  p90  max   wins\n")
+    for i, seat in enumerate(summary["seats"]):
+        out.write("%-4d  %-10s %6.1f  %4d %4d %4d %4d  %5d\n" % (
+            i, seat["player"], seat["mean"], seat["min"],
+            seat["p50"], seat["p90"], seat["max"], seat["wins"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate hearts games without a server.")
+    parser.add_argument("-n", "--games", type=int, default=1000,
+                        help="number of games to play")
+    parser.add_argument("-j", "--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("--players", default="heuristic,random,random,random",
+                        help="comma-separated player types, one per seat (%s)"
+                        % ", ".join(sorted(PLAYER_TYPES)))
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the first game, later games use seed+1, seed+2...")
+    parser.add_argument("--corpus", default=None,
+                        help="write every game, including passes and plays, to this file as JSON lines")
+    parser.add_argument("--json", action="store_true",
+                        help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    player_types = args.players.split(",")
+    if len(player_types) != 4 or any(p not in PLAYER_TYPES for p in player_types):
+        parser.error("--players needs four of: %s" % ", ".join(sorted(PLAYER_TYPES)))
+
+    start = time.time()
+    results = run_games(player_types, args.games, args.seed,
+                        args.processes, args.corpus is not None)
+    elapsed = time.time() - start
+
+    if args.corpus is not None:
+        with open(args.corpus, "w") as f:
+            for result in results:
+                f.write(json.dumps(result, separators=(",", ":")))
+                f.write("\n")
+
+    summary = summarize(results, elapsed)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        _print_summary(summary, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
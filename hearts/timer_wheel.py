@@ -0,0 +1,169 @@
+"""
+A hashed timing wheel, for keeping large numbers of deadlines
+without a greenlet or libev timer for each one.
+
+Time is split into ticks of tick seconds.
+The wheel has a fixed number of slots,
+and a timer due in n ticks goes in slot (cursor + n) % slots,
+along with how many more times the wheel has to go round
+before it is due.
+Scheduling and cancelling are O(1),
+and each tick only looks at the timers in one slot.
+
+A single greenlet turns the wheel while any timers are pending,
+so timers fire up to one tick late.
+"""
+from collections import OrderedDict
+import logging
+import time
+
+import gevent
+
+from hearts.greenlets import spawn
+
+
+DEFAULT_TICK = 0.1
+
+DEFAULT_SLOTS = 512
+
+
+class Timer(object):
+    __slots__ = ["_wheel", "_slot", "_rounds", "_callback", "_args"]
+
+    def __init__(self, wheel, slot, rounds, callback, args):
+        self._wheel = wheel
+        self._slot = slot
+        self._rounds = rounds
+        self._callback = callback
+        self._args = args
+
+    def cancel(self):
+        """
+        Stops the timer from firing.
+        Does nothing if it has already fired or been cancelled.
+        """
+        if self._wheel is not None:
+            self._wheel._remove(self)
+
+    def is_pending(self):
+        return self._wheel is not None
+
+
+class TimerWheel(object):
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, clock=time.time):
+        self._tick = tick
+        self._clock = clock
+
+        # slot -> OrderedDict of Timer -> None, in the order they were scheduled
+        self._slots = [OrderedDict() for _ in range(slots)]
+        self._cursor = 0
+        self._count = 0
+
+        # time at which the slot under the cursor is next processed
+        self._next_tick_at = None
+        self._greenlet = None
+
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self):
+        return self._count
+
+    def now(self):
+        """
+        Returns the current time by the wheel's clock.
+        """
+        return self._clock()
+
+    def schedule(self, delay, callback, *args):
+        """
+        Calls callback(*args) after delay seconds.
+        Returns a Timer, which can be used to cancel it.
+        """
+        if self._count == 0:
+            # the wheel has been standing still, so bring it up to date
+            self._next_tick_at = self._clock() + self._tick
+
+        # ticks from the next one to be processed,
+        # rounding up so that timers never fire early
+        ticks = max(int(-(-(delay - (self._next_tick_at - self._clock())) // self._tick)), 0)
+
+        slot_count = len(self._slots)
+        slot = (self._cursor + ticks) % slot_count
+        timer = Timer(self, slot, ticks // slot_count, callback, args)
+        self._slots[slot][timer] = None
+        self._count += 1
+
+        if self._greenlet is None:
+            self._greenlet = spawn(self._run)
+
+        return timer
+
+    def advance(self):
+        """
+        Processes every tick that has come due, firing expired timers.
+        Returns the number of timers fired.
+        """
+        fired = 0
+        now = self._clock()
+        while self._count > 0 and self._next_tick_at <= now:
+            slot = self._slots[self._cursor]
+
+            # Move on before firing anything,
+            # so that callbacks scheduling new timers
+            # never put them in the slot being processed.
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            self._next_tick_at += self._tick
+
+            fired += self._process_slot(slot)
+        return fired
+
+    def stop(self):
+        """
+        Cancels every pending timer.
+        """
+        for slot in self._slots:
+            for timer in slot:
+                timer._wheel = None
+            slot.clear()
+        self._count = 0
+
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _process_slot(self, slot):
+        due = []
+        for timer in slot:
+            if timer._rounds == 0:
+                due.append(timer)
+            else:
+                timer._rounds -= 1
+
+        fired = 0
+        for timer in due:
+            # an earlier callback may have cancelled it
+            if timer._wheel is None:
+                continue
+
+            self._remove(timer)
+            fired += 1
+            try:
+                timer._callback(*timer._args)
+            except Exception:
+                self.logger.error("Timer callback failed.", exc_info=True)
+
+        return fired
+
+    def _remove(self, timer):
+        del self._slots[timer._slot][timer]
+        timer._wheel = None
+        self._count -= 1
+
+    def _run(self):
+        try:
+            while self._count > 0:
+                gevent.sleep(max(self._next_tick_at - self._clock(), 0))
+                self.advance()
+        finally:
+            self._greenlet = None
@@ -1,21 +1,69 @@
-from random import shuffle
-
 import random
 import string
 
 
-def gen_temp_password():
-    return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
+_token_rng = random.SystemRandom()
+
+
+def gen_session_token():
+    return "".join(_token_rng.choice(string.ascii_letters + string.digits) for _ in range(24))
+
 
+SUITS = ["c", "s", "d", "h"]
 
 DECK = [s + str(num)
-        for s in ["c", "s", "d", "h"]
+        for s in SUITS
         for num in range(1, 11) + ["j", "q", "k"]]
 
+# Card sets can also be represented as 52-bit integers,
+# where card DECK[i] is bit i.
+# Each suit occupies a contiguous block of 13 bits.
+CARD_INDICES = dict((card, idx) for idx, card in enumerate(DECK))
+
+CARD_BITS = dict((card, 1 << idx) for idx, card in enumerate(DECK))
+
+SUIT_MASKS = dict((suit, ((1 << 13) - 1) << (13 * idx))
+                  for idx, suit in enumerate(SUITS))
+
+FULL_DECK_MASK = (1 << len(DECK)) - 1
+
+# Per-card lookup tables, so that trick resolution
+# never has to pick apart card strings.
+_NUMERIC_RANKS = {"j": 11, "q": 12, "k": 13, "1": 14}
+
+CARD_SET = frozenset(DECK)
+
+CARD_SUITS = dict((card, card[0]) for card in DECK)
+
+CARD_RANKS = dict((card, _NUMERIC_RANKS.get(card[1:]) or int(card[1:]))
+                  for card in DECK)
+
+CARD_POINTS = dict((card, 1 if card[0] == "h" else 0) for card in DECK)
+CARD_POINTS["sq"] = 13
+
+
+def card_to_bit(card):
+    try:
+        return CARD_BITS.get(card, 0)
+    except TypeError:
+        # unhashable things are never cards
+        return 0
+
 
-def deal_hands():
+def cards_to_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card]
+    return mask
+
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+
+def deal_hands(rng=random):
     deck_copy = DECK[:]
-    shuffle(deck_copy)
+    rng.shuffle(deck_copy)
 
     hands = [
         deck_copy[:13],
@@ -27,21 +75,22 @@ def deal_hands():
 
 
 def is_card(identifier):
-    return identifier in DECK
+    try:
+        return identifier in CARD_SET
+    except TypeError:
+        return False
 
 
 def find_winning_index(cards):
-    parsed_cards = map(_parse_card, cards)
-
-    lead_suit = parsed_cards[0][0]
+    lead_suit = CARD_SUITS[cards[0]]
 
     winner_rank = 0
     winner_index = -1
 
-    for (index, (suit, rank)) in enumerate(parsed_cards):
-        if suit != lead_suit:
+    for index, card in enumerate(cards):
+        if CARD_SUITS[card] != lead_suit:
             continue
-        numeric_rank = _get_numeric_rank(rank)
+        numeric_rank = CARD_RANKS[card]
         if numeric_rank > winner_rank:
             winner_rank = numeric_rank
             winner_index = index
@@ -50,7 +99,7 @@ def find_winning_index(cards):
 
 
 def sum_points(cards):
-    return sum(map(_point_value, cards))
+    return sum(CARD_POINTS[card] for card in cards)
 
 
 def get_pass_direction(round_number):
@@ -72,33 +121,3 @@ def get_pass_offset(direction):
 
 def get_suit(card):
     return card[0]
-
-
-def _get_numeric_rank(str_rank):
-    if str_rank == "j":
-        return 11
-    if str_rank == "q":
-        return 12
-    if str_rank == "k":
-        return 13
-    if str_rank == "1":
-        return 14
-
-    return int(str_rank)
-
-
-def _parse_card(card):
-    suit = card[0]
-    rank = card[1:]
-    return suit, rank
-
-
-def _point_value(card):
-    if card == "sq":
-        return 13
-
-    suit, rank = _parse_card(card)
-    if suit == "h":
-        return 1
-
-    return 0
@@ -1,36 +1,233 @@
 import json
 import logging
 
+import hearts.binary_protocol as binary
+
 logger = logging.getLogger(__name__)
 
-def send_ws_event(ws, event_type, data=None):
+
+class JsonCodec(object):
+    """
+    A JSON implementation used to encode and decode frames.
+
+    dumps must produce compact output that any JSON parser accepts,
+    and loads must accept anything a standard encoder produces.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _make_ujson_codec():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+    return JsonCodec("ujson", dumps, ujson.loads)
+
+
+def _make_stdlib_codec():
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    decoder = json.JSONDecoder()
+    return JsonCodec("json", encoder.encode, decoder.decode)
+
+
+# in order of preference
+CODEC_FACTORIES = [
+    ("ujson", _make_ujson_codec),
+    ("json", _make_stdlib_codec),
+]
+
+
+def get_available_codecs():
+    """
+    Returns every codec that can be loaded here,
+    fastest first.
+    """
+    codecs = []
+    for _, factory in CODEC_FACTORIES:
+        try:
+            codecs.append(factory())
+        except ImportError:
+            continue
+    return codecs
+
+
+def select_codec(name=None):
+    """
+    Returns the named codec,
+    or the fastest available one if no name is given.
+    """
+    for codec_name, factory in CODEC_FACTORIES:
+        if name is None or name == codec_name:
+            try:
+                return factory()
+            except ImportError:
+                if name is not None:
+                    raise
+    raise ValueError("Unknown codec: " + str(name))
+
+
+def set_codec(codec):
+    global _codec
+    _codec = codec
+
+
+def get_codec():
+    return _codec
+
+
+_codec = select_codec()
+
+
+def encode_event(event_type, data=None):
+    """
+    Encodes an event into a wire frame.
+
+    The frame can be sent to any number of websockets
+    with send_ws_frame, so an event going to several players
+    only needs to be encoded once.
+    """
     if data is None:
         d = {"type": event_type}
     else:
         d = data.copy()
         d["type"] = event_type
 
-    wire_str = json.dumps(d)
-    ws.send(wire_str)
-    logger.debug("Sent: %s", wire_str)
+    return _codec.dumps(d)
+
 
+def _decode_json(wire_str):
+    return _codec.loads(wire_str)
 
-def receive_ws_event(ws):
+
+def _encode_json_value(value):
+    return _codec.dumps(value)
+
+
+def _encode_json_query_success(command_id, encoded_data):
+    return '{"type":"query_success","command_id":%s,"data":%s}' % (
+        _codec.dumps(command_id), encoded_data)
+
+
+class Protocol(object):
+    """
+    A wire format a client can choose to talk in.
+
+    encode_event(event_type, data) returns a frame,
+    and decode(frame) returns the message it holds.
+    If the protocol lets several events share one frame,
+    join_frames(frames) combines encoded events into a single frame.
+    Otherwise it is None.
+
+    encode_value(value) encodes a query result on its own,
+    and encode_query_success(command_id, encoded_value)
+    wraps it in a reply, so that results can be encoded once
+    and reused for several queries.
+    """
+
+    def __init__(
+            self,
+            name,
+            encode_event,
+            decode,
+            encode_value,
+            encode_query_success,
+            binary,
+            join_frames=None):
+        self.name = name
+        self.encode_event = encode_event
+        self.decode = decode
+        self.encode_value = encode_value
+        self.encode_query_success = encode_query_success
+        self.binary = binary
+        self.join_frames = join_frames
+
+
+def _join_json_frames(frames):
+    return "[" + ",".join(frames) + "]"
+
+
+JSON_PROTOCOL = Protocol(
+    "json",
+    encode_event,
+    _decode_json,
+    _encode_json_value,
+    _encode_json_query_success,
+    False)
+
+# Like JSON, except that a frame sent to the client
+# may be an array of events instead of a single one.
+JSON_BATCHED_PROTOCOL = Protocol(
+    "json_batched",
+    encode_event,
+    _decode_json,
+    _encode_json_value,
+    _encode_json_query_success,
+    False,
+    _join_json_frames)
+
+BINARY_PROTOCOL = Protocol(
+    "binary",
+    binary.encode_event,
+    binary.decode_message,
+    binary.encode_value,
+    binary.encode_query_success,
+    True,
+    "".join)
+
+PROTOCOLS = {
+    JSON_PROTOCOL.name: JSON_PROTOCOL,
+    JSON_BATCHED_PROTOCOL.name: JSON_BATCHED_PROTOCOL,
+    BINARY_PROTOCOL.name: BINARY_PROTOCOL,
+}
+
+
+def send_ws_frame(ws, frame, protocol=JSON_PROTOCOL):
+    if protocol.binary:
+        ws.send(frame, binary=True)
+    else:
+        ws.send(frame)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sent: %r", frame)
+
+
+def send_ws_event(ws, event_type, data=None, protocol=JSON_PROTOCOL):
+    send_ws_frame(ws, protocol.encode_event(event_type, data), protocol)
+
+
+def receive_ws_event(ws, protocol=JSON_PROTOCOL):
     data = ws.receive()
     if data is None:
         return None
 
-    logger.debug("Received: %s", data)
-    return json.loads(data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received: %r", data)
+    return protocol.decode(data)
+
+
+def send_command_fail(ws, command_id, protocol=JSON_PROTOCOL):
+    send_ws_event(ws, "command_fail", {"command_id": command_id}, protocol)
 
 
-def send_command_fail(ws, command_id):
-    send_ws_event(ws, "command_fail", {"command_id": command_id})
+def send_command_success(ws, command_id, extra=None, protocol=JSON_PROTOCOL):
+    data = {"command_id": command_id}
+    if extra is not None:
+        data.update(extra)
+    send_ws_event(ws, "command_success", data, protocol)
 
 
-def send_command_success(ws, command_id):
-    send_ws_event(ws, "command_success", {"command_id": command_id})
+def send_query_success(ws, command_id, data, protocol=JSON_PROTOCOL):
+    send_ws_event(ws, "query_success", {"command_id": command_id, "data": data}, protocol)
 
 
-def send_query_success(ws, command_id, data):
-    send_ws_event(ws, "query_success", {"command_id": command_id, "data": data})
+def send_encoded_query_success(ws, command_id, encoded_data, protocol=JSON_PROTOCOL):
+    """
+    Like send_query_success,
+    but takes data already encoded by protocol.encode_value.
+    """
+    send_ws_frame(ws, protocol.encode_query_success(command_id, encoded_data), protocol)
@@ -0,0 +1,184 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import hearts.archive as a
+import hearts.journal as j
+import hearts.model.game as m
+import hearts.util as u
+
+
+class _RoundWatcher(object):
+    def __init__(self):
+        self.round_finished = False
+
+    def on_start_round(self, round_number):
+        self.round_finished = False
+
+    def on_finish_passing(self):
+        pass
+
+    def on_play_card(self, player_index, card):
+        pass
+
+    def on_finish_trick(self, winner, points):
+        pass
+
+    def on_finish_round(self, scores):
+        self.round_finished = True
+
+    def on_finish_game(self):
+        pass
+
+
+def play_journalled_game(journal, game_id, seed):
+    """
+    Plays a whole game, always choosing the first legal move,
+    and returns its final scores.
+    """
+    rng = random.Random(seed)
+    game = m.HeartsGame(deal_func=lambda: u.deal_hands(rng))
+    watcher = _RoundWatcher()
+    game.add_observer(watcher)
+    game.add_observer(j.JournalRecorder(journal, game_id, game))
+
+    journal.record_game_start(game_id, seed, [1, 2, 3, 4])
+    game.start()
+
+    while game.get_state() != "game_over":
+        if game.get_state() == "passing":
+            for i in range(4):
+                game.pass_cards(i, game.get_hand(i)[:3])
+        elif watcher.round_finished:
+            if game.is_player_above_hundred():
+                game.end_game()
+            else:
+                game.start_next_round()
+        else:
+            player = game.get_current_player()
+            game.play_card(game.get_legal_moves(player)[0])
+
+    return game.get_scores()
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.dir, "games.journal")
+        self.archive_dir = os.path.join(self.dir, "archive")
+        self.journal = j.GameJournal(self.journal_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _build(self, segment_size=a.DEFAULT_SEGMENT_SIZE):
+        self.journal.close()
+        a.build_archive([self.journal_path], self.archive_dir, segment_size)
+        reader = a.ArchiveReader(self.archive_dir)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_get_game_and_replay(self):
+        scores = {}
+        for game_id in [5, 2, 9]:
+            scores[game_id] = play_journalled_game(self.journal, game_id, game_id * 100)
+
+        reader = self._build()
+
+        self.assertEqual(3, len(reader))
+        for game_id in [2, 5, 9]:
+            records = reader.get_game(game_id)
+            self.assertEqual("game_start", records[0]["type"])
+            self.assertEqual(scores[game_id], records[-1]["scores"])
+
+            game = a.replay_game(records)
+            self.assertEqual("game_over", game.get_state())
+            self.assertEqual(scores[game_id], game.get_scores())
+
+    def test_missing_game(self):
+        play_journalled_game(self.journal, 5, 1)
+        reader = self._build()
+
+        self.assertIsNone(reader.get_game(4))
+        self.assertIsNone(reader.get_game(6))
+
+    def test_unfinished_games_skipped(self):
+        self.journal.record_game_start(1, 10, [1, 2, 3, 4])
+        self.journal.record_start_round(1, 0)
+        self.journal.record_game_start(2, 10, [1, 2, 3, 4])
+        self.journal.record_abandoned(2)
+
+        reader = self._build()
+
+        self.assertEqual(1, len(reader))
+        self.assertIsNone(reader.get_game(1))
+        self.assertEqual("abandoned", reader.get_game(2)[-1]["type"])
+
+    def test_iter_range(self):
+        for game_id in range(1, 11):
+            self.journal.record_game_start(game_id, game_id, [1, 2, 3, 4])
+            self.journal.record_abandoned(game_id)
+
+        # small segments, so the range spans several files
+        reader = self._build(segment_size=100)
+        self.assertTrue(os.path.exists(os.path.join(self.archive_dir, "segment-00002.dat")))
+
+        ids = [game_id for game_id, _, _ in reader.iter_range(3, 7)]
+        self.assertEqual([3, 4, 5, 6, 7], ids)
+
+        for game_id, run_id, data in reader.iter_range(3, 4):
+            self.assertEqual(self.journal.run_id, run_id)
+            self.assertIsInstance(data, buffer)
+            records = list(j.decode_records(data))
+            self.assertEqual(game_id, records[0][1])
+
+        self.assertEqual(10, len(list(reader.iter_range())))
+
+    def test_reused_game_id(self):
+        self.journal.record_game_start(1, 10, [1, 2, 3, 4])
+        self.journal.record_abandoned(1)
+        self.journal.record_game_start(1, 20, [5, 6, 7, 8])
+        self.journal.record_abandoned(1)
+
+        reader = self._build()
+
+        self.assertEqual([5, 6, 7, 8], reader.get_game(1)[0]["players"])
+
+    def test_game_id_reused_across_runs(self):
+        first_run = self.journal.run_id
+        self.journal.record_game_start(1, 10, [1, 2, 3, 4])
+        self.journal.record_abandoned(1)
+        self.journal.close()
+
+        self.journal = j.GameJournal(self.journal_path, run_id=first_run + 1)
+        self.journal.record_game_start(1, 20, [5, 6, 7, 8])
+        self.journal.record_abandoned(1)
+
+        reader = self._build()
+
+        self.assertEqual([first_run, first_run + 1], reader.get_runs(1))
+        self.assertEqual([1, 2, 3, 4], reader.get_game(1, first_run)[0]["players"])
+        self.assertEqual([5, 6, 7, 8], reader.get_game(1, first_run + 1)[0]["players"])
+        self.assertEqual([5, 6, 7, 8], reader.get_game(1)[0]["players"])
+        self.assertIsNone(reader.get_game(1, first_run + 2))
+
+    def test_restored_game_keeps_its_run(self):
+        first_run = self.journal.run_id
+        self.journal.record_game_start(1, 10, [1, 2, 3, 4])
+        self.journal.close()
+
+        # restored from a checkpoint, the game finishes in the next run
+        self.journal = j.GameJournal(self.journal_path, run_id=first_run + 1)
+        self.journal.record_abandoned(1)
+
+        reader = self._build()
+
+        self.assertEqual([first_run], reader.get_runs(1))
+        self.assertEqual(["game_start", "abandoned"], [x["type"] for x in reader.get_game(1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
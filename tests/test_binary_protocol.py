@@ -0,0 +1,97 @@
+import json
+import unittest
+
+import hearts.binary_protocol as bp
+import hearts.util as u
+
+
+class TestBinaryProtocol(unittest.TestCase):
+
+    def assertRoundTrip(self, message):
+        frame = bp.encode_message(message)
+        self.assertEqual(message, bp.decode_message(frame))
+
+    def test_play_card(self):
+        self.assertRoundTrip({"type": "play_card", "player": 2, "card": "h10"})
+
+    def test_command(self):
+        self.assertRoundTrip({"type": "pass_card", "command_id": 300, "cards": ["c2", "sq", "h1"]})
+
+    def test_full_deck(self):
+        self.assertRoundTrip({"type": "start_round", "round_number": 3, "hand": list(u.DECK)})
+
+    def test_values(self):
+        self.assertRoundTrip({
+            "type": "query_success",
+            "command_id": 1,
+            "data": {
+                "none": None,
+                "true": True,
+                "false": False,
+                "small": -5,
+                "medium": 100000,
+                "large": 1 << 40,
+                "float": 1.5,
+                "name": u"J\xf6rg",
+                "empty": [],
+                "mixed": [1, "c2", None],
+                "nested": {"trick": [{"player": 0, "card": "d5"}]},
+            }
+        })
+
+    def test_unknown_names(self):
+        self.assertRoundTrip({"type": "something_new", "some_field": "value"})
+
+    def test_encode_event(self):
+        frame = bp.encode_event("play_card", {"player": 1, "card": "sq"})
+        expected = {"type": "play_card", "player": 1, "card": "sq"}
+        self.assertEqual(expected, bp.decode_message(frame))
+
+    def test_encode_event_no_data(self):
+        frame = bp.encode_event("connected_to_game")
+        self.assertEqual({"type": "connected_to_game"}, bp.decode_message(frame))
+
+    def test_encode_query_success(self):
+        encoded = bp.encode_value({"hand": ["c2", "d3"], "round_number": 2})
+        frame = bp.encode_query_success(300, encoded)
+
+        expected = {
+            "type": "query_success",
+            "command_id": 300,
+            "data": {"hand": ["c2", "d3"], "round_number": 2}
+        }
+        self.assertEqual(expected, bp.decode_message(frame))
+
+    def test_smaller_than_json(self):
+        message = {"type": "start_round", "round_number": 1, "hand": u.DECK[:13]}
+        self.assertLess(len(bp.encode_message(message)), len(json.dumps(message)) / 2)
+
+    def test_multiple_messages(self):
+        first = {"type": "play_card", "player": 1, "card": "c3"}
+        second = {"type": "command_success", "command_id": 7}
+        frame = bp.encode_message(first) + bp.encode_message(second)
+
+        self.assertEqual([first, second], bp.decode_frame(frame))
+        self.assertRaises(bp.ProtocolError, bp.decode_message, frame)
+
+    def test_bytearray(self):
+        message = {"type": "play_card", "player": 1, "card": "c3"}
+        frame = bytearray(bp.encode_message(message))
+        self.assertEqual(message, bp.decode_message(frame))
+
+    def test_truncated(self):
+        frame = bp.encode_message({"type": "play_card", "player": 1, "card": "c3"})
+        for i in range(1, len(frame)):
+            self.assertRaises(bp.ProtocolError, bp.decode_frame, frame[:i])
+
+    def test_bad_tag(self):
+        frame = bp.encode_message({"type": "play_card", "player": 1})
+        frame = frame[:-2] + chr(200) + frame[-1:]
+        self.assertRaises(bp.ProtocolError, bp.decode_frame, frame)
+
+    def test_unencodable(self):
+        self.assertRaises(bp.ProtocolError, bp.encode_message, {"type": "play_card", "card": object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+import hearts.checkpoint as c
+from hearts.game_backend import GameBackend
+from hearts.services.sqlite_player import SqlitePlayerService
+
+
+def pass_and_play(game, plays):
+    for i in range(4):
+        game.pass_cards(i, game.get_hand(i)[:3])
+    for _ in range(plays):
+        game.play_card(game.get_legal_moves(game.get_current_player())[0])
+
+
+class TestGameCheckpointer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "games.checkpoint")
+        self.backend = GameBackend(Mock())
+        self.checkpointer = c.GameCheckpointer(self.path, self.backend)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _line_count(self):
+        with open(self.path, "rb") as f:
+            return len(f.readlines())
+
+    def _restart(self):
+        backend = GameBackend(Mock())
+        checkpointer = c.GameCheckpointer(self.path, backend)
+        count = checkpointer.restore()
+        return backend, count
+
+    def test_restore(self):
+        game_id = self.backend.create_game([1, 2, 3, 4])
+        game = self.backend.get_game_master(game_id)._game
+        pass_and_play(game, 6)
+        self.checkpointer.checkpoint()
+
+        backend, count = self._restart()
+
+        self.assertEqual(1, count)
+        self.assertEqual((game_id, 2), backend.try_get_game_info(3))
+        restored = backend.get_game_master(game_id)._game
+        self.assertEqual(game.get_trick(), restored.get_trick())
+        for i in range(4):
+            self.assertEqual(game.get_hand(i), restored.get_hand(i))
+
+        # new games must not reuse the restored id
+        self.assertEqual(game_id + 1, backend.create_game([5, 6, 7, 8]))
+
+    def test_restart_keeps_players(self):
+        players = SqlitePlayerService(os.path.join(self.dir, "players.db"))
+        alice = players.create_player("alice", "secret")
+        guests, tokens = zip(*[players.create_guest_player("guest%d" % i) for i in range(3)])
+        guests = list(guests)
+        backend = GameBackend(players)
+        game_id = backend.create_game(guests + [alice])
+        c.GameCheckpointer(self.path, backend).checkpoint()
+        players.close()
+
+        players = SqlitePlayerService(os.path.join(self.dir, "players.db"))
+        self.addCleanup(players.close)
+
+        # one guest is gone, so their seat stays empty
+        players.purge_guests(guests[:2])
+
+        backend = GameBackend(players)
+        c.GameCheckpointer(self.path, backend).restore()
+
+        self.assertEqual((game_id, 3), backend.try_get_game_info(alice))
+        self.assertEqual((game_id, 1), backend.try_get_game_info(guests[1]))
+        self.assertTrue(players.auth_player(guests[1], tokens[1]))
+        self.assertFalse(backend.is_in_game(guests[2]))
+
+        # a new guest must not be given a seat from before the restart
+        stranger, _ = players.create_guest_player("stranger")
+        self.assertNotIn(stranger, guests + [alice])
+        self.assertFalse(backend.is_in_game(stranger))
+
+        backend.on_game_abandoned(game_id)
+        self.assertFalse(backend.is_in_game(alice))
+
+    def test_checkpointed_players(self):
+        self.backend.create_game([1, 2, 3, 4])
+        self.checkpointer.checkpoint()
+
+        other_path = os.path.join(self.dir, "other.checkpoint")
+        backend = GameBackend(Mock())
+        backend.create_game([5, 6, 7, 8])
+        c.GameCheckpointer(other_path, backend).checkpoint()
+
+        missing_path = os.path.join(self.dir, "missing.checkpoint")
+        players = c.get_checkpointed_players([self.path, other_path, missing_path])
+        self.assertEqual(set(range(1, 9)), players)
+
+    def test_later_rounds_deal_the_same(self):
+        game_id = self.backend.create_game([1, 2, 3, 4])
+        game = self.backend.get_game_master(game_id)._game
+        pass_and_play(game, 52)
+        self.checkpointer.checkpoint()
+
+        backend, _ = self._restart()
+        restored = backend.get_game_master(game_id)._game
+
+        game.start_next_round()
+        restored.start_next_round()
+        for i in range(4):
+            self.assertEqual(game.get_hand(i), restored.get_hand(i))
+
+    def test_unchanged_games_not_written(self):
+        self.backend.create_game([1, 2, 3, 4])
+        self.checkpointer.checkpoint()
+        self.checkpointer.checkpoint()
+
+        self.assertEqual(1, self._line_count())
+
+    def test_removed_game(self):
+        first_id = self.backend.create_game([1, 2, 3, 4])
+        second_id = self.backend.create_game([5, 6, 7, 8])
+        self.checkpointer.checkpoint()
+
+        self.backend.on_game_abandoned(first_id)
+        self.checkpointer.checkpoint()
+
+        records = c.load_checkpoint(self.path)
+        self.assertEqual([second_id], records.keys())
+
+    def test_compaction(self):
+        game_id = self.backend.create_game([1, 2, 3, 4])
+        game = self.backend.get_game_master(game_id)._game
+        for i in range(4):
+            game.pass_cards(i, game.get_hand(i)[:3])
+
+        for _ in range(10):
+            game.play_card(game.get_legal_moves(game.get_current_player())[0])
+            self.checkpointer.checkpoint()
+
+        self.assertLessEqual(self._line_count(), c.DEFAULT_COMPACT_RATIO)
+        record = c.load_checkpoint(self.path)[game_id]
+        self.assertEqual(game.get_trick(), record["game"]["round"]["trick"])
+
+    def test_failed_write_retried(self):
+        game_ids = [self.backend.create_game([i * 4 + j for j in range(1, 5)]) for i in range(5)]
+        self.checkpointer.checkpoint()
+
+        self.backend.on_game_abandoned(game_ids[0])
+        game = self.backend.get_game_master(game_ids[1])._game
+        pass_and_play(game, 2)
+
+        append = self.checkpointer._append
+        failures = []
+
+        def fail_once(data):
+            if not failures:
+                failures.append(data)
+                raise IOError("No space left on device")
+            append(data)
+
+        with patch.object(self.checkpointer, "_append", fail_once):
+            self.assertRaises(IOError, self.checkpointer.checkpoint)
+            self.checkpointer.checkpoint()
+
+        self.assertEqual(1, len(failures))
+        records = c.load_checkpoint(self.path)
+        self.assertEqual(sorted(game_ids[1:]), sorted(records.keys()))
+        self.assertEqual(game.get_trick(), records[game_ids[1]]["game"]["round"]["trick"])
+
+    def test_torn_line_ignored(self):
+        self.backend.create_game([1, 2, 3, 4])
+        self.checkpointer.checkpoint()
+
+        with open(self.path, "ab") as f:
+            f.write(json.dumps({"game_id": 2, "players": [5, 6, 7, 8]})[:-5])
+
+        self.assertEqual([1], c.load_checkpoint(self.path).keys())
+
+    def test_missing_file(self):
+        self.assertEqual({}, c.load_checkpoint(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import gevent
+import gevent.queue as gq
+from mock import Mock
+
+import hearts.game_backend as b
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeWebsocket(object):
+    def __init__(self):
+        self.closed = False
+        self.incoming = gq.Queue()
+
+    def receive(self):
+        return self.incoming.get()
+
+    def send(self, message, binary=False):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.incoming.put(None)
+
+
+class TestReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.player_svc = Mock()
+        self.backend = b.GameBackend(self.player_svc, join_timeout=60, idle_timeout=600, clock=self.clock)
+        self.game_id = self.backend.create_game([1, 2, 3, 4])
+        self.master = self.backend.get_game_master(self.game_id)
+
+    def tearDown(self):
+        self.backend._timers.stop()
+
+    def _advance_to(self, seconds):
+        self.clock.now = 1000.0 + seconds
+        self.backend._timers.advance()
+
+    def _connect(self, player_index):
+        ws = FakeWebsocket()
+        gevent.spawn(self.master.connect, ws, "player", player_index)
+        gevent.sleep(0)
+        return ws
+
+    def test_never_joined(self):
+        reaped = b.REAPED_GAMES.labels("never_joined").value
+
+        self._advance_to(59)
+        self.assertEqual(1, self.backend.get_game_count())
+
+        self._advance_to(61)
+        self.assertEqual(0, self.backend.get_game_count())
+        for player_id in [1, 2, 3, 4]:
+            self.assertFalse(self.backend.is_in_game(player_id))
+        self.assertEqual(4, self.player_svc.remove_player.call_count)
+        self.assertEqual(reaped + 1, b.REAPED_GAMES.labels("never_joined").value)
+
+    def test_idle(self):
+        self._advance_to(30)
+        ws = self._connect(0)
+
+        self._advance_to(61)
+        self.assertEqual(1, self.backend.get_game_count())
+
+        self._advance_to(629)
+        self.assertEqual(1, self.backend.get_game_count())
+
+        self._advance_to(631)
+        self.assertEqual(0, self.backend.get_game_count())
+        self.assertTrue(ws.closed)
+
+    def test_activity_postpones(self):
+        self._connect(0)
+        self._advance_to(500)
+        self._connect(1)
+
+        self._advance_to(601)
+        self.assertEqual(1, self.backend.get_game_count())
+
+        self._advance_to(1101)
+        self.assertEqual(0, self.backend.get_game_count())
+
+    def test_finished_game_cancels_reap(self):
+        self.backend.on_game_finished(self.game_id)
+        self.assertEqual(0, len(self.backend._timers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,367 @@
+import json
+import unittest
+
+import gevent
+import gevent.queue as gq
+from mock import patch
+
+import hearts.binary_protocol as bp
+import hearts.websocket_util as wsutil
+from hearts.game_master import GameMaster, PlayerAlreadyConnectedError, MAX_STATE_HISTORY, _consume_events, \
+    OUTBOUND_QUEUE_HIGH_WATER
+from hearts.model.game import HeartsGame
+from hearts.timer_wheel import TimerWheel
+
+
+class FakeWebsocket(object):
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.incoming = gq.Queue()
+
+    def receive(self):
+        return self.incoming.get()
+
+    def send(self, message, binary=False):
+        self.sent.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+class TestConsumeEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.ws = FakeWebsocket()
+        self.queue = gq.Queue()
+
+    def _queue_events(self, protocol, count):
+        for i in range(count):
+            self.queue.put(protocol.encode_event("play_card", {"player": i % 4, "card": "c2"}))
+
+    def _consume(self, protocol, max_batch_size, linger=0, wait=0):
+        consumer = gevent.spawn(_consume_events, self.ws, self.queue, protocol, max_batch_size, linger)
+        gevent.sleep(wait)
+        consumer.kill()
+
+    def test_unbatched(self):
+        protocol = wsutil.JSON_BATCHED_PROTOCOL
+        self._queue_events(protocol, 3)
+        self._consume(protocol, 1)
+
+        self.assertEqual(3, len(self.ws.sent))
+        self.assertEqual("play_card", json.loads(self.ws.sent[0])["type"])
+
+    def test_protocol_without_batching(self):
+        """
+        Plain JSON clients expect one event per frame.
+        """
+        protocol = wsutil.JSON_PROTOCOL
+        self._queue_events(protocol, 3)
+        self._consume(protocol, 16)
+
+        self.assertEqual(3, len(self.ws.sent))
+
+    def test_json_batch(self):
+        protocol = wsutil.JSON_BATCHED_PROTOCOL
+        self._queue_events(protocol, 3)
+        self._consume(protocol, 16)
+
+        self.assertEqual(1, len(self.ws.sent))
+        events = json.loads(self.ws.sent[0])
+        self.assertEqual([0, 1, 2], [x["player"] for x in events])
+
+    def test_single_event_not_wrapped(self):
+        protocol = wsutil.JSON_BATCHED_PROTOCOL
+        self._queue_events(protocol, 1)
+        self._consume(protocol, 16)
+
+        self.assertEqual("play_card", json.loads(self.ws.sent[0])["type"])
+
+    def test_max_batch_size(self):
+        protocol = wsutil.BINARY_PROTOCOL
+        self._queue_events(protocol, 5)
+        self._consume(protocol, 2)
+
+        self.assertEqual([2, 2, 1], [len(bp.decode_frame(x)) for x in self.ws.sent])
+
+    def test_linger(self):
+        protocol = wsutil.BINARY_PROTOCOL
+        self._queue_events(protocol, 1)
+
+        gevent.spawn_later(0.01, self._queue_events, protocol, 1)
+        self._consume(protocol, 16, 0.05, 0.1)
+
+        self.assertEqual(1, len(self.ws.sent))
+        self.assertEqual(2, len(bp.decode_frame(self.ws.sent[0])))
+
+
+class TestStateSync(unittest.TestCase):
+
+    def setUp(self):
+        self.game = HeartsGame()
+        self.master = GameMaster(self.game, 1)
+        self.game.start()
+
+        self.sockets = []
+        for i in range(4):
+            ws = FakeWebsocket()
+            self.sockets.append(ws)
+            self.master.attach(ws, "player%d" % i, i, gq.Queue())
+
+        self.command_id = 0
+
+    def _send(self, player_index, msg):
+        self.command_id += 1
+        msg["command_id"] = self.command_id
+        self.master._receive_message(player_index, msg)
+        return json.loads(self.sockets[player_index].sent[-1])
+
+    def _query(self, player_index, msg):
+        reply = self._send(player_index, msg)
+        self.assertEqual("query_success", reply["type"])
+        return reply["data"]
+
+    def _pass(self, player_index):
+        cards = self.game.get_hand(player_index)[:3]
+        reply = self._send(player_index, {"type": "pass_card", "cards": cards})
+        self.assertEqual("command_success", reply["type"])
+
+    def test_get_state_has_version(self):
+        state = self._query(0, {"type": "get_state"})
+        self.assertEqual(self.master.get_state_version(), state["version"])
+
+    def test_version_increases(self):
+        before = self.master.get_state_version()
+        self._pass(0)
+        self.assertGreater(self.master.get_state_version(), before)
+
+    def test_no_changes(self):
+        state = self._query(0, {"type": "get_state"})
+        changes = self._query(0, {"type": "get_state_changes", "since_version": state["version"]})
+
+        expected = {
+            "version": state["version"],
+            "changes": {},
+            "state_data": {},
+            "removed": []
+        }
+        self.assertEqual(expected, changes)
+
+    def test_changes_after_pass(self):
+        state = self._query(0, {"type": "get_state"})
+        self._pass(0)
+
+        changes = self._query(0, {"type": "get_state_changes", "since_version": state["version"]})
+
+        self.assertEqual(self.master.get_state_version(), changes["version"])
+        self.assertEqual({}, changes["changes"])
+        self.assertEqual(
+            set(["have_passed", "passed_cards"]),
+            set(changes["state_data"].keys()))
+        self.assertTrue(changes["state_data"]["have_passed"])
+
+    def test_changes_after_passing_finished(self):
+        state = self._query(0, {"type": "get_state"})
+        for i in range(4):
+            self._pass(i)
+
+        changes = self._query(0, {"type": "get_state_changes", "since_version": state["version"]})
+
+        self.assertEqual("playing", changes["changes"]["state"])
+        self.assertIn("trick", changes["state_data"])
+        self.assertEqual(
+            set(["pass_direction", "have_passed", "passed_cards"]),
+            set(changes["removed"]))
+
+    def test_unknown_version(self):
+        changes = self._query(0, {"type": "get_state_changes", "since_version": 12345})
+
+        full = self._query(0, {"type": "get_state"})
+        self.assertEqual({"version": full["version"], "full": full}, changes)
+
+    def test_invalid_since_version(self):
+        for since_version in [[1], "1", None, True]:
+            response = self._send(0, {"type": "get_state_changes", "since_version": since_version})
+            self.assertEqual("command_fail", response["type"])
+
+    def test_get_state_cached(self):
+        with patch.object(self.master, "_serialize_game_state",
+                          wraps=self.master._serialize_game_state) as serialize:
+            first = self._query(0, {"type": "get_state"})
+            second = self._query(0, {"type": "get_state"})
+
+            self.assertEqual(first, second)
+            self.assertEqual(1, serialize.call_count)
+
+            # other players have their own state
+            self._query(1, {"type": "get_state"})
+            self.assertEqual(2, serialize.call_count)
+
+    def test_get_state_cache_invalidated(self):
+        first = self._query(0, {"type": "get_state"})
+        self._pass(0)
+        second = self._query(0, {"type": "get_state"})
+
+        self.assertNotEqual(first["version"], second["version"])
+        self.assertFalse(first["state_data"]["have_passed"])
+        self.assertTrue(second["state_data"]["have_passed"])
+
+    def test_get_state_binary(self):
+        game = HeartsGame()
+        master = GameMaster(game, 2)
+        game.start()
+        ws = FakeWebsocket()
+        master.attach(ws, "player0", 0, gq.Queue(), wsutil.BINARY_PROTOCOL)
+
+        master._receive_message(0, {"type": "get_state", "command_id": 3})
+        master._receive_message(0, {"type": "get_state", "command_id": 4})
+
+        first, second = [bp.decode_message(x) for x in ws.sent]
+        self.assertEqual(3, first["command_id"])
+        self.assertEqual(4, second["command_id"])
+        self.assertEqual(first["data"], second["data"])
+        self.assertEqual(master.get_state_version(), first["data"]["version"])
+
+    def test_history_bounded(self):
+        first = self._query(0, {"type": "get_state"})
+        for _ in range(MAX_STATE_HISTORY):
+            self.master._bump_state_version()
+            self._query(0, {"type": "get_state"})
+
+        changes = self._query(0, {"type": "get_state_changes", "since_version": first["version"]})
+        self.assertIn("full", changes)
+
+
+class TestSlowConsumer(unittest.TestCase):
+
+    def _create_master(self, policy, queue_sizes=(2, 2, 2, 2)):
+        self.game = HeartsGame()
+        self.master = GameMaster(self.game, 1, max_queue_size=2, slow_consumer_policy=policy)
+        self.game.start()
+
+        self.sockets = []
+        self.queues = []
+        for i, size in enumerate(queue_sizes):
+            ws = FakeWebsocket()
+            self.sockets.append(ws)
+            self.queues.append(gq.Queue(size))
+            self.master.attach(ws, "player%d" % i, i, self.queues[i])
+
+    def _fill_queues(self):
+        for _ in range(3):
+            self.master._broadcast_event("play_card", {"player": 0, "card": "c2"})
+
+    def _queued(self, player_index):
+        return [json.loads(x) for x in self.queues[player_index].queue]
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, GameMaster, HeartsGame(), 1, slow_consumer_policy="asdf")
+
+    def test_resync(self):
+        self._create_master("resync")
+        self._fill_queues()
+
+        self.assertEqual([{"type": "resync"}], self._queued(0))
+
+        # nothing more is sent until the client asks for its state
+        self.master._broadcast_event("play_card", {"player": 0, "card": "c3"})
+        self.assertEqual(1, len(self._queued(0)))
+
+        self.master._receive_message(0, {"type": "get_state", "command_id": 1})
+        self.master._broadcast_event("play_card", {"player": 0, "card": "c4"})
+        self.assertEqual("c4", self._queued(0)[-1]["card"])
+
+    def test_coalesce(self):
+        self._create_master("coalesce")
+        self._fill_queues()
+
+        queued = self._queued(0)
+        self.assertEqual(1, len(queued))
+        self.assertEqual("game_state", queued[0]["type"])
+        self.assertEqual(self.master.get_state_version(), queued[0]["data"]["version"])
+
+    def test_disconnect(self):
+        # player 1 keeps up, so they hear about player 0 leaving
+        self._create_master("disconnect", queue_sizes=(2, None, 2, 2))
+        self._fill_queues()
+
+        self.assertTrue(self.sockets[0].closed)
+        self.assertFalse(self.master.is_connected(0))
+        self.assertIn({"type": "player_disconnected", "index": 0}, self._queued(1))
+
+    def test_high_water(self):
+        self._create_master("resync")
+        OUTBOUND_QUEUE_HIGH_WATER.set(0)
+        self.master._broadcast_event("play_card", {"player": 0, "card": "c2"})
+        self.master._broadcast_event("play_card", {"player": 0, "card": "c2"})
+
+        self.assertEqual(2, OUTBOUND_QUEUE_HIGH_WATER.value)
+
+
+class TestConnect(unittest.TestCase):
+
+    def setUp(self):
+        self.master = GameMaster(HeartsGame(), 1)
+
+    def test_malformed_frame_frees_seat(self):
+        ws = FakeWebsocket()
+        connection = gevent.spawn(self.master.connect, ws, "Joe", 0, wsutil.BINARY_PROTOCOL)
+        gevent.sleep(0)
+        self.assertTrue(self.master.is_connected(0))
+
+        ws.incoming.put(bp.encode_message({"type": "get_state"})[:-1])
+        connection.join(timeout=1)
+
+        self.assertTrue(connection.successful())
+        self.assertFalse(self.master.is_connected(0))
+
+        # the player can come back to the same seat
+        ws = FakeWebsocket()
+        connection = gevent.spawn(self.master.connect, ws, "Joe", 0, wsutil.BINARY_PROTOCOL)
+        gevent.sleep(0)
+        self.assertTrue(self.master.is_connected(0))
+
+        ws.incoming.put(None)
+        connection.join(timeout=1)
+
+    def test_failed_message_frees_seat(self):
+        ws = FakeWebsocket()
+        connection = gevent.spawn(self.master.connect, ws, "Joe", 0)
+        gevent.sleep(0)
+
+        # no command_id
+        ws.incoming.put(json.dumps({"type": "get_state"}))
+        connection.join(timeout=1)
+
+        self.assertTrue(connection.successful())
+        self.assertFalse(self.master.is_connected(0))
+
+    def test_seat_taken(self):
+        self.master.attach(FakeWebsocket(), "Joe", 0, gq.Queue())
+        self.assertRaises(
+            PlayerAlreadyConnectedError,
+            self.master.connect, FakeWebsocket(), "Ann", 0)
+
+
+class TestRoundTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.timers = TimerWheel()
+        self.master = GameMaster(HeartsGame(), 1, timers=self.timers)
+
+    def tearDown(self):
+        self.timers.stop()
+
+    def test_next_round_scheduled(self):
+        self.master.on_finish_round([0, 0, 0, 26])
+        self.assertEqual(1, len(self.timers))
+
+    def test_close_cancels(self):
+        self.master.on_finish_round([0, 0, 0, 26])
+        self.master.close()
+        self.assertEqual(0, len(self.timers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -149,6 +149,25 @@ class TestHeartsModel(unittest.TestCase):
 
         self.assertEqual([{"player": 1, "card": "c2"}], game.get_trick())
 
+    def test_init_get_legal_moves(self):
+        game = HeartsGame()
+        try:
+            game.get_legal_moves(0)
+            self.fail()
+        except e.RoundNotInProgressError:
+            pass  # test succeeded
+
+    def test_get_legal_moves(self):
+        game = HeartsGame(deal_func=lambda: example_hands)
+        game.start()
+
+        for i in range(4):
+            game.pass_cards(i, example_hands[i][:3])
+
+        # player 1 received the c2 from player 0
+        self.assertEqual(["c2"], game.get_legal_moves(1))
+        self.assertEqual([], game.get_legal_moves(0))
+
     def test_finish_trick(self):
         """
         Tests that observers are notified
@@ -234,6 +253,63 @@ class TestHeartsModel(unittest.TestCase):
         self.assertEqual(1, game.get_current_round_number())
         observer.on_start_round.assert_called_once_with(1)
 
+    def test_snapshot_passing(self):
+        """
+        A game restored from a snapshot taken during passing
+        should carry on exactly like the original.
+        """
+        game = HeartsGame(deal_func=lambda: example_hands)
+        game.start()
+        game.pass_cards(0, example_hands[0][:3])
+
+        restored = HeartsGame.from_snapshot(game.get_snapshot())
+
+        self.assertEqual("passing", restored.get_state())
+        self.assertTrue(restored.has_player_passed(0))
+        self.assertFalse(restored.has_player_passed(1))
+        self.assertEqual(example_hands[2], restored.get_hand(2))
+
+        for g in [game, restored]:
+            for i in range(1, 4):
+                g.pass_cards(i, example_hands[i][:3])
+
+        for i in range(4):
+            self.assertEqual(game.get_hand(i), restored.get_hand(i))
+
+    def test_snapshot_playing(self):
+        game = HeartsGame(deal_func=lambda: example_hands)
+        game.start()
+        for i in range(4):
+            game.pass_cards(i, example_hands[i][:3])
+
+        # play a trick and a bit
+        for _ in range(6):
+            game.play_card(game.get_legal_moves(game.get_current_player())[0])
+
+        restored = HeartsGame.from_snapshot(game.get_snapshot())
+        observer = Mock()
+        restored.add_observer(observer)
+
+        self.assertEqual(game.get_trick(), restored.get_trick())
+        self.assertEqual(game.get_current_player(), restored.get_current_player())
+        self.assertEqual(game.get_round_scores(), restored.get_round_scores())
+        self.assertEqual(game.is_first_trick(), restored.is_first_trick())
+
+        while not game.is_round_finished():
+            player = game.get_current_player()
+            self.assertEqual(game.get_legal_moves(player), restored.get_legal_moves(player))
+            card = game.get_legal_moves(player)[0]
+            game.play_card(card)
+            restored.play_card(card)
+
+        self.assertTrue(restored.is_round_finished())
+        self.assertEqual(game.get_scores(), restored.get_scores())
+        observer.on_finish_round.assert_called_once_with(game.get_round_scores())
+
+    def test_snapshot_init(self):
+        restored = HeartsGame.from_snapshot(HeartsGame().get_snapshot())
+        self.assertEqual("init", restored.get_state())
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
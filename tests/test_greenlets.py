@@ -0,0 +1,36 @@
+import unittest
+
+import gevent
+from gevent.event import Event
+
+import hearts.greenlets as g
+
+
+class TestSpawn(unittest.TestCase):
+
+    def test_counts_live_greenlets(self):
+        before = g.GREENLETS.value
+        done = Event()
+
+        first = g.spawn(done.wait)
+        second = g.spawn(done.wait)
+        self.assertEqual(before + 2, g.GREENLETS.value)
+
+        # The count drops once the loop has run the greenlet's links.
+        # One that dies before ever running counts as gone too.
+        g.spawn(done.wait).kill()
+        gevent.sleep(0)
+        self.assertEqual(before + 2, g.GREENLETS.value)
+
+        second.kill()
+        gevent.sleep(0)
+        self.assertEqual(before + 1, g.GREENLETS.value)
+
+        done.set()
+        first.join()
+        gevent.sleep(0)
+        self.assertEqual(before, g.GREENLETS.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import gevent
+from mock import Mock, patch
+
+import hearts.journal as j
+import hearts.model.game as m
+import hearts.util as u
+from hearts.game_backend import GameBackend
+
+
+def read_events(path):
+    """
+    Returns the records in the journal, apart from the run markers.
+    """
+    return [x for x in j.read_journal(path) if x["type"] != "run_start"]
+
+
+class TestGameJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "games.journal")
+        self.journal = j.GameJournal(self.path, flush_interval=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.journal.record_game_start(3, 2 ** 63 + 5, [10, 11, 12, 13])
+        self.journal.record_start_round(3, 0)
+        self.journal.record_pass(3, 1, ["c2", "sq", "h1"])
+        self.journal.record_play(3, 2, "d10")
+        self.journal.record_game_over(3, [100, 26, 0, 4])
+        self.journal.record_abandoned(4)
+        self.journal.close()
+
+        expected = [
+            {"type": "run_start", "game_id": 0, "run_id": self.journal.run_id},
+            {"type": "game_start", "game_id": 3, "seed": 2 ** 63 + 5, "players": [10, 11, 12, 13]},
+            {"type": "start_round", "game_id": 3, "round_number": 0},
+            {"type": "pass", "game_id": 3, "player": 1, "cards": ["c2", "sq", "h1"]},
+            {"type": "play", "game_id": 3, "player": 2, "card": "d10"},
+            {"type": "game_over", "game_id": 3, "scores": [100, 26, 0, 4]},
+            {"type": "abandoned", "game_id": 4},
+        ]
+        self.assertEqual(expected, list(j.read_journal(self.path)))
+
+    def test_appends(self):
+        self.journal.record_play(1, 0, "c2")
+        self.journal.close()
+
+        journal = j.GameJournal(self.path)
+        journal.record_play(1, 1, "c3")
+        journal.close()
+
+        cards = [x["card"] for x in read_events(self.path)]
+        self.assertEqual(["c2", "c3"], cards)
+
+    def test_run_start(self):
+        self.journal.close()
+
+        journal = j.GameJournal(self.path, run_id=12)
+        journal.close()
+
+        runs = [x["run_id"] for x in j.read_journal(self.path)]
+        self.assertEqual([self.journal.run_id, 12], runs)
+
+    def test_flushes_in_background(self):
+        self.journal.record_play(1, 0, "c2")
+        gevent.sleep(0.1)
+
+        self.assertEqual(1, len(read_events(self.path)))
+        self.journal.close()
+
+    def test_failed_write_retried(self):
+        fsync = j.os.fsync
+        failures = []
+
+        def fail_once(fd):
+            if not failures:
+                failures.append(fd)
+                raise OSError("No space left on device")
+            fsync(fd)
+
+        with patch("hearts.journal.os.fsync", fail_once):
+            self.journal.record_play(1, 0, "c2")
+            gevent.sleep(0.05)
+            self.journal.record_play(1, 1, "c3")
+            gevent.sleep(0.1)
+
+        self.assertEqual(1, len(failures))
+        cards = [x["card"] for x in read_events(self.path)]
+        self.assertEqual(["c2", "c3"], cards)
+        self.journal.close()
+
+    def test_close_during_flush(self):
+        write = self.journal._write
+
+        def slow_write(data):
+            time.sleep(0.1)
+            write(data)
+
+        with patch.object(self.journal, "_write", slow_write):
+            self.journal.record_play(1, 0, "c2")
+            gevent.sleep(0.05)
+            self.journal.close()
+
+        types = [x["type"] for x in j.read_journal(self.path)]
+        self.assertEqual(["run_start", "play"], types)
+
+    def test_torn_record_ignored(self):
+        self.journal.record_play(1, 0, "c2")
+        self.journal.record_play(1, 1, "c3")
+        self.journal.close()
+
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+
+        self.assertEqual(1, len(read_events(self.path)))
+
+    def test_recorder(self):
+        rng = random.Random(5)
+        game = m.HeartsGame(deal_func=lambda: u.deal_hands(rng))
+        game.add_observer(j.JournalRecorder(self.journal, 1, game))
+        game.start()
+
+        for i in range(4):
+            game.pass_cards(i, game.get_hand(i)[:3])
+        for _ in range(4):
+            game.play_card(game.get_legal_moves(game.get_current_player())[0])
+
+        self.journal.close()
+
+        types = [x["type"] for x in read_events(self.path)]
+        self.assertEqual(["start_round"] + ["pass"] * 4 + ["play"] * 4, types)
+
+
+class TestGameBackendJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "games.journal")
+        self.journal = j.GameJournal(self.path)
+        self.backend = GameBackend(Mock(), journal=self.journal)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_create_game(self):
+        game_id = self.backend.create_game([5, 6, 7, 8])
+        self.journal.close()
+
+        records = read_events(self.path)
+        self.assertEqual("game_start", records[0]["type"])
+        self.assertEqual(game_id, records[0]["game_id"])
+        self.assertEqual([5, 6, 7, 8], records[0]["players"])
+        self.assertEqual("start_round", records[1]["type"])
+
+    def test_seed_reproduces_deal(self):
+        game_id = self.backend.create_game([5, 6, 7, 8])
+        self.journal.close()
+
+        seed = read_events(self.path)[0]["seed"]
+        game = self.backend.get_game_master(game_id)._game
+
+        self.assertEqual(u.deal_hands(random.Random(seed))[0], game.get_hand(0))
+
+    def test_abandoned(self):
+        game_id = self.backend.create_game([5, 6, 7, 8])
+        self.backend.on_game_abandoned(game_id)
+        self.journal.close()
+
+        self.assertEqual("abandoned", read_events(self.path)[-1]["type"])
+
+
+if __name__ == '__main__':
+    unittest.main()
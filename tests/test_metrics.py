@@ -0,0 +1,71 @@
+import unittest
+
+import hearts.metrics as metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("plays_total", "Cards played.")
+        counter.inc()
+        counter.inc(2)
+
+        expected = "\n".join([
+            "# HELP plays_total Cards played.",
+            "# TYPE plays_total counter",
+            "plays_total 3.0",
+        ]) + "\n"
+        self.assertEqual(expected, self.registry.render())
+
+    def test_gauge_func(self):
+        values = [4]
+        self.registry.gauge("games", "Games.", func=lambda: values[0])
+        values[0] = 7
+
+        self.assertIn("games 7.0\n", self.registry.render())
+
+    def test_gauge_inc_dec(self):
+        gauge = self.registry.gauge("sockets", "Sockets.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        self.assertIn("sockets 1.0\n", self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("latency", "Latency.", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual([
+            'latency_bucket{le="0.1"} 2.0',
+            'latency_bucket{le="1.0"} 3.0',
+            'latency_bucket{le="+Inf"} 4.0',
+            'latency_sum 5.65',
+            'latency_count 4.0',
+        ], lines[2:])
+
+    def test_labels(self):
+        counter = self.registry.counter("messages_total", "Messages.", labels=("type",))
+        counter.labels("play_card").inc()
+        counter.labels('say "hi"').inc(2)
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual([
+            'messages_total{type="play_card"} 1.0',
+            'messages_total{type="say \\"hi\\""} 2.0',
+        ], lines[2:])
+
+    def test_labelled_metric_needs_labels(self):
+        counter = self.registry.counter("messages_total", "Messages.", labels=("type",))
+        self.assertRaises(AttributeError, getattr, counter, "inc")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import time
 import unittest
 
+import gevent
+
 from hearts.services.player import PlayerService, PlayerStateError
 
 
@@ -8,6 +11,9 @@ class TestPlayerService(unittest.TestCase):
     def setUp(self):
         self.svc = PlayerService()
 
+    def tearDown(self):
+        self.svc.close()
+
     def test_get_player_not_found(self):
         data = self.svc.get_player(1234)
         self.assertIsNone(data)
@@ -79,6 +85,94 @@ class TestPlayerService(unittest.TestCase):
         self.assertEqual("Jimmy", jimmy["name"])
         self.assertEqual("Bob", bob["name"])
 
+    def test_auth_player(self):
+        player_id = self.svc.create_player("Joe", "password")
+
+        self.assertTrue(self.svc.auth_player(player_id, "password"))
+        self.assertFalse(self.svc.auth_player(player_id, "asdf"))
+
+    def test_auth_player_not_found(self):
+        self.assertFalse(self.svc.auth_player(1234, "password"))
+
+    def test_hashing_does_not_block_other_greenlets(self):
+        # start the hashing processes, which is not what we are measuring
+        self.svc.create_player("Warmup", "password")
+
+        tick_times = []
+
+        def ticker():
+            while True:
+                tick_times.append(time.time())
+                gevent.sleep(0.001)
+
+        ticker_greenlet = gevent.spawn(ticker)
+        gevent.sleep(0)
+
+        gevent.joinall([gevent.spawn(self.svc.create_player, "Joe%d" % i, "password") for i in range(4)])
+        ticker_greenlet.kill()
+
+        gaps = [b - a for a, b in zip(tick_times, tick_times[1:])]
+        self.assertLess(max(gaps), 0.1)
+
+    def test_create_player_duplicate_concurrent(self):
+        """
+        Two greenlets creating the same name while hashing
+        should not both succeed.
+        """
+        results = []
+
+        def create():
+            try:
+                results.append(self.svc.create_player("Joe", "password"))
+            except PlayerStateError:
+                results.append(None)
+
+        gevent.joinall([gevent.spawn(create) for _ in range(2)])
+
+        self.assertEqual(1, results.count(None))
+        self.assertIn(self.svc.get_player_id("Joe"), results)
+    def test_create_guest_player(self):
+        player_id, token = self.svc.create_guest_player("Joe")
+        player = self.svc.get_player(player_id)
+
+        expected = {
+            "id": player_id,
+            "name": "Joe"
+        }
+
+        self.assertEqual(expected, player)
+        self.assertEqual(player_id, self.svc.get_player_id("Joe"))
+
+    def test_create_guest_player_duplicate(self):
+        self.svc.create_player("Joe", "password")
+
+        self.assertRaises(PlayerStateError, self.svc.create_guest_player, "Joe")
+
+    def test_auth_guest_player(self):
+        player_id, token = self.svc.create_guest_player("Joe")
+
+        self.assertTrue(self.svc.auth_player(player_id, token))
+        self.assertTrue(self.svc.auth_player(player_id, unicode(token)))
+        self.assertFalse(self.svc.auth_player(player_id, "asdf"))
+
+    def test_guest_tokens_differ(self):
+        _, first = self.svc.create_guest_player("Joe")
+        _, second = self.svc.create_guest_player("Bob")
+
+        self.assertNotEqual(first, second)
+
+
+class TestPlayerServiceIdStep(unittest.TestCase):
+
+    def test_ids_strided(self):
+        svc = PlayerService(first_id=2, id_step=3)
+        first = svc.create_player("Joe", "password")
+        second, _ = svc.create_guest_player("Bob")
+        svc.close()
+
+        self.assertEqual(2, first)
+        self.assertEqual(5, second)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -88,6 +88,20 @@ class TestHeartsPreRound(unittest.TestCase):
         except m.InvalidMoveError:
             pass  # test succeeded
 
+    def test_pass_duplicate_cards(self):
+        """
+        We should not be allowed to pass the same card more than once.
+        """
+        round = HeartsPreRound(example_hands)
+
+        cards_to_pass = ["h5", "h5", "c2"]
+
+        try:
+            round.pass_cards(0, cards_to_pass)
+            self.fail()
+        except m.InvalidMoveError:
+            pass  # test succeeded
+
     def test_pass_cards_twice(self):
         """
         We should not be allowed to pass cards more than once.
@@ -0,0 +1,269 @@
+import unittest
+from mock import Mock
+
+import hearts.queue_backend as q
+from hearts.queue_backend import GameQueueBackend, RatedGameQueueBackend, PlayerUnregisteredError
+
+
+class TestGameQueueBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.game_creator = Mock()
+        self.game_creator.create_game.return_value = 7
+        self.queue = GameQueueBackend(self.game_creator)
+
+    def test_register(self):
+        self.queue.register(1)
+
+        self.assertTrue(self.queue.is_registered(1))
+        self.assertFalse(self.queue.is_registered(2))
+
+    def test_match_four(self):
+        """
+        When the fourth player registers,
+        a game should be created for the first four.
+        """
+        results = [self.queue.register(i) for i in range(1, 5)]
+
+        self.game_creator.create_game.assert_called_once_with([1, 2, 3, 4])
+        for result in results:
+            self.assertEqual(7, result.get(block=False))
+
+        for i in range(1, 5):
+            self.assertFalse(self.queue.is_registered(i))
+
+    def test_match_fifo(self):
+        """
+        Players should be matched in the order they registered,
+        skipping anyone who left the queue.
+        """
+        for i in range(1, 4):
+            self.queue.register(i)
+
+        self.queue.unregister(2)
+        self.queue.register(4)
+        self.assertFalse(self.game_creator.create_game.called)
+
+        self.queue.register(5)
+        self.queue.register(6)
+
+        self.game_creator.create_game.assert_called_once_with([1, 3, 4, 5])
+        self.assertTrue(self.queue.is_registered(6))
+
+    def test_unregister(self):
+        result = self.queue.register(1)
+        self.queue.unregister(1)
+
+        self.assertFalse(self.queue.is_registered(1))
+        self.assertRaises(PlayerUnregisteredError, result.get, block=False)
+
+    def test_unregister_not_registered(self):
+        # should do nothing
+        self.queue.unregister(1234)
+
+
+class TestRatedGameQueueBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.game_creator = Mock()
+        self.game_creator.create_game.return_value = 7
+        self.queue = RatedGameQueueBackend(
+            self.game_creator,
+            base_window=100,
+            widen_rate=10,
+            max_window=500,
+            clock=lambda: self.now)
+
+    def test_no_match_on_register(self):
+        """
+        Tables should only be formed on tick.
+        """
+        for i in range(1, 5):
+            self.queue.register(i, 1500)
+
+        self.assertFalse(self.game_creator.create_game.called)
+        self.assertTrue(self.queue.is_registered(1))
+
+    def test_tick_matches_similar_ratings(self):
+        results = [self.queue.register(i, 1500 + i) for i in range(1, 5)]
+
+        self.queue.tick()
+
+        self.game_creator.create_game.assert_called_once_with([1, 2, 3, 4])
+        for result in results:
+            self.assertEqual(7, result.get(block=False))
+
+        for i in range(1, 5):
+            self.assertFalse(self.queue.is_registered(i))
+
+    def test_tick_keeps_distant_ratings_apart(self):
+        self.queue.register(1, 1000)
+        self.queue.register(2, 1010)
+        self.queue.register(3, 1020)
+        self.queue.register(4, 2000)
+
+        self.queue.tick()
+
+        self.assertFalse(self.game_creator.create_game.called)
+
+    def test_tick_prefers_closest_ratings(self):
+        self.queue.register(1, 1500)
+        self.queue.register(2, 1590)
+        self.queue.register(3, 1510)
+        self.queue.register(4, 1520)
+        self.queue.register(5, 1530)
+
+        self.queue.tick()
+
+        self.game_creator.create_game.assert_called_once_with([1, 3, 4, 5])
+        self.assertTrue(self.queue.is_registered(2))
+
+    def test_tick_takes_nearest_on_either_side(self):
+        self.queue.register(1, 1500)
+        self.queue.register(2, 1380)
+        self.queue.register(3, 1595)
+        self.queue.register(4, 1450)
+        self.queue.register(5, 1530)
+        self.queue.register(6, 1520)
+
+        self.queue.tick()
+
+        self.game_creator.create_game.assert_called_once_with([1, 6, 5, 4])
+
+    def test_tick_large_queue(self):
+        for i in range(1, 4002):
+            self.queue.register(i, 1500 + (i % 4))
+
+        stats = self.queue.tick()
+
+        self.assertEqual(1000, stats["tables"])
+        self.assertEqual(1, stats["players_waiting"])
+        self.assertEqual(0, stats["max_spread"])
+
+    def test_window_widens_with_wait(self):
+        self.queue.register(1, 1000)
+        self.queue.register(2, 1010)
+        self.queue.register(3, 1020)
+        self.queue.register(4, 1300)
+
+        self.queue.tick()
+        self.assertFalse(self.game_creator.create_game.called)
+
+        # the window is now 100 + (10 * 20) = 300
+        self.now += 20
+        self.queue.tick()
+
+        self.game_creator.create_game.assert_called_once_with([1, 2, 3, 4])
+
+    def test_window_capped(self):
+        self.assertEqual(100, self.queue.get_window(0))
+        self.assertEqual(150, self.queue.get_window(5))
+        self.assertEqual(500, self.queue.get_window(1000))
+
+    def test_tick_forms_multiple_tables(self):
+        for i in range(1, 5):
+            self.queue.register(i, 1000)
+        for i in range(5, 9):
+            self.queue.register(i, 2000)
+
+        self.queue.tick()
+
+        self.assertEqual(2, self.game_creator.create_game.call_count)
+        self.game_creator.create_game.assert_any_call([1, 2, 3, 4])
+        self.game_creator.create_game.assert_any_call([5, 6, 7, 8])
+
+    def test_tick_stats(self):
+        self.queue.register(1, 1500)
+        self.queue.register(2, 1520)
+        self.now += 4
+        self.queue.register(3, 1540)
+        self.queue.register(4, 1560)
+        self.queue.register(5, 2500)
+
+        stats = self.queue.tick()
+
+        self.assertEqual(stats, self.queue.last_tick_stats)
+        self.assertEqual(1, stats["tables"])
+        self.assertEqual(4, stats["players_matched"])
+        self.assertEqual(1, stats["players_waiting"])
+        self.assertEqual(2, stats["mean_wait"])
+        self.assertEqual(4, stats["max_wait"])
+        self.assertEqual(60, stats["mean_spread"])
+        self.assertEqual(60, stats["max_spread"])
+
+    def test_tick_metrics(self):
+        waits = q.MATCH_WAIT_SECONDS.count
+        wait_sum = q.MATCH_WAIT_SECONDS.sum
+        spreads = q.MATCH_RATING_SPREAD.count
+        spread_sum = q.MATCH_RATING_SPREAD.sum
+
+        self.queue.register(1, 1500)
+        self.now += 4
+        for i in range(2, 5):
+            self.queue.register(i, 1500 + i * 10)
+
+        self.queue.tick()
+
+        self.assertEqual(waits + 4, q.MATCH_WAIT_SECONDS.count)
+        self.assertEqual(wait_sum + 4, q.MATCH_WAIT_SECONDS.sum)
+        self.assertEqual(spreads + 1, q.MATCH_RATING_SPREAD.count)
+        self.assertEqual(spread_sum + 40, q.MATCH_RATING_SPREAD.sum)
+
+    def test_failed_create_requeues(self):
+        """
+        If the game cannot be created,
+        its players should go back in the queue in the order they registered.
+        """
+        results = [self.queue.register(i, 1500 + i) for i in range(1, 6)]
+        self.game_creator.create_game.side_effect = ValueError("no workers")
+
+        self.assertRaises(ValueError, self.queue.tick)
+
+        self.assertEqual(5, self.queue.get_queue_size())
+        self.assertEqual([1, 2, 3, 4, 5], list(self.queue.clients))
+        self.assertFalse(any(x.ready() for x in results))
+
+        self.game_creator.create_game.side_effect = None
+        self.queue.tick()
+
+        self.game_creator.create_game.assert_called_with([1, 2, 3, 4])
+        self.assertEqual(7, results[0].get(block=False))
+        self.assertTrue(self.queue.is_registered(5))
+
+    def test_ticks_survive_failure(self):
+        failures = q.FAILED_MATCH_TICKS.value
+        results = [self.queue.register(i, 1500) for i in range(1, 5)]
+        self.game_creator.create_game.side_effect = [ValueError("no workers"), 7]
+
+        self.queue.logger = Mock()
+        self.queue.start(interval=0.01)
+        try:
+            self.assertEqual(7, results[0].get(timeout=1))
+        finally:
+            self.queue.stop()
+
+        self.assertEqual(2, self.game_creator.create_game.call_count)
+        self.assertEqual(failures + 1, q.FAILED_MATCH_TICKS.value)
+        self.assertTrue(self.queue.logger.error.called)
+
+    def test_unregister(self):
+        result = self.queue.register(1, 1500)
+        self.queue.unregister(1)
+
+        self.assertFalse(self.queue.is_registered(1))
+        self.assertRaises(PlayerUnregisteredError, result.get, block=False)
+
+        for i in range(2, 5):
+            self.queue.register(i, 1500)
+
+        self.queue.tick()
+        self.assertFalse(self.game_creator.create_game.called)
+
+    def test_unregister_not_registered(self):
+        # should do nothing
+        self.queue.unregister(1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -454,5 +454,121 @@ class TestHeartsRound(unittest.TestCase):
         # so their score should update.
         self.assertEqual(1, round.get_score(2))
 
+    def test_legal_moves_first_move(self):
+        """
+        The only legal first move is the two of clubs.
+        """
+        round = HeartsRound(example_hands)
+
+        self.assertEqual(["c2"], round.get_legal_moves(0))
+
+    def test_legal_moves_not_current_player(self):
+        """
+        Players other than the current player have no legal moves.
+        """
+        round = HeartsRound(example_hands)
+
+        for i in range(1, 4):
+            self.assertEqual([], round.get_legal_moves(i))
+
+    def test_legal_moves_follow_suit(self):
+        """
+        A player holding the lead suit must follow it.
+        """
+        round = HeartsRound(example_hands)
+        round.play_card("c2")
+
+        self.assertEqual(["c10", "c3"], round.get_legal_moves(1))
+
+    def test_legal_moves_first_trick_no_points(self):
+        """
+        A player who cannot follow suit on the first trick
+        may not play hearts or the queen of spades.
+        """
+        hands = [
+            ['h5', 's7', 'h6', 'h1', 'd2', 'h8', 'd3', 's9', 'd9', 'sj', 'd8', 'dq', 's5'],
+            ['c10', 'c2', 'c3', 'h10', 'hk', 'd7', 'dk', 'h4', 'c5', 'hq', 'hj', 'c4', 'd5'],
+            ['s6', 's10', 'd1', 'sk', 's4', 'h7', 'd10', 's2', 'c9', 'cq', 'd6', 'h2', 'cj'],
+            ['d4', 'c8', 'h9', 'ck', 'h3', 'c6', 'dj', 'sq', 's1', 'c1', 's3', 'c7', 's8']
+        ]
+
+        round = HeartsRound(hands)
+        round.play_card("c2")
+        round.play_card("cq")
+        round.play_card("c8")
+
+        expected = ['s7', 'd2', 'd3', 's9', 'd9', 'sj', 'd8', 'dq', 's5']
+        self.assertEqual(expected, round.get_legal_moves(0))
+
+    def test_legal_moves_hearts_not_broken(self):
+        """
+        Hearts cannot be led until they are broken.
+        """
+        round = HeartsRound(example_hands)
+
+        round.play_card("c2")
+        round.play_card("c10")
+        round.play_card("c9")
+        round.play_card("c8")
+
+        expected = ['c3', 'd7', 'dk', 'sj', 's5', 'd5']
+        self.assertEqual(expected, round.get_legal_moves(1))
+
+    def test_legal_moves_match_play_card(self):
+        """
+        Every legal move should be accepted by play_card
+        and every other card in the hand should be rejected.
+        """
+        round = HeartsRound(example_hands)
+        round.play_card("c2")
+
+        legal = round.get_legal_moves(1)
+        for card in round.get_hand(1):
+            if card in legal:
+                continue
+            try:
+                round.play_card(card)
+                self.fail()
+            except m.InvalidMoveError:
+                pass  # test succeeded
+
+        round.play_card(legal[0])
+        self.assertEqual(2, round.get_current_player())
+
+    def test_legal_moves_modification(self):
+        """
+        Modifying the returned moves should not affect the round.
+        """
+        round = HeartsRound(example_hands)
+        moves = round.get_legal_moves(0)
+        moves.append("h5")
+
+        self.assertEqual(["c2"], round.get_legal_moves(0))
+
+    def test_play_first_trick_hearts_does_not_break(self):
+        """
+        A rejected heart on the first trick should not break hearts.
+        """
+        hands = [
+            ['h5', 's7', 'c2', 'h1', 'd2', 'c6', 'd3', 's2', 'd9', 'c5', 'd8', 'dq', 'c4'],
+            ['c10', 'h6', 'c3', 'h10', 'hk', 'ck', 'dk', 'h4', 'sj', 'hq', 'hj', 's5', 'd5'],
+            ['s6', 'c8', 'd1', 'sk', 's4', 'h7', 'd10', 'sq', 'c9', 'cq', 'c1', 'c7', 'cj'],
+            ['d4', 's10', 'h9', 'd7', 'h3', 'h8', 'dj', 's9', 's1', 'd6', 's3', 'h2', 's8']
+        ]
+
+        round = HeartsRound(hands)
+        round.play_card("c2")
+        round.play_card("c10")
+        round.play_card("c9")
+
+        try:
+            round.play_card("h9")
+            self.fail()
+        except m.InvalidMoveError:
+            pass
+
+        self.assertFalse(round.is_hearts_broken())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import gevent
+import gevent.queue as gq
+from mock import Mock
+
+import hearts.shard as s
+from hearts.game_backend import GameBackend
+from hearts.game_sockets import GameWebsocketHandler
+from hearts.queue_backend import PlayerUnregisteredError
+from hearts.services.player import PlayerExistsError
+from hearts.services.sqlite_player import SqlitePlayerService
+
+
+class FakeWebsocket(object):
+    def __init__(self):
+        self.incoming = gq.Queue()
+        self.sent = []
+
+    def receive(self):
+        return self.incoming.get()
+
+    def send(self, data, binary=False):
+        self.sent.append((data, binary))
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        listener = s.bind_unix_listener(s.get_coordinator_path(self.dir))
+        self.coordinator = s.ShardCoordinator(listener, 2)
+        self.coordinator.start()
+
+        self.backends = []
+        self.clients = []
+        for i in range(2):
+            self._start_shard(i, GameBackend(Mock()))
+
+        # let the hellos arrive
+        gevent.sleep(0.01)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop()
+        self.coordinator.stop()
+        shutil.rmtree(self.dir)
+
+    def _start_shard(self, shard_index, backend):
+        client = s.ShardClient(self.dir, shard_index, backend, Mock())
+        client.start(GameWebsocketHandler(Mock(), client, backend, client))
+        self.backends.append(backend)
+        self.clients.append(client)
+        return client
+
+    def _match(self, shards):
+        results = [self.clients[shard].register(player_id) for player_id, shard in enumerate(shards, 1)]
+        return [result.get(timeout=1) for result in results]
+
+    def test_game_created_where_most_players_are(self):
+        game_ids = self._match([1, 0, 1, 1])
+
+        self.assertEqual(1, len(set(game_ids)))
+        self.assertTrue(self.backends[1].is_in_game(1))
+        self.assertFalse(self.backends[0].is_in_game(2))
+
+        for client in self.clients:
+            for player_id in range(1, 5):
+                self.assertEqual(1, client.get_player_shard(player_id))
+
+    def test_game_ids_strided(self):
+        first_id = self._match([0, 0, 0, 0])[0]
+        second_id = self._match([1, 1, 1, 1])[0]
+
+        self.assertEqual(1, first_id)
+        self.assertEqual(2, second_id)
+
+    def test_unregister(self):
+        result = self.clients[0].register(1)
+        self.clients[0].unregister(1)
+
+        self.assertRaises(PlayerUnregisteredError, result.get)
+        self.assertFalse(self.clients[0].is_registered(1))
+
+        # the coordinator should have dropped the player too
+        gevent.sleep(0.01)
+        results = [self.clients[0].register(player_id) for player_id in range(2, 6)]
+        game_id = results[0].get(timeout=1)
+        self.assertEqual([2, 3, 4, 5], self.backends[0].get_games()[game_id])
+
+    def test_removed_game(self):
+        game_id = self._match([0, 0, 0, 0])[0]
+        self.backends[0].on_game_abandoned(game_id)
+        gevent.sleep(0.01)
+
+        for client in self.clients:
+            self.assertIsNone(client.get_player_shard(1))
+
+    def test_forward(self):
+        self._match([0, 0, 0, 1])
+        game_id, player_index = self.backends[0].try_get_game_info(4)
+        game_master = self.backends[0].get_game_master(game_id)
+
+        ws = FakeWebsocket()
+        forward = gevent.spawn(self.clients[1].forward, ws, 4, "Joe", s.wsutil.JSON_PROTOCOL)
+        gevent.sleep(0.01)
+
+        self.assertTrue(game_master.is_connected(player_index))
+        self.assertEqual("connected_to_game", json.loads(ws.sent[0][0])["type"])
+
+        ws.incoming.put(json.dumps({"type": "get_state", "command_id": 1}).decode("utf-8"))
+        gevent.sleep(0.01)
+        reply = json.loads(ws.sent[-1][0])
+        self.assertEqual("query_success", reply["type"])
+
+        # disconnecting the player's websocket disconnects them from the game
+        ws.incoming.put(None)
+        forward.join(timeout=1)
+        gevent.sleep(0.01)
+        self.assertFalse(game_master.is_connected(player_index))
+
+    def test_guest_routed_from_other_worker(self):
+        path = os.path.join(self.dir, "players.db")
+        services = []
+        for i in range(2):
+            services.append(SqlitePlayerService(path, first_id=i + 1, id_step=2, write_through=True))
+            self.addCleanup(services[i].close)
+
+        guest_id, token = services[0].create_guest_player("Joe")
+        results = [self.clients[0].register(player_id) for player_id in [guest_id, 10, 12, 14]]
+        results[0].get(timeout=1)
+        gevent.sleep(0.01)
+
+        # the guest reconnects, and lands on the other worker
+        handler = GameWebsocketHandler(services[1], self.clients[1], self.backends[1], self.clients[1])
+        ws = FakeWebsocket()
+        auth = handler._try_auth(ws, {"type": "auth", "command_id": 1, "name": "Joe", "password": token})
+
+        self.assertEqual(guest_id, auth[0])
+        self.assertTrue(handler._is_in_game(guest_id))
+        self.assertEqual(0, self.clients[1].get_player_shard(guest_id))
+
+        # and nobody else can take the name on either worker
+        self.assertRaises(PlayerExistsError, services[1].create_guest_player, "Joe")
+
+    def test_restored_games_announced(self):
+        backend = GameBackend(Mock())
+        backend.create_game([7, 8, 9, 10], game_id=3)
+
+        # a third worker, as if it had restored a game on startup
+        self.coordinator._shard_count = 3
+        self.coordinator._next_game_ids.append(3)
+        self._start_shard(2, backend)
+        gevent.sleep(0.01)
+
+        self.assertEqual(2, self.clients[0].get_player_shard(7))
+        self.assertEqual(6, self.coordinator._next_game_ids[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
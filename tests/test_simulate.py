@@ -0,0 +1,48 @@
+import unittest
+
+import hearts.simulate as sim
+
+
+class TestPlayGame(unittest.TestCase):
+    def test_game_completes(self):
+        result = sim.play_game(["random", "random", "random", "random"], 1234)
+
+        self.assertTrue(any(map(lambda x: x >= 100, result["scores"])))
+        self.assertEqual(result["rounds"] * 52, result["moves"])
+
+    def test_heuristic_players(self):
+        result = sim.play_game(["heuristic", "heuristic", "random", "random"], 99)
+
+        self.assertTrue(any(map(lambda x: x >= 100, result["scores"])))
+
+    def test_deterministic(self):
+        """
+        The same seed should always produce the same game.
+        """
+        players = ["heuristic", "random", "random", "random"]
+        first = sim.play_game(players, 42, record_moves=True)
+        second = sim.play_game(players, 42, record_moves=True)
+
+        self.assertEqual(first, second)
+
+    def test_record_moves(self):
+        result = sim.play_game(["random"] * 4, 7, record_moves=True)
+
+        history = result["history"]
+        self.assertEqual(result["rounds"], len(history))
+        for round_history in history:
+            self.assertEqual(52, len(round_history["plays"]))
+
+
+class TestRunGames(unittest.TestCase):
+    def test_summary(self):
+        results = sim.run_games(["random"] * 4, 5, seed=10)
+        summary = sim.summarize(results, 1.0)
+
+        self.assertEqual(5, summary["games"])
+        self.assertEqual(sum(r["moves"] for r in results), summary["moves"])
+        self.assertEqual(4, len(summary["seats"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
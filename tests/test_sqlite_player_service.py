@@ -0,0 +1,220 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import gevent
+
+import test_player_service
+
+from hearts.services.player import PlayerStateError, PlayerExistsError
+from hearts.services.sqlite_player import SqlitePlayerService
+
+
+class TestSqlitePlayerServiceInterface(test_player_service.TestPlayerService):
+    """
+    The SQLite service should behave just like the in-memory one.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.svc = SqlitePlayerService(os.path.join(self.dir, "players.db"))
+
+    def tearDown(self):
+        self.svc.close()
+        shutil.rmtree(self.dir)
+
+
+class TestSqlitePlayerService(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "players.db")
+        self.svc = SqlitePlayerService(self.path)
+
+    def tearDown(self):
+        self.svc.close()
+        shutil.rmtree(self.dir)
+
+    def _restart(self):
+        self.svc.close()
+        self.svc = SqlitePlayerService(self.path)
+
+    def test_players_survive_restart(self):
+        player_id = self.svc.create_player("Joe", "password")
+        self._restart()
+
+        self.assertEqual(player_id, self.svc.get_player_id("Joe"))
+        self.assertEqual({"id": player_id, "name": "Joe"}, self.svc.get_player(player_id))
+        self.assertTrue(self.svc.auth_player(player_id, "password"))
+        self.assertFalse(self.svc.auth_player(player_id, "asdf"))
+
+    def test_ids_continue_after_restart(self):
+        first_id = self.svc.create_player("Joe", "password")
+        self._restart()
+
+        second_id = self.svc.create_player("Bob", "password")
+        self.assertEqual(first_id + 1, second_id)
+
+    def test_id_step_after_restart(self):
+        self.svc.create_player("Joe", "password")
+        self.svc.create_player("Bob", "password")
+        self.svc.close()
+
+        # another worker's ids are 2, 4, ...
+        self.svc = SqlitePlayerService(self.path, first_id=2, id_step=2)
+        self.assertEqual(4, self.svc.create_player("Jim", "password"))
+
+    def test_duplicate_after_restart(self):
+        self.svc.create_player("Joe", "password")
+        self._restart()
+
+        self.assertRaises(PlayerStateError, self.svc.create_player, "Joe", "asdf")
+        self.assertRaises(PlayerStateError, self.svc.create_guest_player, "Joe")
+
+    def test_remove_keeps_registered_players(self):
+        player_id = self.svc.create_player("Joe", "password")
+
+        # not written yet, so it must stay cached
+        self.svc.remove_player(player_id)
+        self.assertEqual(player_id, self.svc.get_player_id("Joe"))
+
+        self.svc.flush()
+        self.svc.remove_player(player_id)
+        self.assertEqual(player_id, self.svc.get_player_id("Joe"))
+        self.assertTrue(self.svc.auth_player(player_id, "password"))
+
+    def test_guests_survive_restart(self):
+        player_id, token = self.svc.create_guest_player("Joe")
+        self._restart()
+
+        self.assertEqual(player_id, self.svc.get_player_id("Joe"))
+        self.assertTrue(self.svc.auth_player(player_id, token))
+        self.assertFalse(self.svc.auth_player(player_id, "asdf"))
+
+    def test_removed_guests_deleted(self):
+        player_id, token = self.svc.create_guest_player("Joe")
+        self.svc.flush()
+
+        self.svc.remove_player(player_id)
+        self.assertIsNone(self.svc.get_player_id("Joe"))
+
+        # the name is free again before the delete is written
+        new_id, _ = self.svc.create_guest_player("Joe")
+        self.svc.flush()
+
+        self._restart()
+        self.assertEqual(new_id, self.svc.get_player_id("Joe"))
+        self.assertIsNone(self.svc.get_player(player_id))
+
+    def test_guest_found_by_other_process(self):
+        player_id, token = self.svc.create_guest_player("Joe")
+        self.svc.flush()
+
+        other = SqlitePlayerService(self.path, first_id=2, id_step=2)
+        try:
+            self.assertEqual(player_id, other.get_player_id("Joe"))
+            self.assertTrue(other.auth_player(player_id, token))
+            self.assertRaises(PlayerExistsError, other.create_guest_player, "Joe")
+
+            # forgetting them leaves them for the process that removes them
+            other.forget_player(player_id)
+            other.flush()
+            self.assertEqual(player_id, other.get_player_id("Joe"))
+
+            other.remove_player(player_id)
+            other.flush()
+        finally:
+            other.close()
+
+        self.svc.forget_player(player_id)
+        self.assertIsNone(self.svc.get_player_id("Joe"))
+
+    def test_purge_guests(self):
+        kept, _ = self.svc.create_guest_player("Joe")
+        purged, _ = self.svc.create_guest_player("Bob")
+        registered = self.svc.create_player("Jim", "password")
+        self._restart()
+
+        self.assertEqual(1, self.svc.purge_guests([kept]))
+
+        self.assertEqual(kept, self.svc.get_player_id("Joe"))
+        self.assertIsNone(self.svc.get_player_id("Bob"))
+        self.assertIsNone(self.svc.get_player(purged))
+        self.assertEqual(registered, self.svc.get_player_id("Jim"))
+
+    def test_old_database(self):
+        self.svc.close()
+        os.remove(self.path)
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(
+                "CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, password_hash TEXT NOT NULL)")
+        conn.close()
+
+        self.svc = SqlitePlayerService(self.path)
+        player_id, token = self.svc.create_guest_player("Joe")
+        self._restart()
+
+        self.assertTrue(self.svc.auth_player(player_id, token))
+
+    def test_written_in_background(self):
+        self.svc.create_player("Joe", "password")
+
+        other = SqlitePlayerService(self.path)
+        try:
+            self.assertIsNone(other.get_player_id("Joe"))
+
+            gevent.sleep(self.svc._flush_interval * 2)
+            self.assertIsNotNone(other.get_player_id("Joe"))
+        finally:
+            other.close()
+
+
+    def test_name_taken_by_other_process(self):
+        # neither writes anything until told to
+        self.svc.close()
+        self.svc = SqlitePlayerService(self.path, flush_interval=60)
+        other = SqlitePlayerService(self.path, flush_interval=60, first_id=2, id_step=2)
+        try:
+            alice_id = self.svc.create_player("alice", "password")
+            other_alice_id = other.create_player("alice", "other password")
+            carol_id = other.create_player("carol", "password")
+
+            self.svc.flush()
+            other.flush()
+
+            # the second alice lost, but carol was still written
+            self.assertEqual(alice_id, other.get_player_id("alice"))
+            self.assertIsNone(other.get_player(other_alice_id))
+            self.assertTrue(other.auth_player(alice_id, "password"))
+            self.assertEqual({}, other._pending)
+        finally:
+            other.close()
+
+        self._restart()
+        self.assertEqual(carol_id, self.svc.get_player_id("carol"))
+
+    def test_write_through(self):
+        self.svc.close()
+        self.svc = SqlitePlayerService(self.path, flush_interval=60, write_through=True)
+        other = SqlitePlayerService(self.path, flush_interval=60, first_id=2, id_step=2, write_through=True)
+        try:
+            alice_id = self.svc.create_player("alice", "password")
+            self.assertEqual({}, self.svc._pending)
+            self.assertEqual(alice_id, other.get_player_id("alice"))
+
+            # as if other had checked the name before alice was written
+            other._usernames.clear()
+            other._players.clear()
+            with self.assertRaises(PlayerExistsError):
+                other._add_player("alice", password_hash="hash")
+
+            self.assertEqual(alice_id, other.get_player_id("alice"))
+            self.assertTrue(other.auth_player(alice_id, "password"))
+        finally:
+            other.close()
+
+if __name__ == '__main__':
+    unittest.main()
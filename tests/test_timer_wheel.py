@@ -0,0 +1,115 @@
+import unittest
+
+import gevent
+from mock import Mock
+
+from hearts.timer_wheel import TimerWheel
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=1, slots=8, clock=self.clock)
+
+    def tearDown(self):
+        self.wheel.stop()
+
+    def _advance_to(self, seconds):
+        self.clock.now = 1000.0 + seconds
+        return self.wheel.advance()
+
+    def test_fires_after_delay(self):
+        callback = Mock()
+        self.wheel.schedule(3, callback, "a", 1)
+
+        self._advance_to(2.5)
+        self.assertFalse(callback.called)
+
+        self._advance_to(3)
+        callback.assert_called_once_with("a", 1)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_never_early(self):
+        self.clock.now = 1000.5
+        callback = Mock()
+        self.wheel.schedule(1, callback)
+
+        self._advance_to(1.4)
+        self.assertFalse(callback.called)
+        self._advance_to(2)
+        self.assertTrue(callback.called)
+
+    def test_longer_than_one_turn(self):
+        callback = Mock()
+        self.wheel.schedule(20, callback)
+
+        self._advance_to(19)
+        self.assertFalse(callback.called)
+        self._advance_to(20)
+        self.assertTrue(callback.called)
+
+    def test_cancel(self):
+        callback = Mock()
+        timer = self.wheel.schedule(3, callback)
+        timer.cancel()
+        timer.cancel()
+
+        self.assertFalse(timer.is_pending())
+        self.assertEqual(0, len(self.wheel))
+        self._advance_to(10)
+        self.assertFalse(callback.called)
+
+    def test_fired_in_order(self):
+        fired = []
+        for i in range(3):
+            self.wheel.schedule(2, fired.append, i)
+        self.wheel.schedule(1, fired.append, "first")
+
+        self.assertEqual(4, self._advance_to(5))
+        self.assertEqual(["first", 0, 1, 2], fired)
+
+    def test_reschedule_from_callback(self):
+        fired = []
+
+        def callback():
+            fired.append(self.clock.now)
+            if len(fired) < 3:
+                self.wheel.schedule(1, callback)
+
+        self.wheel.schedule(1, callback)
+        for i in range(1, 5):
+            self._advance_to(i)
+
+        self.assertEqual([1001.0, 1002.0, 1003.0], fired)
+
+    def test_failing_callback(self):
+        callback = Mock()
+        self.wheel.schedule(1, Mock(side_effect=ValueError()))
+        self.wheel.schedule(1, callback)
+
+        self._advance_to(1)
+        self.assertTrue(callback.called)
+
+    def test_runs_in_background(self):
+        wheel = TimerWheel(tick=0.01)
+        callback = Mock()
+        wheel.schedule(0.02, callback)
+
+        gevent.sleep(0.1)
+        self.assertTrue(callback.called)
+
+        # nothing left, so the wheel stops turning
+        self.assertIsNone(wheel._greenlet)
+
+
+if __name__ == '__main__':
+    unittest.main()
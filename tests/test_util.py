@@ -46,6 +46,32 @@ class TestFindWinningIndex(unittest.TestCase):
         self.assertEqual(expected, u.find_winning_index(data))
 
 
+class TestIsCard(unittest.TestCase):
+    def test_cards(self):
+        for card in ["c2", "h10", "sq", "d1", "ck"]:
+            self.assertTrue(u.is_card(card))
+
+    def test_not_cards(self):
+        for identifier in ["c11", "x2", "", "h", None, 5, ["c2"]]:
+            self.assertFalse(u.is_card(identifier))
+
+
+class TestCardTables(unittest.TestCase):
+    def test_ranks(self):
+        self.assertEqual(2, u.CARD_RANKS["c2"])
+        self.assertEqual(10, u.CARD_RANKS["d10"])
+        self.assertEqual(11, u.CARD_RANKS["sj"])
+        self.assertEqual(13, u.CARD_RANKS["hk"])
+        self.assertEqual(14, u.CARD_RANKS["h1"])
+
+    def test_suits(self):
+        for card in u.DECK:
+            self.assertEqual(card[0], u.CARD_SUITS[card])
+
+    def test_total_points(self):
+        self.assertEqual(26, u.sum_points(u.DECK))
+
+
 class TestDealHands(unittest.TestCase):
     def test_no_duplicates(self):
         seen_cards = set()
@@ -67,6 +93,29 @@ class TestDealHands(unittest.TestCase):
             self.assertEqual(13, len(hand))
 
 
+class TestCardMasks(unittest.TestCase):
+    def test_cards_to_mask(self):
+        cards = ["c2", "sq", "h1", "dk"]
+        mask = u.cards_to_mask(cards)
+        self.assertEqual(4, u.popcount(mask))
+        for card in cards:
+            self.assertTrue(mask & u.card_to_bit(card))
+
+    def test_deck_mask(self):
+        self.assertEqual(u.FULL_DECK_MASK, u.cards_to_mask(u.DECK))
+        self.assertEqual(52, u.popcount(u.FULL_DECK_MASK))
+
+    def test_suit_masks(self):
+        for suit, mask in u.SUIT_MASKS.items():
+            self.assertEqual(13, u.popcount(mask))
+            for card in u.DECK:
+                self.assertEqual(u.get_suit(card) == suit, bool(mask & u.card_to_bit(card)))
+
+    def test_card_to_bit_not_card(self):
+        self.assertEqual(0, u.card_to_bit("x5"))
+        self.assertEqual(0, u.card_to_bit(["c2"]))
+
+
 class TestGetPassDirection(unittest.TestCase):
     def test_simple(self):
         self.assertEqual("left", u.get_pass_direction(1))
@@ -0,0 +1,96 @@
+import json
+import unittest
+
+import hearts.websocket_util as wsutil
+
+
+class FakeWebsocket(object):
+    def __init__(self, incoming=None):
+        self.sent = []
+        self.incoming = list(incoming or [])
+
+    def send(self, message, binary=False):
+        self.sent.append(message)
+        self.binary = binary
+
+    def receive(self):
+        if not self.incoming:
+            return None
+        return self.incoming.pop(0)
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_round_trip(self):
+        msg = {"type": "start_round", "round_number": 1, "hand": ["c2", "h10", "sq"]}
+        for codec in wsutil.get_available_codecs():
+            self.assertEqual(msg, codec.loads(codec.dumps(msg)), codec.name)
+
+    def test_output_is_standard_json(self):
+        msg = {"type": "player_connected", "index": 2, "player": "a/b"}
+        for codec in wsutil.get_available_codecs():
+            self.assertEqual(msg, json.loads(codec.dumps(msg)), codec.name)
+
+    def test_output_is_compact(self):
+        for codec in wsutil.get_available_codecs():
+            wire_str = codec.dumps({"command_id": 1, "cards": ["c2", "c3"]})
+            self.assertNotIn(" ", wire_str, codec.name)
+
+    def test_stdlib_always_available(self):
+        self.assertEqual("json", wsutil.select_codec("json").name)
+
+    def test_select_fastest(self):
+        fastest = wsutil.get_available_codecs()[0]
+        self.assertEqual(fastest.name, wsutil.select_codec().name)
+
+    def test_select_unknown(self):
+        self.assertRaises(ValueError, wsutil.select_codec, "asdf")
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_encode_event(self):
+        data = {"player": 1, "card": "h2"}
+        wire_str = wsutil.encode_event("play_card", data)
+
+        expected = {"type": "play_card", "player": 1, "card": "h2"}
+        self.assertEqual(expected, json.loads(wire_str))
+
+        # the caller's data should be left alone
+        self.assertEqual({"player": 1, "card": "h2"}, data)
+
+    def test_send_and_receive(self):
+        ws = FakeWebsocket()
+        wsutil.send_command_success(ws, 5, {"token": "abc"})
+
+        expected = {"type": "command_success", "command_id": 5, "token": "abc"}
+        self.assertEqual(expected, json.loads(ws.sent[0]))
+
+        ws = FakeWebsocket(ws.sent)
+        self.assertEqual(expected, wsutil.receive_ws_event(ws))
+        self.assertIsNone(wsutil.receive_ws_event(ws))
+
+    def test_encoded_query_success(self):
+        for protocol in wsutil.PROTOCOLS.itervalues():
+            ws = FakeWebsocket()
+            encoded = protocol.encode_value({"hand": ["c2"], "state": "playing"})
+            wsutil.send_encoded_query_success(ws, 9, encoded, protocol)
+
+            expected = {"type": "query_success", "command_id": 9, "data": {"hand": ["c2"], "state": "playing"}}
+            ws = FakeWebsocket(ws.sent)
+            self.assertEqual(expected, wsutil.receive_ws_event(ws, protocol), protocol.name)
+
+    def test_binary_protocol(self):
+        protocol = wsutil.PROTOCOLS["binary"]
+
+        ws = FakeWebsocket()
+        wsutil.send_query_success(ws, 5, ["c2", "c3"], protocol)
+        self.assertTrue(ws.binary)
+
+        expected = {"type": "query_success", "command_id": 5, "data": ["c2", "c3"]}
+        ws = FakeWebsocket(ws.sent)
+        self.assertEqual(expected, wsutil.receive_ws_event(ws, protocol))
+
+
+if __name__ == '__main__':
+    unittest.main()